@@ -1,3 +1,10 @@
-﻿from .poseviewer import *
+﻿# The GUI is only imported when it is used, so the headless parts (python -m poseviewer) work without it.
+
+
+def run():
+    from .poseviewer import run
+    run()
+
+
 # settings = Settings(QSettings.IniFormat, QSettings.UserScope, "Mare5", "Poseviewer")
 
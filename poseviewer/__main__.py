@@ -0,0 +1,165 @@
+"""
+Headless command line for preparing libraries and caches without starting the GUI.
+
+    python -m poseviewer                         start the GUI
+    python -m poseviewer scan PATH...            index image folders (and read image headers with --metadata)
+    python -m poseviewer thumbs PATH...          generate the thumbnails of folders
+    python -m poseviewer plan                    print the plan of the saved slideshow settings
+    python -m poseviewer bench [ARGS...]         run the benchmarks (see poseviewer.benchmarks)
+
+Caches are written where the GUI looks for them, next to its settings file.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+
+def print_progress(done, total, start):
+    secs = time.perf_counter() - start
+    print("\r  {}/{} ({:.0f}/s)".format(done, total, done / secs if secs else 0), end="", flush=True)
+
+
+def command_scan(args):
+    from .imageloader import DirectoryScanner
+    from .libraryindex import LibraryIndex
+    from .imagemetadata import MetadataCache
+    from .settingscache import settings_sibling
+
+    start = time.perf_counter()
+    if args.no_index:
+        scanner = DirectoryScanner(max_depth=args.depth)
+    else:
+        scanner = LibraryIndex(settings_sibling("-library.db")).scanner(max_depth=args.depth)
+    paths = list(scanner.scan(args.paths))
+    print("Found {} images in {:.2f} s.".format(len(paths), time.perf_counter() - start))
+
+    if args.metadata:
+        cache = MetadataCache(settings_sibling("-library.db"))
+        start = time.perf_counter()
+        done = 0
+        for future in cache.probe_async(paths, lambda results: None):
+            future.result()
+            done = min(done + cache.PROBE_CHUNK, len(paths))
+            print_progress(done, len(paths), start)
+        cache.save()
+        print("\nRead {} image headers.".format(len(paths)))
+
+
+def command_thumbs(args):
+    from PySide.QtCore import QSize
+    from .imageloader import DirectoryScanner
+    from .thumbnails import ThumbnailStore, make_thumbnail, thumbnail_size, init_worker
+    from .settingscache import settings_sibling
+
+    store = ThumbnailStore(settings_sibling("-thumbnails"))
+    side = thumbnail_size(QSize(args.size, args.size))
+    paths = [path for path in DirectoryScanner(max_depth=None if args.recursive else 0).scan(args.paths)
+             if store.get(path, side) is None]
+    print("Generating {} thumbnails of {} px.".format(len(paths), side))
+
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+        for done, (path, (size, mtime, data)) in enumerate(zip(paths, pool.map(make_thumbnail, paths, [side] * len(paths),
+                                                                             chunksize=16)), 1):
+            if data:
+                store.put(path, side, size, mtime, data)
+            else:
+                failed += 1
+            if done % 500 == 0:
+                store.save()
+            print_progress(done, len(paths), start)
+    store.save()
+    store.close()
+    print("\nDone{}.".format(", {} images could not be read".format(failed) if failed else ""))
+
+
+def command_plan(args):
+    from PySide.QtCore import QTime
+    from .corewidgets import Settings, secs_from_qtime, format_secs
+    from . import slideshowplan
+
+    settings = Settings()
+    with settings.in_group('settings_ui'):
+        preset = settings.get_int('selected_preset', 0) if args.preset is None else args.preset
+        base_speed = secs_from_qtime(settings.value('base_speed', QTime(0, 0, 30)))
+        total_random_time = secs_from_qtime(settings.value('total_random_time_edit', QTime(0, 20, 0)))
+        with settings.in_group('interval_settings'):
+            increment_interval = settings.get_int('increment_interval', 0)
+        with settings.in_group('random_time_table'):
+            times = [secs_from_qtime(QTime.fromString(settings.value(str(row)), "hh:mm:ss"))
+                     for row in range(settings.get_int('rows', 0))]
+        with settings.in_group('images_time_table'):
+            rows = []
+            for row in range(settings.get_int('rows', 0)):
+                images, secs = settings.value(str(row))
+                rows.append((int(images), secs_from_qtime(QTime.fromString(secs, "hh:mm:ss"))))
+
+    if preset == slideshowplan.INCREMENTAL:
+        plan = slideshowplan.incremental_plan(base_speed, increment_interval)
+    elif preset == slideshowplan.RANDOM_TIME:
+        plan = slideshowplan.random_time_plan(times, total_random_time, random.Random(args.seed))
+    elif preset == slideshowplan.IMAGES_TIME:
+        plan = slideshowplan.images_time_plan(rows)
+    else:
+        plan = slideshowplan.fixed_plan(base_speed, args.images)
+
+    print("Preset {}: {} images, {}".format(preset, len(plan), format_secs(sum(plan))))
+    for images, secs in slideshowplan.group_plan(plan):
+        print("  {:>4} x {}".format(images, format_secs(secs)))
+
+
+def command_bench(args):
+    from . import benchmarks
+    benchmarks.main(args.args)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m poseviewer", description="Poseviewer without the GUI.")
+    commands = parser.add_subparsers(dest="command")
+
+    scan = commands.add_parser("scan", help="index image folders")
+    scan.add_argument("paths", nargs="+")
+    scan.add_argument("--depth", type=int, default=None, help="subdirectory levels to descend into (default: all)")
+    scan.add_argument("--no-index", action="store_true", help="scan without reading or updating the library index")
+    scan.add_argument("--metadata", action="store_true", help="also cache the dimensions and formats of the images")
+    scan.set_defaults(func=command_scan, qt=False)
+
+    thumbs = commands.add_parser("thumbs", help="generate thumbnails")
+    thumbs.add_argument("paths", nargs="+")
+    thumbs.add_argument("--size", type=int, default=256, help="longer side of the thumbnails in pixels")
+    thumbs.add_argument("--recursive", action="store_true", help="include subdirectories")
+    thumbs.add_argument("--workers", type=int, default=os.cpu_count())
+    thumbs.set_defaults(func=command_thumbs)
+
+    plan = commands.add_parser("plan", help="print the slideshow of the saved settings")
+    plan.add_argument("--preset", type=int, default=None, help="preset to plan instead of the selected one")
+    plan.add_argument("--images", type=int, default=20, help="images to plan for slideshows without an end")
+    plan.add_argument("--seed", type=int, default=None, help="seed of random slideshows")
+    plan.set_defaults(func=command_plan, qt=False)
+
+    bench = commands.add_parser("bench", help="run the benchmarks")
+    bench.add_argument("args", nargs=argparse.REMAINDER)
+    bench.set_defaults(func=command_bench, qt=False)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.command is None:
+        from . import run
+        return run()
+
+    if getattr(args, "qt", True):
+        from PySide.QtCore import QCoreApplication  # no display needed, unlike a QApplication
+        _app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])  # for QSettings and the image plugins
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""
+Benchmarks for the parts of poseviewer that have to keep up with large image libraries.
+
+    python -m poseviewer.benchmarks [root]
+    python -m poseviewer.benchmarks decode [image dir]
+    python -m poseviewer.benchmarks transport
+    python -m poseviewer.benchmarks sequence [paths]
+
+Without a root a synthetic tree of 100k empty image files is generated in a temporary directory.
+Without an image dir the decoding benchmark generates large JPEGs to decode, with the in-process threads and
+with the DecodeFarm. The transport benchmark compares handing decoded frames from worker processes to this one
+through SharedBuffers and as pickled bytes (the part of the DecodeFarm that doesn't need Qt).
+The sequence benchmark compares a list of 1M synthetic paths (or as many as given) to a CompactSequence
+and shuffles and sorts them as copies and as permutations.
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from .imageloader import DirectoryScanner, is_supported_image
+from .libraryindex import LibraryIndex
+from .sequence import CompactSequence, list_nbytes, shuffle_order, unshuffle_order
+from .sorting import SequenceSorter, NAME, FOLDER
+from .sharedbuffers import BufferPool, write_buffer
+
+
+def make_synthetic_tree(root, files=100000, files_per_dir=500, dirs_per_level=10):
+    """
+    Create a directory tree of empty image files. Directories are nested dirs_per_level wide
+    so the tree resembles a library sorted into folders and subfolders.
+    Return the number of files created.
+    """
+    created = 0
+    dir_index = 0
+    while created < files:
+        parts = []
+        n = dir_index
+        while True:
+            n, rest = divmod(n, dirs_per_level)
+            parts.append("dir{}".format(rest))
+            if n == 0:
+                break
+        dir_path = os.path.join(root, *reversed(parts))
+        os.makedirs(dir_path, exist_ok=True)
+
+        for i in range(min(files_per_dir, files - created)):
+            open(os.path.join(dir_path, "img{:06d}.jpg".format(created)), "wb").close()
+            created += 1
+        dir_index += 1
+    return created
+
+
+def listdir_scan(root):
+    """The old loader: os.listdir on every directory and a linear membership test."""
+    sequence = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        for name in file_names:
+            path = os.path.join(dir_path, name)
+            if is_supported_image(path) and path not in sequence:
+                sequence.append(path)
+    return sequence
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_scan(root, baseline=True):
+    """Return [(name, files found, seconds, files/second)] for every scanning strategy."""
+    results = []
+    strategies = [("DirectoryScanner", lambda path: list(DirectoryScanner().scan(path))),
+                  ("DirectoryScanner (1 worker)", lambda path: list(DirectoryScanner(workers=1).scan(path)))]
+    if baseline:
+        strategies.append(("os.listdir + list", listdir_scan))
+
+    for name, func in strategies:
+        found, secs = timed(func, root)
+        results.append((name, len(found), secs, len(found) / secs if secs else 0))
+    return results
+
+
+def bench_index(root):
+    """Cold (empty index) versus warm (unchanged library) open of root through a LibraryIndex."""
+    results = []
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = LibraryIndex(os.path.join(index_dir, "library.db"))
+        for name in ("LibraryIndex cold", "LibraryIndex warm"):
+            found, secs = timed(lambda path: list(index.scan(path)), root)
+            results.append((name, len(found), secs, len(found) / secs if secs else 0))
+    return results
+
+
+def make_synthetic_images(root, count=48, width=4000, height=3000):
+    """Write count JPEGs with gradients (which don't compress to nothing) and return their paths."""
+    from PySide.QtCore import QPointF  # PySide is only needed by the decoding benchmark
+    from PySide.QtGui import QImage, QPainter, QLinearGradient, QColor
+
+    paths = []
+    os.makedirs(root, exist_ok=True)
+    for i in range(count):
+        image = QImage(width, height, QImage.Format_RGB32)
+        gradient = QLinearGradient(QPointF(0, 0), QPointF(width, height))
+        gradient.setColorAt(0, QColor.fromHsv(i * 7 % 360, 200, 250))
+        gradient.setColorAt(1, QColor.fromHsv(i * 13 % 360, 120, 60))
+        painter = QPainter(image)
+        painter.fillRect(image.rect(), gradient)
+        painter.end()
+        path = os.path.join(root, "img{:03d}.jpg".format(i))
+        image.save(path, "JPG", 90)
+        paths.append(path)
+    return paths
+
+
+def bench_decode(paths, width=1920, height=1080):
+    """Return [(name, images decoded, seconds, images/second)] for the in-process threads and the DecodeFarm."""
+    from PySide.QtCore import QSize
+    from .imagedecoder import ImageDecoder, decode_image
+    from .decodefarm import DecodeFarm
+
+    size = QSize(width, height)
+    results = []
+
+    def decode_all(decode, workers):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return [image for image, source_size in pool.map(lambda path: decode(path, size), paths)]
+
+    threads = ImageDecoder.WORKERS + ImageDecoder.PREFETCH_WORKERS
+    images, secs = timed(decode_all, decode_image, threads)
+    results.append(("threads ({})".format(threads), len(images), secs, len(images) / secs if secs else 0))
+
+    farm = DecodeFarm()
+    try:
+        decode_all(farm.decode, farm.workers)  # start the worker processes and allocate the buffers
+        images, secs = timed(decode_all, farm.decode, farm.workers)
+        results.append(("DecodeFarm ({} processes)".format(farm.workers), len(images), secs,
+                        len(images) / secs if secs else 0))
+    finally:
+        farm.shutdown()
+    return results
+
+
+def _frame(size):
+    return bytes(size)
+
+
+def _frame_into(path, size):
+    write_buffer(path, bytes(size))
+
+
+def bench_transport(count=500, width=1920, height=1080, workers=os.cpu_count() or 2):
+    """Return [(name, frames, seconds, frames/second)] for getting count frames from worker processes."""
+    size = width * height * 4
+    results = []
+    pool = BufferPool(budget=2 * workers * size)
+
+    def shared(i):
+        buffer = pool.acquire(size)
+        processes.submit(_frame_into, buffer.path, size).result()
+        frame = bytes(buffer.view(size)[:1])  # what a QImage reads from
+        pool.release(buffer)
+        return frame
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as processes, ThreadPoolExecutor(max_workers=workers) as threads:
+            for name, func in (("pickled bytes", lambda i: processes.submit(_frame, size).result()[:1]),
+                               ("SharedBuffer", shared)):
+                list(threads.map(func, range(workers)))  # start the processes and allocate the buffers
+                frames, secs = timed(lambda: list(threads.map(func, range(count))))
+                results.append((name, len(frames), secs, len(frames) / secs if secs else 0))
+    finally:
+        pool.close()
+    return results
+
+
+def bench_sequence(count=1000000, files_per_dir=500):
+    """Return [(name, megabytes, seconds to build, seconds for 1000 lookups)] for a list and a CompactSequence."""
+    paths = [os.path.join(os.sep, "library", "folder{:05d}".format(i // files_per_dir), "img{:07d}.jpg".format(i))
+             for i in range(count)]
+    lookups = paths[::max(count // 1000, 1)][:1000]
+    results = []
+
+    sequence, build_secs = timed(list, paths)
+    hits, lookup_secs = timed(lambda: [sequence.index(path) for path in lookups[:10]])  # linear, 10 is plenty
+    results.append(("list", list_nbytes(sequence) / 2 ** 20, build_secs, lookup_secs * 100))
+
+    sequence, build_secs = timed(CompactSequence, paths)
+    sequence.find(paths[0])  # builds the lookup index
+    hits, lookup_secs = timed(lambda: [sequence.index(path) for path in lookups])
+    results.append(("CompactSequence", sequence.nbytes() / 2 ** 20, build_secs, lookup_secs))
+    return results
+
+
+def bench_shuffle(count=1000000):
+    """Return [(name, seconds)] for shuffling count paths and undoing it, as copies and as permutations."""
+    paths = ["img{:07d}.jpg".format(i) for i in range(count)]
+    results = []
+    shuffled, secs = timed(random.sample, paths, count)
+    results.append(("random.sample copy", secs))
+    step = (random.getrandbits(63), 0, count)
+    order, secs = timed(shuffle_order, array('I'), *step)
+    results.append(("permutation shuffle", secs))
+    order, secs = timed(unshuffle_order, order, *step)
+    results.append(("permutation undo", secs))
+    return results
+
+
+def bench_sort(count=1000000, batch=512):
+    """Return [(name, seconds)] for sorting count paths by folder and name, again from the kept keys, and while loading."""
+    paths = [os.path.join(os.sep, "library", "folder{}".format(random.randrange(count // 500 + 1)),
+                          "img{}.jpg".format(random.randrange(count))) for i in range(count)]
+    base = CompactSequence(paths)
+    results = [("sorted() of a list (plain str order)", timed(sorted, paths)[1])]
+    for kind in (FOLDER, NAME):
+        sorter = SequenceSorter(kind)
+        sorter.set_sequence(base)
+        order, secs = timed(sorter.sort)
+        results.append(("sort by {}".format(kind), secs))
+        results.append(("sort by {} again".format(kind), timed(sorter.sort)[1]))
+        base.extend(paths[:batch])
+        results.append(("insert {} by {}".format(batch, kind), timed(sorter.insert, order, range(count, count + batch))[1]))
+        base = CompactSequence(paths)
+    return results
+
+
+def print_results(title, results, unit="files"):
+    print(title)
+    for name, files, secs, rate in results:
+        print("  {:<30} {:>8} {} {:>9.3f} s {:>12.0f} {}/s".format(name, files, unit, secs, rate, unit))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["sequence"]:
+        count = int(argv[1]) if len(argv) > 1 else 1000000
+        print("Sequence of {} paths".format(count))
+        for name, megabytes, build_secs, lookup_secs in bench_sequence(count):
+            print("  {:<30} {:>8.1f} MB {:>9.3f} s to build {:>9.3f} s per 1000 lookups".format(
+                name, megabytes, build_secs, lookup_secs))
+        for name, secs in bench_shuffle(count) + bench_sort(count):
+            print("  {:<30} {:>9.3f} s".format(name, secs))
+        return
+    if argv[:1] == ["transport"]:
+        print_results("Frames of 1920x1080 from worker processes", bench_transport(), unit="frames")
+        return
+    if argv[:1] == ["decode"]:
+        with tempfile.TemporaryDirectory() as root:
+            paths = sorted(DirectoryScanner().scan(argv[1])) if len(argv) > 1 else make_synthetic_images(root)
+            print_results("Decoding {} images at 1920x1080".format(len(paths)), bench_decode(paths), unit="images")
+        return
+
+    if argv:
+        print_results("Scanning {}".format(argv[0]), bench_scan(argv[0]) + bench_index(argv[0]))
+        return
+
+    with tempfile.TemporaryDirectory() as root:
+        files = make_synthetic_tree(os.path.join(root, "large"))
+        # the quadratic baseline takes minutes on 100k files, so it gets a smaller tree of its own
+        print_results("Scanning synthetic tree ({} files)".format(files),
+                      bench_scan(os.path.join(root, "large"), baseline=False) + bench_index(os.path.join(root, "large")))
+        files = make_synthetic_tree(os.path.join(root, "small"), files=10000)
+        print_results("Scanning synthetic tree ({} files)".format(files), bench_scan(os.path.join(root, "small")))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,24 @@ from PySide.QtCore import *
 from PySide.QtGui import *
 import os
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_right
+from itertools import chain
+from array import array
 from contextlib import contextmanager
 from .imageloader import *
+from .libraryindex import LibraryIndex
+from .folderwatcher import FolderWatcher
+from .imagemetadata import MetadataCache
+from .sequence import CompactSequence, PermutedSequence, shuffle_order, unshuffle_order, inverse_permutation
+from .sampling import ImageSampler
+from .sorting import SequenceSorter
+from .session import Session, write_snapshot
+from .stars import StarStore
+from .settingscache import SettingsCache, settings_file_path, settings_sibling
+from .tags import TagStore
+from .decodefarm import DecodeFarm
 
 
 ICON_ROOT = ":/Icons/Icons/{}"
@@ -37,9 +53,120 @@ def secs_from_qtime(qtime):
     return (qtime.hour() * 3600) + (qtime.minute() * 60) + qtime.second() + (qtime.msec() / 1000)
 
 
-class Settings(QSettings):
-    def __init__(self, *args, **kwargs):
-        super().__init__(QSettings.IniFormat, QSettings.UserScope, "Mare5", "Poseviewer")
+class SettingsService(QObject):
+    """
+    The settings INI file, read once into a SettingsCache that every Settings shares (see shared_settings).
+    Changes are written together FLUSH_DELAY ms after the last one and when the application quits.
+    changed is emitted for every changed key (with None for the removed ones), in the thread that changed it.
+    """
+
+    FLUSH_DELAY = 1000
+
+    changed = Signal(str, object)
+    _dirty = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.qsettings = QSettings(settings_file_path(), QSettings.IniFormat)
+        self.file_name = self.qsettings.fileName()
+        self.cache = SettingsCache({key: self.qsettings.value(key) for key in self.qsettings.allKeys()},
+                                   on_change=self._changed)
+        self.lock = threading.Lock()
+
+        self.flush_timer = QTimer(self, singleShot=True, interval=self.FLUSH_DELAY)
+        self.flush_timer.timeout.connect(self.flush)
+        self._dirty.connect(self.flush_timer.start, Qt.QueuedConnection)  # the timer lives in the GUI thread
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.flush)
+
+    def _changed(self, changes):
+        for key, value in changes.items():
+            self.changed.emit(key, value)
+        self._dirty.emit()
+
+    def flush(self):
+        """Write the pending changes to the INI file now."""
+        with self.lock:
+            values, removed = self.cache.take_changes()
+            if not values and not removed:
+                return
+            for key in removed:
+                self.qsettings.remove(key)
+            for key, value in values.items():
+                self.qsettings.setValue(key, value)
+            self.qsettings.sync()
+
+
+_settings_service = None
+_settings_lock = threading.Lock()
+
+
+def shared_settings():
+    """The SettingsService of the application, made on first use (from any thread)."""
+    global _settings_service
+    with _settings_lock:
+        if _settings_service is None:
+            service = SettingsService()
+            app = QCoreApplication.instance()
+            if app is not None:
+                service.moveToThread(app.thread())
+            _settings_service = service
+    return _settings_service
+
+
+class Settings:
+    """
+    A view of the shared settings with the QSettings methods used around the app and typed getters.
+    Making one costs nothing (the INI file is only read once) and the group it is in is its own, so
+    workers can read the settings at any time without touching QSettings.
+    """
+
+    def __init__(self, group=''):
+        self.service = shared_settings()
+        self.cache = self.service.cache
+        self.group = group
+
+    def key(self, key):
+        """The full key of key in the current group."""
+        return self.group + '/' + key if self.group else key
+
+    def fileName(self):
+        return self.service.file_name
+
+    def contains(self, key):
+        return self.key(key) in self.cache
+
+    def value(self, key, default=None):
+        return self.cache.value(self.key(key), default)
+
+    def get_int(self, key, default=0):
+        return self.cache.get_int(self.key(key), default)
+
+    def get_float(self, key, default=0.0):
+        return self.cache.get_float(self.key(key), default)
+
+    def get_bool(self, key, default=False):
+        return self.cache.get_bool(self.key(key), default)
+
+    def get_str(self, key, default=''):
+        return self.cache.get_str(self.key(key), default)
+
+    def get_list(self, key, default=()):
+        return self.cache.get_list(self.key(key), default)
+
+    def setValue(self, key, value):
+        self.cache.set_value(self.key(key), value)
+
+    def remove(self, key):
+        self.cache.remove(self.key(key))
+
+    def childKeys(self):
+        return self.cache.child_keys(self.group)
+
+    def sync(self):
+        self.service.flush()
 
     def __getitem__(self, key):
         return self.value(key)
@@ -49,26 +176,232 @@ class Settings(QSettings):
 
     @contextmanager
     def in_group(self, group):
-        self.beginGroup(group)
-        yield
-        self.endGroup()
-
-    def set_values(self, values, group=''):
+        previous = self.group
+        self.group = self.key(group) if group else previous
+        try:
+            yield
+        finally:
+            self.group = previous
+
+    def set_values(self, values, group='', replace=False):
+        """Set all of values at once. With replace, the other keys directly in the group are removed."""
         with self.in_group(group):
-            for key, value in values.items():
-                self.setValue(key, value)
+            if replace:
+                self.cache.replace_group(self.group, values)
+            else:
+                self.cache.set_values({self.key(key): value for key, value in values.items()})
 
     def get_values(self, *values, group=''):
         with self.in_group(group):
             return {key: self.value(key) for key in values}
 
 
+def library_scanner():
+    return LibraryIndex(settings_sibling("-library.db")).scanner()
+
+
+_decode_farm = None
+
+
+def shared_decode_farm():
+    """The DecodeFarm shared by the image canvases if the decode_backend setting is 'processes', otherwise None."""
+    global _decode_farm
+    if _decode_farm is None and Settings().get_str('decode_backend', 'threads') == 'processes':
+        _decode_farm = DecodeFarm()
+    return _decode_farm
+
+
+def shutdown_decode_farm():
+    if _decode_farm is not None:
+        _decode_farm.shutdown()
+
+
+_star_saver = None
+
+
+def shared_star_store():
+    """
+    The StarStore of the application, loaded on first use. The first time, the stars are moved there from
+    the 'stars' settings value.
+    """
+    global _star_saver
+    if _star_saver is None:
+        store = StarStore(settings_sibling("-stars.txt"))
+        if not store.load():
+            settings = Settings()
+            store.star(settings.get_list('stars'))
+            store.save()
+            settings.remove('stars')
+        _star_saver = StarSaver(store, QApplication.instance())
+    return _star_saver.store
+
+
+def flush_star_store():
+    if _star_saver is not None:
+        _star_saver.flush()
+
+
+_tag_store = None
+
+
+def shared_tag_store():
+    """The TagStore of the application. Its 'starred' term queries the stars of shared_star_store()."""
+    global _tag_store
+    if _tag_store is None:
+        _tag_store = TagStore(settings_sibling("-tags.db"), starred=shared_star_store)
+    return _tag_store
+
+
+def flush_tag_store():
+    if _tag_store is not None:
+        _tag_store.flush()
+
+
+class StarSaver(QObject):
+    """Save a StarStore SAVE_DELAY ms after its last change (write-behind), in a worker thread."""
+
+    SAVE_DELAY = 1000
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.save_timer = QTimer(self, singleShot=True, interval=self.SAVE_DELAY)
+        self.save_timer.timeout.connect(self.save)
+        store.on_change = self.save_timer.start
+
+    def save(self):
+        if self.store.dirty:
+            self.executor.submit(self.store.write, self.store.encode())
+
+    def flush(self):
+        """Save pending changes now and wait for them to be written."""
+        self.save_timer.stop()
+        self.save()
+        self.executor.shutdown()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+
+class ImageLoader(QObject):
+    """
+    Load image paths in a background ImageLoaderThread and stream them back to the GUI thread.
+
+    batchLoaded carries a list of new paths, progress the number of paths loaded so far.
+    Batches of a load that was cancelled or replaced by a newer load are dropped.
+    """
+
+    IDLE, LOADING, FINISHED, CANCELLED = range(4)
+
+    batchLoaded = Signal(list)
+    progress = Signal(int)
+    finished = Signal()
+    cancelled = Signal()
+
+    _batchReady = Signal(int, list, int)
+    _loadingDone = Signal(int, bool)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.state = self.IDLE
+        self.generation = 0
+        self.image_loader_thread = ImageLoaderThread()
+
+        # emitted from the loader thread, delivered in the thread of this object
+        self._batchReady.connect(self.handle_batch, Qt.QueuedConnection)
+        self._loadingDone.connect(self.handle_done, Qt.QueuedConnection)
+
+    def load(self, paths, scanner=None):
+        self.cancel()
+
+        self.generation += 1
+        generation = self.generation
+        self.image_loader_thread = ImageLoaderThread(dir_path=paths, scanner=scanner or library_scanner(), daemon=True,
+                                                     on_batch=lambda batch, total: self._batchReady.emit(generation, batch, total),
+                                                     on_finished=lambda cancelled: self._loadingDone.emit(generation, cancelled))
+        self.state = self.LOADING
+        self.image_loader_thread.start()
+
+    def cancel(self):
+        """Stop loading without waiting for the loader thread to finish."""
+        if self.state == self.LOADING:
+            self.image_loader_thread.stop()
+            self.generation += 1
+            self.state = self.CANCELLED
+            QTimer.singleShot(0, self.cancelled.emit)
+
+    def is_loading(self):
+        return self.state == self.LOADING
+
+    def handle_batch(self, generation, batch, total):
+        if generation == self.generation:
+            self.batchLoaded.emit(batch)
+            self.progress.emit(total)
+
+    def handle_done(self, generation, cancelled):
+        if generation == self.generation and self.state == self.LOADING:
+            self.state = self.CANCELLED if cancelled else self.FINISHED
+            if cancelled:
+                self.cancelled.emit()
+            else:
+                self.finished.emit()
+
+
+class MetadataProbe(QObject):
+    """
+    Read image headers in a worker pool and deliver the results in the GUI thread.
+    Results are cached in the library index database, so each file's header is read only once.
+    metadataReady carries a list of (path, ImageMetadata or None).
+    """
+
+    metadataReady = Signal(list)
+
+    _chunkReady = Signal(int, list)
+
+    SAVE_DELAY = 2000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.cache = MetadataCache(settings_sibling("-library.db"))
+        self.generation = 0
+        self._chunkReady.connect(self.handle_chunk, Qt.QueuedConnection)
+
+        self.save_timer = QTimer(self, singleShot=True, interval=self.SAVE_DELAY)
+        self.save_timer.timeout.connect(lambda: self.cache.executor.submit(self.cache.save))
+
+    def probe(self, paths):
+        generation = self.generation
+        self.cache.probe_async(list(paths), lambda results: self._chunkReady.emit(generation, results))
+
+    def cancel(self):
+        self.generation += 1
+        self.cache.cancel()
+
+    def get(self, path):
+        return self.cache.get(path)
+
+    def file_stat(self, path):
+        return self.cache.file_stat(path)
+
+    def handle_chunk(self, generation, results):
+        if generation == self.generation:
+            self.metadataReady.emit(results)
+            self.save_timer.start()
+
+
 class ImagePath(QObject):
     imageChanged = Signal(str)
     sequenceChanged = Signal()
+    sequenceExtended = Signal(list)
+
+    _sortKeysRead = Signal(object, str, int, object)
 
     UNDO_SHUFFLE_LIMIT = 10
     UNDO_RANDOM_LIMIT = 50
+    PREFETCH_DISTANCE = 3
+    MERGE_INTERVAL = 500  # ms between sorting loaded images in
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -77,13 +410,37 @@ class ImagePath(QObject):
         self.undo_random_index = -1
         self.undo_shuffle_index = -1
         self.previous_random_storage = []
-        self.previous_shuffle_storage = []
-        self._sequence = []
+        self.previous_shuffle_storage = []  # (base sequence, shuffle steps, current index)
+        self.shuffle_steps = ()  # the (seed, start, length) shuffles and sorts that made the order of the sequence
+        self.sort_order = None  # one of sorting.SORT_ORDERS, None for the order the images were found in
+        self.sort_permutation = None  # the order of the last sort
+        self.next_random = None
+        self._sequence = PermutedSequence()
+        self.sampler = ImageSampler(self._sequence.base)  # random picks
         self.current_image_path = ""
+        self.root_dirs = []
 
-        self.image_loader_thread = ImageLoaderThread(sequence=self._sequence)
+        self.loader = ImageLoader(self)
+        self.loader.batchLoaded.connect(self.extend_sequence)
+        self.loader.finished.connect(self.loading_finished)
+
+        self.metadata_probe = MetadataProbe(self)
+        self.sorter = SequenceSorter(metadata=self.metadata_probe.get, stat=self.metadata_probe.file_stat)
+        self.sort_keys_executor = ThreadPoolExecutor(max_workers=1)
+        self.reading_sort_keys = False
+        self.after_sort_keys = []  # what to do once the keys being read are in (see with_sort_keys)
+        self._sortKeysRead.connect(self.handle_sort_keys, Qt.QueuedConnection)
+
+        self.merge_timer = QTimer(self, singleShot=True, interval=self.MERGE_INTERVAL)
+        self.merge_timer.timeout.connect(lambda: self.with_sort_keys(self.merge_loaded))
+
+        self.watching = False
+        self.folder_watcher = FolderWatcher(self)
+        self.folder_watcher.sequenceDiff.connect(self.apply_diff)
 
     def next(self):
+        if not self._sequence:  # nothing was found, keep showing the last image
+            return
         if self.current_index + 1 >= len(self.sequence):  # if we go through all files go back to start
             self.current_index = 0
         else:
@@ -92,6 +449,8 @@ class ImagePath(QObject):
         self.current = self.sequence[self.current_index]
 
     def prev(self):
+        if not self._sequence:
+            return
         if not abs(self.current_index) + 1 >= len(self.sequence):
             self.current_index -= 1
         else:
@@ -99,32 +458,171 @@ class ImagePath(QObject):
 
         self.current = self.sequence[self.current_index]
 
-    def shuffle(self):
+    def shuffle(self, remaining=False, weighted=False):
+        """
+        Shuffle the sequence, or with remaining only the images after the current one. Weighted shuffles
+        put starred images and images of small folders first on average (see ImageSampler.permutation).
+        Only a permutation of the sequence is stored; undoing it needs nothing but its seed.
+        """
         if len(self.previous_shuffle_storage) > self.UNDO_SHUFFLE_LIMIT:
             self.previous_shuffle_storage.pop(0)
-        self.previous_shuffle_storage.append((self.sequence, self.current_index))
+        self.previous_shuffle_storage.append((self._sequence.base, self.shuffle_steps, self.current_index))
         self.undo_shuffle_index = -1
-        self.current_index = 0
-        self.sequence = random.sample(self.sequence, len(self.sequence))
+
+        start = min(self.current_index + 1, len(self._sequence)) if remaining else 0
+        seed = self.weighted_permutation(start) if weighted else random.getrandbits(63)
+        step = (seed, start, len(self._sequence))
+        self.set_order(shuffle_order(self._sequence.order, *step), self.shuffle_steps + (step,))
+        if not remaining:
+            self.current_index = 0
+        if self._sequence:
+            self.current = self._sequence[self.current_index]
 
     def previous_shuffle(self):
         if abs(self.undo_shuffle_index) <= len(self.previous_shuffle_storage):
-            self.sequence, self.current_index = self.previous_shuffle_storage[self.undo_shuffle_index]
+            base, steps, current_index = self.previous_shuffle_storage[self.undo_shuffle_index]
+            if base is not self._sequence.base:
+                self.set_sequence(PermutedSequence(base))
+            self.restore_shuffle(steps)
+            self.current_index = current_index
             self.undo_shuffle_index -= 1
 
         if self.undo_shuffle_index < -(self.UNDO_SHUFFLE_LIMIT - 1):
             self.undo_shuffle_index = -(self.UNDO_SHUFFLE_LIMIT - 1)
 
-        self.current = self.sequence[self.current_index]
+        if self._sequence:
+            self.current = self.sequence[self.current_index]
+
+    def weighted_permutation(self, start):
+        """A weighted permutation of the images from start on, as a seed for shuffle_order."""
+        order = self._sequence.order[:]
+        order.extend(range(len(order), len(self._sequence)))
+        inverse = inverse_permutation(order)
+        return array('I', (inverse[position] - start for position in self.sampler.permutation(order[start:])))
+
+    def restore_shuffle(self, steps):
+        """Bring the order of the sequence back to the one made by steps (see shuffle)."""
+        order = self._sequence.order
+        if self.shuffle_steps[:len(steps)] == steps:  # undo the shuffles made since
+            for step in reversed(self.shuffle_steps[len(steps):]):
+                order = unshuffle_order(order, *step)
+        else:
+            order = array('I')
+            for step in steps:
+                order = shuffle_order(order, *step)
+        self.set_order(order, steps)
+
+    def set_order(self, order, steps):
+        self._sequence = PermutedSequence(self._sequence.base, order)
+        self.shuffle_steps = steps
+        QTimer.singleShot(0, self.sequenceChanged.emit)
+
+    def set_sort_order(self, sort_order):
+        """Sort the sequence by sort_order from now on (see sort), None keeps the order the images are found in."""
+        self.sort_order = sort_order
+        if sort_order is not None:
+            self.sorter.set_kind(sort_order)
+        self.sort()
+
+    def sort(self):
+        """
+        Sort the sequence by sort_order, keeping the current image. A sort is undone like a shuffle and
+        images that are loaded into a sorted sequence are inserted where they belong (see merge_loaded).
+        """
+        if not self._sequence:
+            return
+        if len(self.previous_shuffle_storage) > self.UNDO_SHUFFLE_LIMIT:
+            self.previous_shuffle_storage.pop(0)
+        self.previous_shuffle_storage.append((self._sequence.base, self.shuffle_steps, self.current_index))
+        self.undo_shuffle_index = -1
+
+        if self.sort_order is None:
+            self.set_order(array('I'), ())
+            self.current_index = max(self._sequence.find(self.current), 0)
+        else:
+            self.with_sort_keys(self.apply_sort)
+
+    def apply_sort(self):
+        """Put the sequence in its sort order, keeping the current image."""
+        if self.sort_order is not None and self._sequence:
+            self.set_sorted(self.sorter.sort())
+            self.current_index = max(self._sequence.find(self.current), 0)
+
+    def with_sort_keys(self, then):
+        """
+        Call then() once the sorter has the keys of every image. Keys that need a stat of every file (modified
+        and size) are read in a worker first, so sorting never waits for the file system in the GUI thread.
+        """
+        if then not in self.after_sort_keys:
+            self.after_sort_keys.append(then)
+        if not self.reading_sort_keys:  # otherwise handle_sort_keys carries on
+            self.read_missing_sort_keys()
+
+    def read_missing_sort_keys(self):
+        missing = self.sorter.missing_keys()
+        if missing is not None:
+            self.reading_sort_keys = True
+            self.sort_keys_executor.submit(self.read_sort_keys, self.sorter.base, self.sorter.kind, *missing)
+            return
+        todo, self.after_sort_keys = self.after_sort_keys, []
+        for then in todo:
+            then()
+
+    def read_sort_keys(self, base, kind, start, stop):
+        # worker thread
+        self._sortKeysRead.emit(base, kind, start, self.sorter.read_keys(base, kind, start, stop))
+
+    def handle_sort_keys(self, base, kind, start, keys):
+        self.reading_sort_keys = False
+        self.sorter.add_keys(base, kind, start, keys)
+        if self.after_sort_keys:  # images may have been loaded while the keys were read
+            self.read_missing_sort_keys()
+
+    def merge_loaded(self):
+        """Sort the images loaded since the last merge into the sorted sequence, keeping the current image."""
+        order = self._sequence.order
+        if not self.is_sorted() or len(order) == len(self._sequence):
+            return
+        new_order, points = self.sorter.insert(order, range(len(order), len(self._sequence)))
+        self.set_sorted(new_order)
+        if self.current_index < len(order):
+            self.current_index += bisect_right(points, self.current_index)  # images inserted before the current one
+        else:
+            self.current_index = max(self._sequence.find(self.current), 0)
+
+    def set_sorted(self, order):
+        self.sort_permutation = order
+        self.set_order(order, ((order, 0, len(order)),))
+
+    def is_sorted(self):
+        """Whether the sequence is in its sort order (and wasn't shuffled since)."""
+        return (self.sort_order is not None and len(self.shuffle_steps) == 1 and
+                self.shuffle_steps[0][0] is self.sort_permutation is self._sequence.order)
 
     def random(self):
+        path = self.next_random or self.sampler.draw_path()
+        if path is None:  # no images to pick from
+            return
         if len(self.previous_random_storage) > self.UNDO_RANDOM_LIMIT:
             self.previous_random_storage.pop(0)
 
         self.previous_random_storage.append(self.current)
-        self.current = random.choice(self.sequence)
+        self.current = path
+        self.next_random = self.sampler.draw_path()  # picked ahead of time so it can be prefetched
         self.undo_random_index = -1
 
+    def upcoming(self, distance=PREFETCH_DISTANCE):
+        """The images that are most likely to be shown next: neighbours in the sequence and the next random pick."""
+        paths = []
+        if self.sequence:
+            for offset in range(1, distance + 1):
+                paths.append(self.sequence[(self.current_index + offset) % len(self.sequence)])
+                paths.append(self.sequence[(self.current_index - offset) % len(self.sequence)])
+            if self.next_random is None:
+                self.next_random = self.sampler.draw_path()
+            paths.append(self.next_random)
+        return [path for path in dict.fromkeys(paths) if path is not None and path != self.current]
+
     def previous_random(self):
         if abs(self.undo_random_index) <= len(self.previous_random_storage):
             self.current = self.previous_random_storage[self.undo_random_index]
@@ -153,21 +651,199 @@ class ImagePath(QObject):
         self.set_sequence(value)
 
     def set_sequence(self, value):
+        if type(value) == str and os.path.isdir(value):
+            self.load([value])
+            return
+
+        self.loader.cancel()
+        self.metadata_probe.cancel()
+        self.next_random = None
+
         if value != self.sequence:
             QTimer.singleShot(0, self.sequenceChanged.emit)
 
-        stop_thread(self.image_loader_thread)
-
-        if type(value) == str and os.path.isdir(value):
-            self._sequence = []
-            self.image_loader_thread = load_dir_threaded(value, self._sequence)
-        elif type(value) == str:
-            self._sequence = [str]
-        else:
+        if type(value) == str:
+            self._sequence = PermutedSequence(CompactSequence([value]))
+        elif isinstance(value, PermutedSequence):
             self._sequence = value
+        elif isinstance(value, CompactSequence):
+            self._sequence = PermutedSequence(value)
+        else:
+            self._sequence = PermutedSequence(CompactSequence(value))
+        self.shuffle_steps = ()
+        if self.sampler.base is not self._sequence.base:
+            self.sampler.set_sequence(self._sequence.base)
+        self.after_sort_keys = []
+        if self.sorter.base is not self._sequence.base:
+            self.sorter.set_sequence(self._sequence.base)
+            if self.sort_order is not None and not isinstance(value, PermutedSequence):
+                self.with_sort_keys(self.apply_sort)
+        self.root_dirs = []
         self.current_index = 0
         if len(self._sequence) > 0:
             self.current = self.sequence[self.current_index]
+        self.metadata_probe.probe(self._sequence)
+
+        if self.watching:
+            self.set_watching(True)
+
+    def load(self, paths):
+        """Replace the sequence with the images found in paths (files and directories), as they are found."""
+        self.loader.cancel()
+        self.metadata_probe.cancel()
+        self.next_random = None
+        self._sequence = PermutedSequence()
+        self.shuffle_steps = ()
+        self.sampler.set_sequence(self._sequence.base)
+        self.sorter.set_sequence(self._sequence.base)
+        self.after_sort_keys = []
+        if self.sort_order is not None:
+            self.set_sorted(array('I'))  # loaded images are sorted in by merge_loaded
+        self.root_dirs = [path for path in paths if os.path.isdir(path)]
+        self.current_index = 0
+        if self.watching:
+            self.folder_watcher.unwatch_all()  # watched again once loading finishes
+        QTimer.singleShot(0, self.sequenceChanged.emit)  # empty until the first batch arrives
+        self.loader.load(paths)
+
+    def extend_sequence(self, paths):
+        if not paths:
+            return
+        was_empty = not self._sequence
+        size = len(self._sequence.base)
+        self._sequence.base.extend(paths)  # after the shuffled (or sorted) part, if any
+        if self.is_sorted() and not self.merge_timer.isActive():
+            self.merge_timer.start()  # one merge for all the batches until then
+        if was_empty:
+            self.current_index = 0
+            self.current = self._sequence[0]
+            QTimer.singleShot(0, self.sequenceChanged.emit)
+        self.sequenceExtended.emit(paths)
+        self.metadata_probe.probe(paths)
+
+    def metadata(self, path=None):
+        """Return the ImageMetadata (dimensions, orientation, frames ...) of path or the current image, if probed."""
+        return self.metadata_probe.get(path or self.current)
+
+    def loading_finished(self):
+        self.merge_timer.stop()
+        self.with_sort_keys(self.merge_loaded)
+        if self.watching:  # now that all directories are known
+            self.set_watching(True)
+
+    def set_watching(self, watching):
+        """Watch the directories of the sequence and patch the sequence as images are added or removed."""
+        self.watching = watching
+        self.folder_watcher.unwatch_all()
+        if watching:
+            self.folder_watcher.watch(self.sequence.directories(), self.root_dirs)
+
+    def apply_diff(self, added, removed, renamed):
+        """Patch the sequence in place, keeping the current image (and its index) where it was."""
+        if self.loader.is_loading():  # the diff may overlap with batches that are still on their way
+            QTimer.singleShot(FolderWatcher.COALESCE_INTERVAL, lambda: self.apply_diff(added, removed, renamed))
+            return
+
+        if self.is_sorted() and len(self._sequence.order) < len(self._sequence):  # not merged yet
+            self.with_sort_keys(self.merge_loaded)
+            self.with_sort_keys(lambda: self.apply_diff(added, removed, renamed))
+            return
+
+        removed = set(removed)
+        if self.next_random in removed or self.next_random in renamed:
+            self.next_random = None
+        if self.is_sorted():
+            self.apply_sorted_diff(added, removed, renamed)
+        else:
+            if removed or renamed:
+                self.drop_paths(removed, renamed)
+            added = [path for path in dict.fromkeys(added) if path not in self._sequence]
+            self._sequence.base.extend(added)
+        self.metadata_probe.probe(list(added) + list(renamed.values()))
+
+        current = renamed.get(self.current, self.current)
+        if current in removed or not self._sequence:
+            self.current_index = max(min(self.current_index, len(self._sequence) - 1), 0)
+        else:
+            try:
+                self.current_index = self._sequence.index(current)
+            except ValueError:
+                pass
+        if self._sequence:
+            self.current = self._sequence[self.current_index]
+
+        QTimer.singleShot(0, self.sequenceChanged.emit)
+
+    def drop_paths(self, removed, renamed):
+        """
+        apply_diff for the removed and renamed images of an unsorted sequence: the others keep their order.
+        The base is copied without the removed images and the order is kept as a permutation of the copy.
+        """
+        base = self._sequence.base
+        dropped = {base.find(path) for path in removed}
+        positions = array('I', (position for position in range(len(base)) if position not in dropped))
+        new_positions = array('I', bytes(4 * len(base)))
+        for new_position, position in enumerate(positions):
+            new_positions[position] = new_position
+        order = array('I', (new_positions[position] for position in self._sequence.order if position not in dropped))
+
+        base = CompactSequence(renamed.get(path, path) for path in map(base.__getitem__, positions))
+        self.sorter.rebase(base, positions)
+        self.sampler.rebase(base)
+        self._sequence = PermutedSequence(base, order)
+        self.shuffle_steps = ((order, 0, len(order)),) if order else ()
+
+    def apply_sorted_diff(self, added, removed, renamed):
+        """apply_diff for sorted sequences: renamed and added images are sorted in, the others keep their keys."""
+        base = self._sequence.base
+        dropped = {base.find(path) for path in chain(removed, renamed)}
+        positions = array('I', (position for position in self._sequence.order if position not in dropped))
+        base = CompactSequence(map(base.__getitem__, positions))
+        self.sorter.rebase(base, positions)
+        self.sampler.rebase(base)
+        self._sequence = PermutedSequence(base)
+
+        size = len(base)
+        base.extend(path for path in dict.fromkeys(chain(renamed.values(), added)) if path not in base)
+        self.set_sorted(self.sorter.insert(array('I', range(size)), range(size, len(base)))[0])
+
+    def session(self):
+        """A Session of the sequence, its order, the current image and the undo history (of this sequence)."""
+        base = self._sequence.base
+        return Session(base, self._sequence.order, self.shuffle_steps, self.current, self.current_index, self.root_dirs,
+                       sort_order=self.sort_order, sorted=self.is_sorted(),
+                       shuffle_history=[(steps, index) for entry_base, steps, index in self.previous_shuffle_storage
+                                        if entry_base is base],
+                       random_history=self.previous_random_storage, seen=self.sampler.seen())
+
+    def restore_session(self, session):
+        """Continue the session, with the current image first."""
+        self.loader.cancel()
+        self.metadata_probe.cancel()
+        self.next_random = None
+        self.current = session.current
+
+        base = session.base
+        self._sequence = PermutedSequence(base, session.order)
+        self.shuffle_steps = session.steps
+        self.sort_permutation = self._sequence.order if session.sorted and session.sort_order == self.sort_order else None
+        self.previous_shuffle_storage = [(base, steps, index) for steps, index in session.shuffle_history]
+        self.undo_shuffle_index = -1
+        self.previous_random_storage = session.random_history
+        self.undo_random_index = -1
+        self.sampler.set_sequence(base)
+        self.sampler.restore_seen(session.seen)
+        self.sorter.set_sequence(base)
+        self.after_sort_keys = []
+        self.root_dirs = session.root_dirs
+        self.current_index = session.current_index
+        if not 0 <= self.current_index < len(self._sequence) or self._sequence[self.current_index] != self.current:
+            self.current_index = max(self._sequence.find(self.current), 0)
+        QTimer.singleShot(0, self.sequenceChanged.emit)
+        self.metadata_probe.probe(self._sequence)
+
+        if self.watching:
+            self.set_watching(True)
 
     #def append_dir(self, dir_path):
     #    dir_path = os.path.abspath(dir_path)
@@ -181,6 +857,92 @@ class ImagePath(QObject):
     #    #        if os.path.isfile(os.path.join(path, img))]
 
 
+class SessionKeeper(QObject):
+    """
+    Save the session of an ImagePath to a snapshot every SAVE_INTERVAL (if it changed) and on exit, and
+    restore it on the next start.
+
+    A restored session is shown right away and validated afterwards: a thread scans the directories it was
+    loaded from (through the library index, so unchanged directories aren't listed) or checks that its images
+    still exist, and the differences are patched in like FolderWatcher changes.
+    """
+
+    SAVE_INTERVAL = 60 * 1000
+
+    _validated = Signal(object, list, list)
+
+    def __init__(self, image_path, path, parent=None):
+        super().__init__(parent)
+
+        self.image_path = image_path
+        self.path = path
+        self.saved_state = None
+        self.executor = ThreadPoolExecutor(max_workers=1)  # one snapshot is written at a time
+        self._validated.connect(self.handle_validated, Qt.QueuedConnection)
+
+        self.save_timer = QTimer(self, interval=self.SAVE_INTERVAL)
+        self.save_timer.timeout.connect(self.save)
+        self.save_timer.start()
+
+    def state(self):
+        """What changes when the session does, without comparing sequences."""
+        image_path = self.image_path
+        return (id(image_path.sequence.base), len(image_path.sequence.base), id(image_path.sequence.order),
+                image_path.current, len(image_path.previous_shuffle_storage), len(image_path.previous_random_storage),
+                image_path.sampler.seen_count())
+
+    def save(self, wait=False):
+        if not self.image_path.sequence or self.state() == self.saved_state:
+            return
+        self.saved_state = self.state()
+        meta, sections = self.image_path.session().encode()  # copies, the sequence may grow while they are written
+        future = self.executor.submit(write_snapshot, self.path, meta, sections)
+        if wait:
+            future.result()
+
+    def restore(self):
+        """Restore the last session, return whether there was one."""
+        session = Session.load(self.path)
+        if session is None:
+            return False
+        try:
+            self.image_path.restore_session(session)
+        finally:
+            session.close()
+        self.saved_state = self.state()
+        self.validate()
+        return True
+
+    def validate(self):
+        base, roots = self.image_path.sequence.base, list(self.image_path.root_dirs)
+        size = len(base)
+
+        def run():
+            known = set(base[i] for i in range(size))
+            added = []
+            if roots:
+                found = set()
+                for path in library_scanner().scan(roots):
+                    found.add(path)
+                    if path not in known:
+                        added.append(path)
+                removed = [path for path in known if path not in found and not os.path.isfile(path)]
+            else:  # a selection of images
+                removed = [path for path in known if not os.path.isfile(path)]
+            self._validated.emit(base, added, removed)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def handle_validated(self, base, added, removed):
+        if base is self.image_path.sequence.base and (added or removed):
+            self.image_path.apply_diff(added, removed, {})
+
+    def shutdown(self):
+        self.save_timer.stop()
+        self.save(wait=True)
+        self.executor.shutdown()
+
+
 class TimeElapsedTimer(QObject):
     """
     Thread for continuous time tracking.
@@ -220,28 +982,22 @@ class StarActions(QObject):
         self.qwidget = qwidget
 
     def starred_images(self):
-        settings = Settings()
-        stars = settings.value('stars', [])
-        # Reading a list with a single string evaluates to a string instead of a list.
-        if isinstance(stars, str):
-            return [stars] if stars else []
-        return stars
+        return shared_star_store().paths()
 
-    def star_image(self, path):
-        settings = Settings()
-
-        starred_images = self.starred_images()
-        if path not in starred_images:
-            starred_images.append(path)
-        else:
-            starred_images.remove(path)
-        # Trying to save an empty list [] causes errors.
-        settings['stars'] = starred_images if starred_images else ['']
+    def is_starred(self, path):
+        return path in shared_star_store()
 
+    def star_image(self, path):
+        shared_star_store().toggle(path)
         QTimer.singleShot(0, lambda: self.handle_star_icon(path))
 
+    def star_images(self, paths, starred=True):
+        """(Un)star all of paths at once, return the ones that changed."""
+        store = shared_star_store()
+        return store.star(paths) if starred else store.unstar(paths)
+
     def handle_star_icon(self, path):
-        if path in self.starred_images():
+        if self.is_starred(path):
             set_icon("fullstar.png", self.qwidget)
         else:
             set_icon("emptystar.png", self.qwidget)
@@ -0,0 +1,81 @@
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .imagedecoder import decode_image, decode_size
+from .sharedbuffers import BufferPool, write_buffer
+from .thumbnails import init_worker
+
+
+IMAGE_FORMAT = QImage.Format_ARGB32_Premultiplied  # what QPainter draws fastest, 4 bytes per pixel
+
+
+def decode_into(path, width, height, buffer_path, capacity):
+    """
+    Runs in a worker process. Decode the image at path at width x height into the SharedBuffer at buffer_path.
+    Return (width, height, source width, source height) of the decoded image, None if it can't be read
+    or doesn't fit in capacity bytes.
+    """
+    image, source_size = decode_image(path, QSize(width, height))
+    if image.isNull():
+        return None
+    image = image.convertToFormat(IMAGE_FORMAT)
+    if image.byteCount() > capacity:
+        return None
+    write_buffer(buffer_path, image.constBits())
+    return image.width(), image.height(), source_size.width(), source_size.height()
+
+
+class DecodeFarm:
+    """
+    Decode images in a pool of worker processes, so decoding scales past the GIL to every core.
+
+    Workers write the pixels into SharedBuffers from a BufferPool and decode() returns a QImage that reads
+    straight from the buffer, without copying it into this process. The farm keeps a copy of every such image
+    (copies share the pixels): once it is the only one left, every other copy is gone and the buffer goes
+    back to the pool.
+
+    decode() has the signature of decode_image, blocks until the image is ready and may be called from any
+    thread; images whose size can't be read from the header are decoded in the calling thread instead.
+    """
+
+    WORKERS = os.cpu_count() or 2
+    POOL_BUDGET = 768 * 1024 * 1024
+
+    def __init__(self, workers=WORKERS, pool_budget=POOL_BUDGET):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+        self.pool = BufferPool(pool_budget)
+
+    def decode(self, path, size=None):
+        source_size = QImageReader(path).size()
+        if not source_size.isValid():
+            return decode_image(path, size)
+
+        decoded_size = decode_size(source_size, size)
+        buffer = self.pool.acquire(decoded_size.width() * decoded_size.height() * 4)
+        try:
+            result = self.executor.submit(decode_into, path, decoded_size.width(), decoded_size.height(),
+                                          buffer.path, buffer.size).result()
+        except Exception:  # a worker died, or the farm was shut down
+            result = None
+        if result is None:
+            self.pool.release(buffer)
+            return decode_image(path, size)
+
+        width, height, source_width, source_height = result
+        view = buffer.view(width * height * 4)
+        image = QImage(view, width, height, width * 4, IMAGE_FORMAT)  # no copy, the image reads from the buffer
+        own = QImage(image)  # shares the pixels, detached once every other copy of image is gone
+        self.pool.lease(buffer, lambda view=view: not own.isDetached())  # the lease keeps the view alive
+        return image, QSize(source_width, source_height)
+
+    def leased(self):
+        """The number of buffers that images still read from."""
+        return self.pool.leased()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+        self.pool.close()
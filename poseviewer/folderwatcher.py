@@ -0,0 +1,185 @@
+from PySide.QtCore import *
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .imageloader import is_supported_image, _entry_key
+
+
+class FolderWatcher(QObject):
+    """
+    Watch directories for added, removed and renamed images.
+
+    Change notifications are coalesced: the watched directories are only listed again once no new notification
+    arrived for COALESCE_INTERVAL ms (or MAX_DELAY ms passed since the first one), so copying thousands of files
+    results in a handful of sequenceDiff signals instead of one per file. Directories are listed in a worker
+    thread, one rescan at a time, and the differences are posted back to the GUI thread.
+    sequenceDiff carries (added paths, removed paths, {old path: new path}).
+    """
+
+    sequenceDiff = Signal(list, list, dict)
+
+    _listed = Signal(int, object)
+    _rescanned = Signal(int, object, list, list, dict)
+
+    COALESCE_INTERVAL = 300
+    MAX_DELAY = 2000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.directory_changed)
+
+        self._contents = {}  # dir path -> {image name: (st_dev, st_ino)}
+        self._dirty = set()
+        self.generation = 0
+        self.rescanning = False
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self._listed.connect(self.handle_listed, Qt.QueuedConnection)
+        self._rescanned.connect(self.handle_rescanned, Qt.QueuedConnection)
+
+        self.coalesce_timer = QTimer(self, singleShot=True, interval=self.COALESCE_INTERVAL)
+        self.coalesce_timer.timeout.connect(self.flush)
+        self.first_change = QElapsedTimer()
+
+    def watch(self, dirs, roots=()):
+        """Watch dirs and every directory below roots, once they are listed in the worker."""
+        self.executor.submit(self._list, self.generation, list(dirs), list(roots))
+
+    def _list(self, generation, dirs, roots):
+        # worker thread
+        dirs = dict.fromkeys(os.path.abspath(dir_path) for dir_path in dirs)
+        for root in roots:
+            dirs.update(dict.fromkeys(path for path, subdirs, files in os.walk(os.path.abspath(root))))
+        self._listed.emit(generation, {dir_path: list_dir(dir_path)[0] for dir_path in dirs})
+
+    def handle_listed(self, generation, contents):
+        if generation == self.generation:
+            self.update_contents({dir_path: images for dir_path, images in contents.items()
+                                  if images is not None and dir_path not in self._contents})
+
+    def update_contents(self, contents):
+        """Take the listings in contents, None for directories that aren't watched any more."""
+        for dir_path, images in contents.items():
+            if images is None:
+                if self._contents.pop(dir_path, None) is not None:
+                    self.watcher.removePath(dir_path)
+                continue
+            if dir_path not in self._contents:
+                self.watcher.addPath(dir_path)
+            self._contents[dir_path] = images
+
+    def unwatch_all(self):
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+        self._contents.clear()
+        self._dirty.clear()
+        self.generation += 1
+        self.rescanning = False
+        self.coalesce_timer.stop()
+
+    def is_watching(self):
+        return bool(self._contents)
+
+    def directory_changed(self, path):
+        if not self._dirty:
+            self.first_change.start()
+        self._dirty.add(path)
+        if not self.coalesce_timer.isActive() or self.first_change.elapsed() < self.MAX_DELAY:
+            self.coalesce_timer.start()
+
+    def flush(self):
+        if self.rescanning:  # flushed again once the running rescan is in
+            return
+        dirty, self._dirty = self._dirty, set()
+        if dirty:
+            self.rescanning = True
+            self.executor.submit(self._rescan, self.generation, dirty, dict(self._contents))
+
+    def _rescan(self, generation, dirty, contents):
+        # worker thread
+        self._rescanned.emit(generation, *rescan(dirty, contents))
+
+    def handle_rescanned(self, generation, contents, added, removed, renamed):
+        if generation != self.generation:
+            return
+        self.rescanning = False
+        self.update_contents(contents)
+        if added or removed or renamed:
+            self.sequenceDiff.emit(added, removed, renamed)
+        if self._dirty and not self.coalesce_timer.isActive():
+            self.coalesce_timer.start()
+
+
+def rescan(dirty, contents):
+    """
+    List the dirty directories of contents ({dir path: {image name: (st_dev, st_ino)}}) again.
+    Return (the new contents of the changed directories, None for the ones that are gone, added paths,
+    removed paths, {old path: new path}). The new directories below the dirty ones are listed too.
+    A removed and an added image are a rename if they are the same file, on the same device.
+    """
+    updates = {}
+    added, removed = [], []
+    renamed_keys = {}
+
+    for dir_path in dirty:
+        if dir_path not in contents or updates.get(dir_path, ()) is None:
+            continue
+        old = contents[dir_path]
+        new, subdirs = list_dir(dir_path)
+        if new is None:  # the directory itself was removed, forget it and everything below it
+            for path in [path for path in contents if path == dir_path or path.startswith(os.path.join(dir_path, ''))]:
+                removed.extend(os.path.join(path, name) for name in contents[path])
+                updates[path] = None
+            continue
+
+        for name in old.keys() - new.keys():
+            removed.append(os.path.join(dir_path, name))
+            if old[name]:
+                renamed_keys[old[name]] = os.path.join(dir_path, name)
+        added.extend(os.path.join(dir_path, name) for name in new.keys() - old.keys())
+        updates[dir_path] = new
+
+        for subdir in subdirs:
+            if subdir not in contents and subdir not in updates:  # a new directory, watch it with its subdirectories
+                for path, dirs, files in os.walk(subdir):
+                    images = list_dir(path)[0]
+                    if images is not None:
+                        updates[path] = images
+                        added.extend(os.path.join(path, name) for name in images)
+
+    renamed = {}
+    for path in added:
+        dir_path, name = os.path.split(path)
+        key = (updates.get(dir_path) or {}).get(name)
+        if key and key in renamed_keys:
+            renamed[renamed_keys[key]] = path
+    renamed_to = set(renamed.values())
+    added = [path for path in added if path not in renamed_to]
+    removed = [path for path in removed if path not in renamed]
+    return updates, added, removed, renamed
+
+
+def list_dir(dir_path):
+    """
+    Return ({image name: (st_dev, st_ino)}, [subdirectory paths]) or (None, None) if dir_path is gone.
+    The identities are None on Windows, where DirEntry doesn't have them.
+    """
+    images = {}
+    subdirs = []
+    try:
+        dir_dev = os.stat(dir_path).st_dev
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and is_supported_image(entry.name):
+                        images[entry.name] = _entry_key(entry, dir_dev) if os.name != 'nt' else None
+                    elif entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                except OSError:
+                    continue
+    except OSError:
+        return None, None
+    return images, subdirs
@@ -0,0 +1,205 @@
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+import queue
+import threading
+from collections import namedtuple
+
+
+Frame = namedtuple('Frame', 'image delay')  # image is a QImage until it is first shown, a QPixmap after that
+
+
+class GifPlayer(QObject):
+    """
+    Play animated images from frames that are decoded once, in a worker thread.
+
+    The worker decodes at most DECODE_AHEAD frames ahead of playback. While the frames of the whole animation
+    fit in FRAME_BUDGET bytes they are kept, so later loops cost no decoding at all. Animations that don't fit
+    are streamed instead: the worker starts over at the end of every loop and memory stays bounded.
+
+    Playback follows the frame delays against a clock. When it falls behind, frames whose time has already
+    passed are dropped instead of being shown late.
+    firstFrame carries (path, QImage, size of the image in the file) of the first frame,
+    frameChanged the pixmaps of the frames after it.
+    """
+
+    NotRunning, Paused, Running = range(3)
+
+    firstFrame = Signal(str, QImage, QSize)
+    frameChanged = Signal(QPixmap)
+
+    FRAME_BUDGET = 128 * 1024 * 1024
+    DECODE_AHEAD = 8
+    MIN_DELAY = 10  # ms, shorter delays (and missing ones) are played at DEFAULT_DELAY, like browsers do
+    DEFAULT_DELAY = 100
+    RETRY_INTERVAL = 10  # ms to wait for a frame that hasn't been decoded yet
+
+    _STREAMING = 'streaming'  # queued by the worker once the animation is known not to fit in FRAME_BUDGET
+    _COMPLETE = 'complete'  # queued after the last frame of the first loop
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.state = self.NotRunning
+        self.path = ""
+        self.source_size = QSize()
+        self.generation = 0
+        self._incoming = queue.Queue()
+
+        self.frames = []  # the frames of the animation, unless streaming
+        self.frames_complete = False
+        self.streaming = False
+        self.index = -1
+        self.shown_frames = 0
+        self.dropped_frames = 0
+
+        self.clock = QElapsedTimer()
+        self.due = 0  # clock time at which the frame on screen ends
+        self.paused_at = 0
+        self.timer = QTimer(self, singleShot=True)
+        self.timer.timeout.connect(self.tick)
+
+    def play(self, path, size=None):
+        """Play the animation at path, scaled down to fit size (a QSize) if given."""
+        self.stop()
+        self.path = path
+        self.source_size = QSize()
+        self.state = self.Running
+        self.frames_complete = False
+        self.streaming = False
+        self.index = -1
+        self.shown_frames = 0
+        self.dropped_frames = 0
+        self._incoming = queue.Queue(maxsize=self.DECODE_AHEAD)
+
+        thread = threading.Thread(target=self._decode, args=(self.generation, self._incoming, path, size))
+        thread.daemon = True
+        thread.start()
+
+        self.clock.start()
+        self.due = 0
+        self.timer.start(0)
+
+    def stop(self):
+        self.generation += 1  # the worker notices and exits
+        self.timer.stop()
+        self.state = self.NotRunning
+        self.frames = []
+
+    def set_paused(self, paused):
+        if paused and self.state == self.Running:
+            self.state = self.Paused
+            self.timer.stop()
+            self.paused_at = self.clock.elapsed()
+        elif not paused and self.state == self.Paused:
+            self.state = self.Running
+            self.due += self.clock.elapsed() - self.paused_at
+            self.timer.start(max(self.due - self.clock.elapsed(), 0))
+
+    def is_running(self):
+        return self.state == self.Running
+
+    def _decode(self, generation, incoming, path, size):
+        """Runs in a worker thread. Queue the frames of path until the animation is stopped."""
+        frame_bytes = 0
+        streaming = False
+        while generation == self.generation:
+            reader = QImageReader(path)
+            source_size = reader.size()
+            if size and source_size.isValid() and (source_size.width() > size.width() or source_size.height() > size.height()):
+                scaled_size = QSize(source_size)
+                scaled_size.scale(size, Qt.KeepAspectRatio)
+                reader.setScaledSize(scaled_size)
+            if not self.source_size.isValid():
+                self.source_size = source_size
+
+            frames = 0
+            while generation == self.generation:
+                image = reader.read()
+                if image.isNull():
+                    break
+                frames += 1
+                delay = reader.nextImageDelay()
+
+                if not streaming:
+                    frame_bytes += image.byteCount()
+                    if frame_bytes > self.FRAME_BUDGET:
+                        streaming = True
+                        self._put(incoming, generation, self._STREAMING)
+                self._put(incoming, generation, Frame(image, delay if delay >= self.MIN_DELAY else self.DEFAULT_DELAY))
+
+            if not streaming or frames <= 1:  # everything is queued, playback loops over the kept frames
+                self._put(incoming, generation, self._COMPLETE)
+                return
+
+    def _put(self, incoming, generation, item):
+        while generation == self.generation:
+            try:
+                incoming.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def next_frame(self):
+        """Return the next Frame or None if it isn't decoded yet."""
+        while not self.frames_complete:
+            try:
+                item = self._incoming.get_nowait()
+            except queue.Empty:
+                return None
+
+            if item is self._STREAMING:
+                self.streaming = True
+                self.frames = []
+            elif item is self._COMPLETE:
+                self.frames_complete = True
+                self.index = -1
+            elif self.streaming:
+                return item
+            else:
+                self.frames.append(item)
+                self.index = len(self.frames) - 1
+                return item
+
+        if not self.frames:
+            return None
+        self.index = (self.index + 1) % len(self.frames)
+        return self.frames[self.index]
+
+    def tick(self):
+        if self.state != self.Running:
+            return
+
+        now = self.clock.elapsed()
+        frame = None
+        while True:
+            next_frame = self.next_frame()
+            if next_frame is None:
+                break
+            if frame is not None:
+                self.dropped_frames += 1
+            frame = next_frame
+            self.due += frame.delay
+            if self.due > now:
+                break
+
+        if frame is None:  # decoding is behind, wait for it without building up a debt of frames to drop
+            self.due = max(self.due, now)
+            self.timer.start(self.RETRY_INTERVAL)
+            return
+
+        self.show_frame(frame)
+        self.timer.start(max(self.due - now, 0))
+
+    def show_frame(self, frame):
+        self.shown_frames += 1
+        if self.shown_frames == 1:
+            self.firstFrame.emit(self.path, frame.image, self.source_size if self.source_size.isValid() else frame.image.size())
+            return
+
+        pixmap = frame.image
+        if isinstance(pixmap, QImage):
+            pixmap = QPixmap.fromImage(pixmap)
+            if not self.streaming and 0 <= self.index < len(self.frames):  # converted once, later loops reuse it
+                self.frames[self.index] = Frame(pixmap, frame.delay)
+        self.frameChanged.emit(pixmap)
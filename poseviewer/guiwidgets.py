@@ -2,10 +2,22 @@
 from PySide.QtGui import *
 
 import os
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque, OrderedDict
 
 from .imageloader import *
+from .imagedecoder import ImageDecoder
+from .tiledimage import TiledImageItem, needs_tiling
+from .gifplayer import GifPlayer
+from .thumbnails import ThumbnailService, thumbnail_size
+from .thumbnailgrid import ThumbnailGridView
+from .imageexport import normalized_transform
 from .slideshowsettings import Slideshow
-from .corewidgets import StarButton
+from .corewidgets import StarButton, ImageLoader, shared_tag_store, shared_decode_farm
+from .settingscache import settings_sibling
+from .search import SearchIndex, filter_rows
 
 
 SUPPORTED_FORMATS_FILTER = ["*.BMP", "*.GIF", "*.JPG", "*.JPEG", "*.PNG", "*.PBM", "*.PGM", "*.PPM", "*.XBM", "*.XPM"]
@@ -13,6 +25,8 @@ SUPPORTED_FORMATS_FILTER = ["*.BMP", "*.GIF", "*.JPG", "*.JPEG", "*.PNG", "*.PBM
 
 class ImageCanvas(QGraphicsView):
     ZOOM_FACTOR = 1.2
+    INTERACTION_IDLE = 150  # ms without input before the smooth re-render
+    FIT_FRAMES = 4
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -34,64 +48,212 @@ class ImageCanvas(QGraphicsView):
         self.pix_item = QGraphicsPixmapItem()
         self.pix_item.setTransformationMode(Qt.SmoothTransformation)  # make it smooooth
 
-        self.movie = QMovie(self)
-        self.movie.updated.connect(self.update_gif)
+        self.decoder = ImageDecoder(self, farm=shared_decode_farm())
+        self.decoder.imageDecoded.connect(self.show_image)
+
+        self.gif_player = GifPlayer(self)  # gifs are decoded by the player only, its first frame is shown like any image
+        self.gif_player.firstFrame.connect(self.show_image)
+        self.gif_player.frameChanged.connect(self.update_gif)
+
+        self.tiled_item = None  # replaces pix_item for very large images
 
         self.imageScene.addItem(self.pix_item)  # add pixmap to scene
         self.setScene(self.imageScene)  # apply scene to view
 
         self.image_path = ""
+        self.shown_path = ""
+        self.image_size = None
+        self.full_resolution_requested = False
+        self.request_time = 0
+        self.display_times = deque(maxlen=100)  # seconds from draw_image to the image being on screen
+
+        # While the user resizes, zooms, drags or transforms, frames are drawn with fast transformations.
+        # Once input goes idle the view is drawn smoothly again, from a frame pre-scaled to the window if it fits.
+        self.interacting = False
+        self.interaction_timer = QTimer(self, singleShot=True, interval=self.INTERACTION_IDLE)
+        self.interaction_timer.timeout.connect(self.end_interaction)
+        self.fitted = True
+        self.base_pixmap = QPixmap()
+        self.fit_frames = OrderedDict()  # (width, height) -> base_pixmap smoothly scaled to that size
+        self.frame_times = {True: deque(maxlen=200), False: deque(maxlen=200)}  # interacting -> paint durations
 
         self.show()  # show image
 
     def draw_image(self, image_path, size=None):
+        """
+        Decode the image in the background. The previous image stays on screen until it is ready.
+
+        Without a size the image is first decoded at the size of the viewport, the full resolution
+        is only fetched once it is needed (see request_full_resolution).
+        """
+        self.image_path = image_path
+        self.image_size = size
+        self.full_resolution_requested = size is not None  # a fixed size never needs more detail
+        self.request_time = time.perf_counter()
+        if image_path.lower().endswith(".gif"):
+            self.full_resolution_requested = True  # frames are decoded at full resolution unless size is given
+            self.gif_player.play(image_path, size)
+        else:
+            self.decoder.request(image_path, self.display_size())
+
+    def draw_thumbnail(self, image_path, thumbnails):
+        """Show the cached thumbnail of image_path from thumbnails (a ThumbnailService), scaled to the canvas."""
         self.image_path = image_path
-        pix_image = QPixmap(image_path)  # make pixmap
-        if pix_image.isNull():
+        self.image_size = self.size()
+        self.full_resolution_requested = True
+        self.request_time = time.perf_counter()
+        thumbnails.request(image_path, self.image_size)
+
+    def show_thumbnail(self, image_path, side, image):
+        if self.image_size and side == thumbnail_size(self.image_size):
+            self.show_image(image_path, image, image.size())
+
+    def display_size(self):
+        return self.image_size or self.viewport().size()
+
+    def request_full_resolution(self):
+        if not self.full_resolution_requested and self.image_path and self.tiled_item is None:
+            self.full_resolution_requested = True
+            self.decoder.request(self.image_path)
+
+    def prefetch(self, paths):
+        """Decode paths into the cache ahead of time, at the size draw_image uses."""
+        self.decoder.prefetch([path for path in paths if not path.lower().endswith(".gif")], self.display_size())
+
+    def cache_stats(self):
+        cache = self.decoder.cache
+        average = sum(self.display_times) / len(self.display_times) if self.display_times else 0
+        return {'hits': cache.hits, 'misses': cache.misses, 'hit_rate': cache.hit_rate(),
+                'cached_bytes': cache.bytes, 'average_time_to_display': average}
+
+    def show_image(self, image_path, image, source_size):
+        tiled = needs_tiling(source_size) and not self.image_size and not image_path.lower().endswith(".gif")
+        if image_path != self.image_path or (image.isNull() and not tiled):  # too large images are only tiled
             return
 
-        if size:
-            pix_image = pix_image.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        self.pix_item.setPixmap(pix_image)
-        self.setSceneRect(QRectF(0.0, 0.0, pix_image.width(),
-                                 pix_image.height()))  # update the rect so it isn't retarded like by default -- center image
-        self.fit_in_view()
+        if image_path == self.shown_path:  # a sharper version of the image on screen, keep the zoom and position
+            if not image.isNull():
+                self.set_pixmap(QPixmap.fromImage(image))
+            return
 
-        if self.image_path.lower().endswith(".gif"):
-            self.play_gif(self.image_path, size=size)
+        self.shown_path = image_path
+        self.display_times.append(time.perf_counter() - self.request_time)
+        # the scene rect always has the dimensions of the full resolution image
+        self.setSceneRect(QRectF(0.0, 0.0, source_size.width(), source_size.height()))
+        self.remove_tiled_item()
+        if tiled:
+            self.tiled_item = TiledImageItem(image_path, source_size, QPixmap.fromImage(image))
+            self.imageScene.addItem(self.tiled_item)
+            self.pix_item.hide()
         else:
-            self.movie.stop()
+            self.set_pixmap(QPixmap.fromImage(image))
+        self.fit_in_view()
+
+        if not image_path.lower().endswith(".gif"):
+            self.gif_player.stop()
+
+    def set_pixmap(self, pixmap):
+        """Show pixmap stretched over the whole scene rect, whatever resolution it was decoded at."""
+        self.base_pixmap = pixmap
+        self.fit_frames.clear()
+        self.show_pixmap(pixmap)
+        self.apply_fit_frame()
+
+    def show_pixmap(self, pixmap):
+        self.pix_item.setPixmap(pixmap)
+        if pixmap.width():
+            self.pix_item.setScale(self.sceneRect().width() / pixmap.width())
+
+    def apply_fit_frame(self):
+        """
+        While the image is fitted to the window, show base_pixmap pre-scaled to its size on screen,
+        so repaints draw it 1:1 instead of resampling the whole pixmap every frame.
+        """
+        if (not self.fitted or self.interacting or self.tiled_item is not None or self.base_pixmap.isNull()
+                or self.gif_player.is_running()):
+            return
+
+        scale = abs(self.transform().determinant()) ** 0.5
+        size = QSize(round(self.sceneRect().width() * scale), round(self.sceneRect().height() * scale))
+        if size.isEmpty() or size.width() >= self.base_pixmap.width():
+            self.show_pixmap(self.base_pixmap)
+            return
+
+        key = (size.width(), size.height())
+        frame = self.fit_frames.get(key)
+        if frame is None:
+            frame = self.base_pixmap.scaled(size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+            self.fit_frames[key] = frame
+            while len(self.fit_frames) > self.FIT_FRAMES:
+                self.fit_frames.popitem(last=False)
+        self.fit_frames.move_to_end(key)
+        self.show_pixmap(frame)
+
+    def begin_interaction(self):
+        if not self.interacting:
+            self.interacting = True
+            self.setRenderHint(QPainter.SmoothPixmapTransform, False)
+            self.pix_item.setTransformationMode(Qt.FastTransformation)
+        self.interaction_timer.start()
+
+    def end_interaction(self):
+        self.interacting = False
+        self.setRenderHint(QPainter.SmoothPixmapTransform, True)
+        self.pix_item.setTransformationMode(Qt.SmoothTransformation)
+        self.apply_fit_frame()
+        self.viewport().update()
+
+    def frame_stats(self):
+        """Average paint time in seconds while interacting and while idle."""
+        return {interacting: sum(times) / len(times) if times else 0 for interacting, times in self.frame_times.items()}
+
+    def paintEvent(self, event):
+        start = time.perf_counter()
+        super().paintEvent(event)
+        self.frame_times[self.interacting].append(time.perf_counter() - start)
+
+    def remove_tiled_item(self):
+        if self.tiled_item is not None:
+            self.tiled_item.cancel()
+            self.imageScene.removeItem(self.tiled_item)
+            self.tiled_item = None
+            self.pix_item.show()
 
     def fit_in_view(self):
         self.fitInView(self.sceneRect(), Qt.KeepAspectRatio)
+        self.fitted = True
+        self.apply_fit_frame()
 
-    def play_gif(self, path, size=None):
-        if self.movie.state() == QMovie.Running:
-            self.movie.stop()
-        self.movie.setFileName(path)
-        if size:
-            self.movie.setScaledSize(size)
-        self.movie.start()
+    def unfit(self):
+        """Zoomed or dragged away from the fitted view, show the pixmap with all its detail."""
+        if self.fitted:
+            self.fitted = False
+            self.show_pixmap(self.base_pixmap)
 
-    def update_gif(self):
-        self.pix_item.setPixmap(self.movie.currentPixmap())
+    def update_gif(self, pixmap):
+        if self.gif_player.path == self.shown_path:
+            self.set_pixmap(pixmap)
 
     def flip_upside_down(self):
+        self.begin_interaction()
         if self.actionFlipUpDown.isChecked():
             self.rotate(180)  # no need to update image since the rect will stay the same - just flipped
         else:
             self.normal()
 
     def mirror(self):
+        self.begin_interaction()
         if self.actionMirror.isChecked():
             self.setTransform(QTransform().rotate(180, Qt.YAxis), combine=True)
         else:
             self.normal()
 
     def rotate_right(self):
+        self.begin_interaction()
         self.rotate(90)
 
     def rotate_left(self):
+        self.begin_interaction()
         self.rotate(-90)
 
     def normal(self):
@@ -99,28 +261,38 @@ class ImageCanvas(QGraphicsView):
         self.actionMirror.setChecked(False)
         self.resetTransform()
         self.fit_in_view()
+        self.request_full_resolution()
 
-    def save(self, file_name):
-        pix = QPixmap.grabWidget(self)
-        return pix.save(file_name)
+    def view_transform(self):
+        """The flips, mirrors and rotations applied to the image, for exporting it (see imageexport)."""
+        return normalized_transform(self.transform())
 
     def mouseDoubleClickEvent(self, event):
         """Double click to pause/unpause the playing gif (if any). """
 
-        if self.movie.state() == QMovie.Running:
-            self.movie.setPaused(True)
-        elif self.movie.state() == QMovie.Paused:
-            self.movie.setPaused(False)
+        if self.gif_player.state == GifPlayer.Running:
+            self.gif_player.set_paused(True)
+        elif self.gif_player.state == GifPlayer.Paused:
+            self.gif_player.set_paused(False)
         else:
             event.accept()
 
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.LeftButton:  # dragging the image around
+            self.begin_interaction()
+            self.unfit()
+        super().mouseMoveEvent(event)
+
     def wheelEvent(self, event):
         """ Zoom using the scroll wheel. """
 
+        self.begin_interaction()
+        self.unfit()
         old_pos = self.mapToScene(event.pos())
 
         if event.delta() > 0:  # mouse wheel away = zoom in
             self.scale(self.ZOOM_FACTOR, self.ZOOM_FACTOR)
+            self.request_full_resolution()
         else:
             self.scale(1 / self.ZOOM_FACTOR, 1 / self.ZOOM_FACTOR)
 
@@ -129,38 +301,194 @@ class ImageCanvas(QGraphicsView):
         self.translate(delta.x(), delta.y())
 
 
+class PathListModel(QAbstractListModel):
+    """
+    List model over a sequence of paths (a list, CompactSequence or PermutedSequence) narrowed by a search query.
+
+    The rows are an array of indices into the sequence, so filtering 500k paths only resets the model, and
+    paths are found through the SearchIndex instead of a scan of the rows. A list sequence (the starred images)
+    can be edited with add_path and remove_path, which only insert or remove their row.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.set_sequence([])
+
+    def set_sequence(self, paths, query=''):
+        self.sequence = paths
+        self.size = len(paths)  # paths appended to the sequence later aren't shown
+        self.search_index = SearchIndex(paths)
+        self.removed = set()  # indices of the paths removed from a list sequence, which stay in the index
+        self.set_query(query)
+
+    def set_query(self, query):
+        self.beginResetModel()
+        self.query = query
+        self.rows = None  # all of them
+        if query.strip():
+            self.rows = self.search_index.search(query)
+            del self.rows[bisect_left(self.rows, self.size):]
+        if self.removed:
+            self.rows = array('I', (i for i in (range(self.size) if self.rows is None else self.rows)
+                                    if i not in self.removed))
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.size if self.rows is None else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.rowCount():
+            return None
+        if role in (Qt.DisplayRole, Qt.ToolTipRole, Qt.UserRole):
+            return self.path(index.row())
+        return None
+
+    def path(self, row):
+        return self.sequence[row if self.rows is None else self.rows[row]]
+
+    def paths(self):
+        """The paths in the rows: the sequence itself when nothing is filtered out."""
+        if self.rows is None:
+            return self.sequence if len(self.sequence) == self.size else self.sequence[:self.size]
+        return [self.sequence[i] for i in self.rows]
+
+    def find(self, path):
+        """The index of path or None."""
+        row = self.find_row(path)
+        return self.index(row) if row >= 0 else None
+
+    def find_row(self, path):
+        """The row of path or -1."""
+        row = self.search_index.find(path)
+        if row >= self.size or row in self.removed:
+            row = -1
+        if row >= 0 and self.rows is not None:
+            row = filter_rows(self.rows, row)
+        return row
+
+    def add_path(self, path):
+        """Add path to a list sequence (the starred images), filtered like the rest."""
+        index = self.search_index.find(path)
+        if 0 <= index < self.size and index not in self.removed:
+            return
+        if index < 0:
+            index = self.size
+            self.sequence.append(path)
+            self.search_index.append(path)
+        if self.rows is None:
+            self.beginInsertRows(QModelIndex(), index, index)
+            self.size += 1
+            self.endInsertRows()
+            return
+        self.removed.discard(index)
+        self.size = max(self.size, index + 1)
+        if self.query.strip() and filter_rows(self.search_index.search(self.query), index) < 0:
+            return
+        row = bisect_left(self.rows, index)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.rows.insert(row, index)
+        self.endInsertRows()
+
+    def remove_path(self, path):
+        """Remove path from a list sequence. It stays in the sequence (and its index) as a removed entry."""
+        index = self.search_index.find(path)
+        if not 0 <= index < self.size or index in self.removed:
+            return
+        row = index if self.rows is None else filter_rows(self.rows, index)
+        if self.rows is None:
+            self.rows = array('I', range(self.size))
+        self.removed.add(index)
+        if row >= 0:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.rows[row]
+            self.endRemoveRows()
+
+
 class ListImageViewer(QSplitter):
     indexDoubleClicked = Signal(str)
     listImageViewerToggled = Signal()
     starChange = Signal(str)
-    setDefaultSequence = Signal(list)
+    starsChange = Signal(list)
+    setDefaultSequence = Signal(object)  # a list or a sequence of paths
+    loadSelected = Signal(list)
+    exportSelected = Signal(list)
+
+    FILTER_DELAY = 200  # ms after the last key press
 
     def __init__(self, parent=None, path=None):
         super().__init__(parent)
 
-        self.string_list_model = QStringListModel()
+        self.path_model = PathListModel(self)
         self.files_system_model = QFileSystemModel(nameFilterDisables=False)
         self.files_system_model.setNameFilters(SUPPORTED_FORMATS_FILTER)
         self.files_system_model.setRootPath(path)
 
-        self.tree_view = QTreeView(self)
+        self.thumbnails = ThumbnailService(settings_sibling("-thumbnails"), self)
+
+        self.list_panel = QWidget(self)
+        self.filter_edit = QLineEdit(placeholderText="Filter by name, folder or *.png")
+        self.filter_timer = QTimer(self, singleShot=True, interval=self.FILTER_DELAY)
+        self.filter_edit.textChanged.connect(self.filter_timer.start)
+        self.filter_timer.timeout.connect(self.apply_filter)
+        self.views = QStackedWidget()  # the tree view or the thumbnail grid
+        layout = QVBoxLayout(self.list_panel)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.filter_edit)
+        layout.addWidget(self.views)
+
+        self.tree_view = QTreeView()
         self.tree_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
-        self.tree_view.setModel(self.string_list_model)
+        self.tree_view.setModel(self.path_model)
         self.tree_view.doubleClicked.connect(self.apply_index)
 
         self.tree_view.currentChanged = self.currentChanged  # subclass currentChanged slot of QTreeView
 
+        self.grid_view = ThumbnailGridView(self.thumbnails)
+        self.grid_view.doubleClicked.connect(self.apply_index)
+        self.grid_view.selectionModel().currentChanged.connect(self.grid_current_changed)
+        self.grid_view.selectionModel().selectionChanged.connect(self.update_load_button)
+        self.grid_loader = ImageLoader(self)  # lists the directory shown in the grid
+        self.grid_loader.batchLoaded.connect(lambda paths: self.grid_found.extend(paths))
+        self.grid_loader.finished.connect(self.grid_loading_finished)
+        self.grid_found = []
+        self.grid_item = None  # to select once the directory is listed
+
+        self.star_selected_action = QAction("Star selected", self, triggered=lambda: self.star_selected(True))
+        self.unstar_selected_action = QAction("Unstar selected", self, triggered=lambda: self.star_selected(False))
+        self.tag_selected_action = QAction("Tag selected...", self, triggered=lambda: self.tag_selected(True))
+        self.untag_selected_action = QAction("Untag selected...", self, triggered=lambda: self.tag_selected(False))
+        self.collect_selected_action = QAction("Add selected to collection...", self, triggered=self.collect_selected)
+        self.edit_note_action = QAction("Edit note...", self, triggered=self.edit_note)
+        separator = QAction(self, separator=True)
+        for view in (self.tree_view, self.grid_view):
+            view.setContextMenuPolicy(Qt.ActionsContextMenu)
+            view.addActions([self.star_selected_action, self.unstar_selected_action, separator,
+                             self.tag_selected_action, self.untag_selected_action, self.collect_selected_action,
+                             self.edit_note_action])
+
+        self.views.addWidget(self.tree_view)
+        self.views.addWidget(self.grid_view)
+
         self.canvas = ImageCanvas(self)
+        self.thumbnails.thumbnailReady.connect(self.canvas.show_thumbnail)
 
         self.star_button = StarButton(self)
         self.set_default_sequence = QPushButton("Load selected")
+        self.grid_button = QPushButton("Grid", checkable=True)
+        self.export_button = QPushButton("Export selected")
         self.button_box = QDialogButtonBox(Qt.Vertical, self, centerButtons=True)
         self.button_box.addButton(self.star_button, QDialogButtonBox.ActionRole)
         self.button_box.addButton(self.set_default_sequence, QDialogButtonBox.ActionRole)
+        self.button_box.addButton(self.grid_button, QDialogButtonBox.ActionRole)
+        self.button_box.addButton(self.export_button, QDialogButtonBox.ActionRole)
 
         self.star_button.clicked.connect(lambda: self.handle_star(self.canvas.image_path))
         self.star_button.clicked.connect(lambda: self.starChange.emit(self.canvas.image_path))
         self.set_default_sequence.clicked.connect(self.load_selected)
+        self.grid_button.toggled.connect(self.set_grid_mode)
+        self.export_button.clicked.connect(lambda: self.exportSelected.emit(self.selected_images()))
 
         self.setChildrenCollapsible(False)
         self.resize(parent.size())
@@ -168,33 +496,88 @@ class ListImageViewer(QSplitter):
 
         self.hide()
         self.is_displayed = False
-        self.previous_model = self.string_list_model
-
-        self.image_loader_thread = ImageLoaderThread()
+        self.previous_model = self.path_model
+        self.filter_edit.setEnabled(False)
 
     def handle_star(self, path, update=True):
         if update:
             self.star_button.star_image(path)
         else:
             self.star_button.handle_star_icon(path)
-            
-        if path in self.star_button.starred_images():
-            self.string_list_model.insertRow(self.string_list_model.rowCount())
-            self.string_list_model.setData(self.string_list_model.index(self.string_list_model.rowCount() - 1, 0), path)
-            self.select_and_scroll_to(self.string_list_model.index(self.string_list_model.rowCount() - 1, 0))
-        else:
-            index = self.find_item_index(path)
-            if index:
-                self.string_list_model.removeRow(index.row())
+
+        if isinstance(self.path_model.sequence, list):  # the starred images, the other sequences aren't edited
+            if self.star_button.is_starred(path):
+                self.path_model.add_path(path)
+                index = self.find_item_index(path)
+                if index:
+                    self.select_and_scroll_to(index)
+            else:
+                self.path_model.remove_path(path)
+        self.refresh_grid()
+
+    def star_selected(self, starred=True):
+        """(Un)star the selected images all at once."""
+        changed = self.star_button.star_images(self.selected_images(), starred)
+        if not changed:
+            return
+        if isinstance(self.path_model.sequence, list):
+            self.path_model.set_sequence(self.star_button.starred_images(), self.path_model.query)
+            self.refresh_grid()
+        self.star_button.handle_star_icon(self.canvas.image_path)
+        self.starsChange.emit(changed)
+
+    def tag_selected(self, tagged=True):
+        """Ask for tags (separated by commas) and add them to or remove them from the selected images."""
+        paths = self.selected_images()
+        if not paths:
+            return
+        store = shared_tag_store()
+        current = "" if tagged else ", ".join(store.tags_of(paths[0]))
+        text, ok = QInputDialog.getText(self, "Tag selected" if tagged else "Untag selected",
+                                        "Tags, separated by commas:", QLineEdit.Normal, current)
+        names = [name.strip() for name in text.split(',') if name.strip()]
+        if ok and names:
+            if tagged:
+                store.tag(paths, names)
+            else:
+                store.untag(paths, names)
+
+    def collect_selected(self):
+        paths = self.selected_images()
+        if not paths:
+            return
+        store = shared_tag_store()
+        name, ok = QInputDialog.getItem(self, "Add selected to collection", "Collection:", store.collection_names())
+        if ok and name.strip():
+            store.add_to_collection(name.strip(), paths)
+
+    def edit_note(self):
+        """Edit the note of the first selected image."""
+        paths = self.selected_images() or [self.canvas.image_path]
+        if not paths[0]:
+            return
+        store = shared_tag_store()
+        note, ok = QInputDialog.getText(self, "Edit note", os.path.basename(paths[0]), QLineEdit.Normal,
+                                        store.note(paths[0]))
+        if ok:
+            store.set_note(paths[0], note.strip())
 
     def display(self, path, item=None):
+        """Show a directory (str) or a list or sequence of paths, which can be filtered."""
         self.previous_model = self.tree_view.model()
-        if type(path) == list:
-            self.tree_view.setModel(self.string_list_model)
-            self.string_list_model.setStringList(path)
+        self.filter_edit.blockSignals(True)
+        self.filter_edit.clear()
+        self.filter_edit.blockSignals(False)
+        self.filter_timer.stop()
+        if not isinstance(path, str):
+            self.tree_view.setModel(self.path_model)
+            self.path_model.set_sequence(path)
         else:
             self.tree_view.setModel(self.files_system_model)
             self.tree_view.setRootIndex(self.files_system_model.setRootPath(path))
+            self.thumbnails.warm_up(path, self.canvas.size())
+        self.filter_edit.setEnabled(self.tree_view.model() == self.path_model)
+        self.refresh_grid()
 
         if item:
             self.find_and_select(item)
@@ -203,24 +586,86 @@ class ListImageViewer(QSplitter):
             self.toggle_display()
             QTimer.singleShot(0, self.listImageViewerToggled.emit)  # waits for widget to show/hide before emitting
 
+    def search(self, paths, item=None):
+        """Display paths with the focus in the filter box."""
+        self.display(paths, item)
+        if self.is_displayed:
+            self.filter_edit.setFocus(Qt.ShortcutFocusReason)
+
+    def is_showing(self, paths):
+        return self.tree_view.model() == self.path_model and (self.path_model.sequence is paths or
+                                                             self.path_model.sequence == paths)
+
+    def apply_filter(self):
+        if self.tree_view.model() != self.path_model:
+            return
+        self.path_model.set_query(self.filter_edit.text())
+        self.refresh_grid()
+        if self.canvas.image_path:
+            self.find_and_select(self.canvas.image_path)
+
     def toggle_display(self):
         self.is_displayed = not self.is_displayed
         self.setVisible(self.is_displayed)
         self.setFocus(Qt.ActiveWindowFocusReason)
 
     def find_and_select(self, item):
+        if self.is_grid_mode():
+            found_item = self.grid_view.find_path(os.path.abspath(item))
+            if found_item:
+                self.grid_view.setCurrentIndex(found_item)
+                QTimer.singleShot(0, lambda: self.grid_view.scrollTo(found_item))
+            elif self.grid_loader.is_loading():
+                self.grid_item = item
+            return
         found_item = self.find_item_index(item)
         if found_item:
             self.scroll_to_index(found_item)
 
+    def is_grid_mode(self):
+        return self.views.currentWidget() is self.grid_view
+
+    def set_grid_mode(self, grid):
+        self.views.setCurrentWidget(self.grid_view if grid else self.tree_view)
+        if grid:
+            self.refresh_grid()
+        else:
+            self.grid_loader.cancel()
+            self.grid_view.set_paths([])  # drop the thumbnail requests of the hidden grid
+        self.update_load_button()
+
+    def refresh_grid(self):
+        """Show the images of the tree view's model in the grid."""
+        if not self.is_grid_mode():
+            return
+        self.grid_loader.cancel()
+        self.grid_item = None
+        if self.tree_view.model() == self.path_model:
+            self.grid_view.set_paths(self.path_model.paths(), self.path_model.find_row)
+        else:
+            self.grid_view.set_paths([])  # until the directory is listed, in the background
+            self.grid_found = []
+            self.grid_loader.load(self.files_system_model.rootPath(), scanner=DirectoryScanner(max_depth=0))
+        self.update_load_button()  # resetting the grid clears its selection without a signal
+
+    def grid_loading_finished(self):
+        self.grid_view.set_paths(sorted(self.grid_found))
+        self.update_load_button()
+        item, self.grid_item = self.grid_item, None
+        if item:
+            self.find_and_select(item)
+
+    def grid_current_changed(self, current, previous):
+        path = self.grid_view.sequence_model.path(current)
+        if path:
+            self.paint_path(path)
+            QTimer.singleShot(0, lambda: self.star_button.handle_star_icon(self.canvas.image_path))
+
     def find_item_index(self, path):
         model = self.tree_view.model()
         # print(path)
-        if model == self.string_list_model:
-            found = model.match(model.index(0, 0), Qt.DisplayRole, path, 1, Qt.MatchRecursive|Qt.MatchWrap|Qt.MatchContains)
-            # print(found)
-            if found:
-                return found[0]
+        if model == self.path_model:
+            return self.path_model.find(path)
         else:
             found = self.files_system_model.index(path)
             # print(found)
@@ -246,9 +691,15 @@ class ListImageViewer(QSplitter):
         QTimer.singleShot(0, lambda: self.star_button.handle_star_icon(self.canvas.image_path))
 
     def paint_thumbnail(self, index):
-        image_path = self.string_list_model.data(index, 0) if self.tree_view.model() == self.string_list_model \
+        image_path = self.path_model.data(index, 0) if self.tree_view.model() == self.path_model \
             else self.files_system_model.filePath(index)
-        self.canvas.draw_image(image_path, self.canvas.size())  # scale to canvas size
+        self.paint_path(image_path)
+
+    def paint_path(self, image_path):
+        if image_path.lower().endswith(".gif"):
+            self.canvas.draw_image(image_path, self.canvas.size())  # animated, played by the canvas itself
+        else:
+            self.canvas.draw_thumbnail(image_path, self.thumbnails)
 
     def apply_index(self, index):
         self.indexDoubleClicked.emit(self.canvas.image_path)
@@ -260,17 +711,28 @@ class ListImageViewer(QSplitter):
                 selection.append(os.path.abspath(self.files_system_model.filePath(index)))
         return selection
 
-    def load_selected(self):
+    def selected_images(self):
+        """The selected image files, in whichever view is showing."""
+        if self.is_grid_mode():
+            return self.grid_view.selected_paths()
         if self.tree_view.model() == self.files_system_model:
-            all_selected = []
-            selection = self.get_selected()
+            return [path for path in self.get_selected() if os.path.isfile(path)]
+        return [self.path_model.data(index, 0) for index in self.tree_view.selectedIndexes() if index.column() == 0]
 
-            stop_thread(self.image_loader_thread)
-            self.image_loader_thread = load_dir_threaded(selection, all_selected)
+    def update_load_button(self, *args):
+        """In the grid only the selected images are loaded, so there must be some."""
+        self.set_default_sequence.setEnabled(not self.is_grid_mode() or self.grid_view.selectionModel().hasSelection())
 
-            QTimer.singleShot(0, lambda: self.setDefaultSequence.emit(all_selected))
+    def load_selected(self):
+        if self.is_grid_mode():
+            selection = self.grid_view.selected_paths()
+            if selection:
+                QTimer.singleShot(0, lambda: self.setDefaultSequence.emit(selection))
+        elif self.tree_view.model() == self.files_system_model:
+            selection = self.get_selected()
+            QTimer.singleShot(0, lambda: self.loadSelected.emit(selection))
         else:
-            QTimer.singleShot(0, lambda: self.setDefaultSequence.emit(self.string_list_model.stringList()))
+            QTimer.singleShot(0, lambda: self.setDefaultSequence.emit(self.path_model.paths()))  # as filtered
 
 
 class NotificationPopupWidget(QLabel):
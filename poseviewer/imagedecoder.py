@@ -0,0 +1,192 @@
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+
+MAX_DECODE_PIXELS = 64 * 1024 * 1024  # 256 MB as a 32 bit QImage
+
+
+def decode_size(source_size, size=None, max_pixels=MAX_DECODE_PIXELS):
+    """
+    The size to decode an image of source_size at: scaled down to fit size (if given)
+    and to at most max_pixels, so huge images can't exhaust memory.
+    """
+    decoded_size = QSize(source_size)
+    if size and (decoded_size.width() > size.width() or decoded_size.height() > size.height()):
+        decoded_size.scale(size, Qt.KeepAspectRatio)
+    pixels = decoded_size.width() * decoded_size.height()
+    if pixels > max_pixels:
+        factor = (max_pixels / pixels) ** 0.5
+        decoded_size = QSize(max(int(decoded_size.width() * factor), 1), max(int(decoded_size.height() * factor), 1))
+    return decoded_size
+
+
+def decode_image(path, size=None):
+    """
+    Decode the image at path into a QImage, scaled down to fit size (a QSize) if given. Safe to call from any thread.
+    Return (image, size of the image in the file).
+
+    Formats that can't scale while decoding (all but JPEG) are decoded whole and scaled after, so images of those
+    larger than MAX_DECODE_PIXELS aren't decoded at all: the image is null (see TiledImageItem, which draws them).
+    """
+    reader = QImageReader(path)
+    source_size = reader.size()
+    if source_size.isValid():
+        decoded_size = decode_size(source_size, size)
+        if decoded_size != source_size:
+            if (source_size.width() * source_size.height() > MAX_DECODE_PIXELS and
+                    not reader.supportsOption(QImageIOHandler.ScaledSize)):
+                return QImage(), source_size
+            reader.setScaledSize(decoded_size)  # JPEGs are scaled while decoding
+    image = reader.read()
+    return image, source_size if source_size.isValid() else image.size()
+
+
+class ImageCache:
+    """
+    Least recently used cache of decoded (QImage, source size) pairs, keyed by path and target size
+    and bounded by a byte budget. Safe to use from any thread.
+    """
+
+    DEFAULT_BUDGET = 512 * 1024 * 1024
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path, size=None):
+        return path, (size.width(), size.height()) if size else None
+
+    def get(self, key):
+        """Return the cached (image, source size) (counting a hit) or None (counting a miss)."""
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._images.move_to_end(key)
+            return entry
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._images
+
+    def put(self, key, image, source_size):
+        size = image.byteCount()
+        if image.isNull() or size > self.budget:
+            return
+        with self._lock:
+            if key in self._images:
+                self.bytes -= self._images.pop(key)[0].byteCount()
+            self._images[key] = image, source_size
+            self.bytes += size
+            while self.bytes > self.budget:
+                evicted_key, (evicted, evicted_size) = self._images.popitem(last=False)
+                self.bytes -= evicted.byteCount()
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.bytes = 0
+
+    def hit_rate(self):
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0
+
+
+class ImageDecoder(QObject):
+    """
+    Decode images in worker threads.
+
+    Only the most recent request matters: requests that are still queued when a newer one arrives are skipped
+    and results of older requests are dropped, so the GUI thread only ever converts the image it is waiting for.
+    imageDecoded carries (path, QImage, size of the image in the file) and is emitted in the thread
+    of the decoder (the GUI thread).
+
+    prefetch() decodes images that are likely to be requested next into the cache with separate workers,
+    so prefetching never delays the image that is on its way to the screen.
+
+    With a farm (a DecodeFarm) the worker threads only dispatch to its processes and wait for the results.
+    """
+
+    imageDecoded = Signal(str, QImage, QSize)
+
+    _decoded = Signal(int, str, QImage, QSize)
+
+    WORKERS = 2
+    PREFETCH_WORKERS = 2
+
+    def __init__(self, parent=None, workers=WORKERS, cache=None, farm=None):
+        super().__init__(parent)
+
+        self.decode_image = farm.decode if farm else decode_image
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # a farm can keep every core busy with prefetching, threads only as many as Python can drive
+        self.prefetch_executor = ThreadPoolExecutor(
+            max_workers=max(farm.workers - workers, 1) if farm else self.PREFETCH_WORKERS)
+        self.cache = cache if cache is not None else ImageCache()
+
+        self.latest_request = 0
+        self.prefetch_generation = 0
+        self._prefetching = {}  # cache key -> Future of a running prefetch
+        self._lock = threading.Lock()
+
+        self._decoded.connect(self.handle_decoded, Qt.QueuedConnection)
+
+    def request(self, path, size=None):
+        self.latest_request += 1
+        cached = self.cache.get(ImageCache.key(path, size))
+        if cached is not None:
+            self.imageDecoded.emit(path, *cached)
+        else:
+            self.executor.submit(self._decode, self.latest_request, path, size)
+
+    def prefetch(self, paths, size=None):
+        """Decode paths into the cache, in order. Replaces the previous prefetch list."""
+        self.prefetch_generation += 1
+        for path in paths:
+            key = ImageCache.key(path, size)
+            if key not in self.cache:
+                self.prefetch_executor.submit(self._prefetch, self.prefetch_generation, key, path, size)
+
+    def _decode(self, request, path, size):
+        if request != self.latest_request:  # the user has already moved on
+            return
+
+        key = ImageCache.key(path, size)
+        with self._lock:
+            prefetching = self._prefetching.get(key)
+        image, source_size = prefetching.result() if prefetching else self.decode_image(path, size)
+
+        self.cache.put(key, image, source_size)
+        self._decoded.emit(request, path, image, source_size)
+
+    def _prefetch(self, generation, key, path, size):
+        if generation != self.prefetch_generation or key in self.cache:
+            return
+        with self._lock:
+            if key in self._prefetching:
+                return
+            self._prefetching[key] = future = Future()
+        image, source_size = QImage(), QSize()
+        try:
+            image, source_size = self.decode_image(path, size)
+            self.cache.put(key, image, source_size)
+        finally:
+            future.set_result((image, source_size))
+            with self._lock:
+                del self._prefetching[key]
+
+    def handle_decoded(self, request, path, image, source_size):
+        if request == self.latest_request:
+            self.imageDecoded.emit(path, image, source_size)
@@ -0,0 +1,118 @@
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+EXPORT_QUALITY = 95
+
+
+def normalized_transform(transform):
+    """
+    The flips, mirrors and rotations of a view transform, without its zoom and position.
+    Views only rotate by multiples of 90 degrees, so the result maps pixels exactly onto pixels.
+    """
+    scale = abs(transform.determinant()) ** 0.5 or 1
+    return QTransform(round(transform.m11() / scale), round(transform.m12() / scale),
+                      round(transform.m21() / scale), round(transform.m22() / scale), 0, 0)
+
+
+def export_image(path, file_name, transform=None, quality=EXPORT_QUALITY):
+    """
+    Decode the image at path at full resolution, apply transform (see normalized_transform) and save it
+    as file_name, in the format of its extension. Safe to call from any thread. Return whether it succeeded.
+    """
+    image = QImageReader(path).read()
+    if image.isNull():
+        return False
+    if transform is not None and not transform.isIdentity():
+        image = image.transformed(transform)
+    return image.save(file_name, None, quality)
+
+
+def unique_file_name(dir_path, name, taken):
+    """Return a path for name in dir_path that neither exists nor is in taken, adding a number if needed."""
+    base, ext = os.path.splitext(name)
+    file_name = os.path.join(dir_path, name)
+    number = 1
+    while file_name in taken or os.path.exists(file_name):
+        file_name = os.path.join(dir_path, "{} ({}){}".format(base, number, ext))
+        number += 1
+    taken.add(file_name)
+    return file_name
+
+
+class ImageExporter(QObject):
+    """
+    Export images at full resolution with a view transform applied, in worker threads.
+
+    exported carries (source path, file name, success) for every image, progress (done, total)
+    and finished (exported, failed) once a batch is done. All are emitted in the GUI thread.
+    """
+
+    exported = Signal(str, str, bool)
+    progress = Signal(int, int)
+    finished = Signal(int, int)
+
+    _exported = Signal(int, str, str, bool)
+
+    WORKERS = min(os.cpu_count() or 2, 4)  # every worker holds a full resolution image or two
+
+    def __init__(self, parent=None, workers=WORKERS):
+        super().__init__(parent)
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.generation = 0
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+
+        self._exported.connect(self.handle_exported, Qt.QueuedConnection)
+
+    def export(self, path, file_name, transform=None):
+        self.export_files([(path, file_name)], transform)
+
+    def export_batch(self, paths, dir_path, transform=None):
+        """Export paths into dir_path, keeping their names."""
+        taken = set()
+        self.export_files([(path, unique_file_name(dir_path, os.path.basename(path), taken)) for path in paths], transform)
+
+    def export_files(self, files, transform=None):
+        """Export a list of (source path, file name). Replaces a batch that is still running."""
+        self.cancel()
+        self.total = len(files)
+        self.succeeded = self.failed = 0
+        generation = self.generation
+        for path, file_name in files:
+            self.executor.submit(self._export, generation, path, file_name, transform)
+        if not files:
+            self.finished.emit(0, 0)
+
+    def cancel(self):
+        """Skip the images of the current batch that haven't started yet."""
+        self.generation += 1
+
+    def is_exporting(self):
+        return self.succeeded + self.failed < self.total
+
+    def _export(self, generation, path, file_name, transform):
+        if generation != self.generation:
+            return
+        try:
+            ok = export_image(path, file_name, transform)
+        except Exception:
+            ok = False
+        self._exported.emit(generation, path, file_name, ok)
+
+    def handle_exported(self, generation, path, file_name, ok):
+        if generation != self.generation:
+            return
+        if ok:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self.exported.emit(path, file_name, ok)
+        self.progress.emit(self.succeeded + self.failed, self.total)
+        if not self.is_exporting():
+            self.finished.emit(self.succeeded, self.failed)
@@ -1,46 +1,213 @@
-﻿import threading
+﻿import queue
+import threading
+import time
 import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 
 SUPPORTED_FORMATS_EXTENSIONS = (".bmp", ".gif", ".jpg", ".jpeg", ".png", ".pbm", ".pgm", ".ppm", ".xbm", ".xpm")
 
+DEFAULT_SCAN_WORKERS = min(16, (os.cpu_count() or 1) * 2)
+
+
+def is_supported_image(path):
+    return path.lower().endswith(SUPPORTED_FORMATS_EXTENSIONS)
+
+
+class DirectoryScanner:
+    """
+    Recursively walk directory trees with os.scandir.
+
+    Every directory is listed by a worker from a thread pool, so independent subtrees are scanned in parallel
+    (scandir releases the GIL while it waits on the disk). Results are deduplicated with a hash set keyed by
+    (st_dev, st_ino), which also catches hardlinks, symlinks and overlapping selections.
+
+    max_depth -- how many levels of subdirectories to descend into (0 = only the given directories, None = unlimited)
+    follow_symlinks -- descend into symlinked directories (loops are detected and skipped)
+    """
+
+    def __init__(self, max_depth=None, follow_symlinks=False, workers=DEFAULT_SCAN_WORKERS, stop_event=None):
+        self.max_depth = max_depth
+        self.follow_symlinks = follow_symlinks
+        self.workers = workers
+        self.stop_event = stop_event or threading.Event()
+
+        self._seen_files = set()
+        self._seen_dirs = set()
+
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def scan(self, paths):
+        """Yield absolute image paths found in paths (a single path or a list of files and directories)."""
+        for batch in self.scan_batches(paths):
+            yield from batch
+
+    def scan_batches(self, paths):
+        """Yield lists of new image paths, one list per scanned directory."""
+        if isinstance(paths, str):
+            paths = [paths]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = set()
+            files = []
+            for path in paths:
+                path = os.path.abspath(path)
+                if os.path.isdir(path):
+                    if self._first_visit(_path_key(path)):
+                        pending.add(pool.submit(self._scan_dir, path, 0))
+                elif self._first_seen(_path_key(path)):
+                    files.append(path)
+            if files:
+                yield files
+
+            try:
+                while pending and not self.stopped():
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        images, subdirs, depth = future.result()
+                        for subdir, key in subdirs:
+                            if self._first_visit(key):
+                                pending.add(pool.submit(self._scan_dir, subdir, depth + 1))
+
+                        batch = [path for path, key in images if self._first_seen(key)]
+                        if batch:
+                            yield batch
+            finally:  # stopped or the consumer lost interest
+                for future in pending:
+                    future.cancel()
+
+    def _first_seen(self, key):
+        if key in self._seen_files:
+            return False
+        self._seen_files.add(key)
+        return True
+
+    def _first_visit(self, key):
+        if key in self._seen_dirs:
+            return False
+        self._seen_dirs.add(key)
+        return True
+
+    def _scan_dir(self, dir_path, depth):
+        """Runs in a worker thread. Return the images and subdirectories of dir_path."""
+        images, subdirs = [], []
+        if not self.stopped():
+            try:
+                images, subdirs = self._list_dir(dir_path, self.max_depth is None or depth < self.max_depth)
+            except OSError:
+                pass
+        return images, subdirs, depth
+
+    def _list_dir(self, dir_path, descend):
+        images = []
+        subdirs = []
+        dir_dev = os.stat(dir_path).st_dev
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        if is_supported_image(entry.name):
+                            images.append((entry.path, _entry_key(entry, dir_dev)))
+                    elif descend and entry.is_dir(follow_symlinks=self.follow_symlinks):
+                        subdirs.append((entry.path, _entry_key(entry, dir_dev)))
+                except OSError:  # broken symlink, permission denied, file removed while scanning ...
+                    continue
+        return images, subdirs
+
+
+def _entry_key(entry, dir_dev):
+    """Identity of a directory entry. Entries that aren't symlinks live on the same device as their directory."""
+    if os.name == 'nt':  # st_ino of a DirEntry isn't filled in on Windows
+        return _path_key(entry.path)
+    if entry.is_symlink():
+        stat = entry.stat()
+        return stat.st_dev, stat.st_ino
+    return dir_dev, entry.inode()
+
+
+def _path_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return os.path.normcase(path)
+    if os.name == 'nt' or not stat.st_ino:
+        return os.path.normcase(os.path.realpath(path))
+    return stat.st_dev, stat.st_ino
+
 
 class ImageLoaderThread(threading.Thread):
-    def __init__(self, *args, sequence=None, dir_path=None, **kwargs):
+    """
+    Scan dir_path (a path or a list of paths) and stream the found images to on_batch(paths, total)
+    in batches of up to batch_size paths. The first image is delivered on its own so it can be shown
+    right away, after that a batch is also delivered once it has waited for more than BATCH_INTERVAL seconds,
+    even while the scanner is stuck in a slow directory. on_finished(cancelled) is called once scanning is done.
+    """
+
+    BATCH_SIZE = 512
+    BATCH_INTERVAL = 0.1
+
+    def __init__(self, *args, dir_path=None, scanner=None, on_batch=None, on_finished=None,
+                 batch_size=BATCH_SIZE, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self._stop_event = threading.Event()
-        self._first_image_ready = threading.Event()
+        self.scanner = scanner or DirectoryScanner()
+        self._stop_event = self.scanner.stop_event
 
         self.dir_path = dir_path
-        self.sequence = sequence  # this is a reference to the original
+        self.batch_size = batch_size
+        self.on_batch = on_batch or (lambda paths, total: None)
+        self.on_finished = on_finished or (lambda cancelled: None)
+        self.total = 0
+        self.last_flush = time.perf_counter()
 
     def run(self):
-        if type(self.dir_path) == list:  # we got a list of paths
-            for path in self.dir_path:
-                if os.path.isdir(path):
-                    self.load_dir(path)
-                else:
-                    self.append_and_notify(os.path.abspath(path))
-        elif os.path.isfile(self.dir_path):
-            self.append_and_notify(os.path.abspath(self.dir_path))
-        else:                            # we got only a single path
-            self.load_dir(self.dir_path)
-
-    def load_dir(self, dir_path):
-        dir_path = os.path.abspath(dir_path)
-        for path in os.listdir(dir_path):
-            if self.stopped():
-                return
-
-            path = os.path.join(dir_path, path)
-            if path.lower().endswith(SUPPORTED_FORMATS_EXTENSIONS) and path not in self.sequence:
-                self.append_and_notify(path)
-
-    def append_and_notify(self, path):
-        self.sequence.append(path)
-        if not self._first_image_ready.is_set():
-            self._first_image_ready.set()
+        results = queue.Queue()
+        scan = threading.Thread(target=self._scan, args=(results,), daemon=True)
+        scan.start()
+        pending = []
+        try:
+            while True:
+                try:
+                    paths = results.get(timeout=self.BATCH_INTERVAL)
+                except queue.Empty:
+                    paths = ()  # nothing new, but what is pending has waited long enough
+                if paths is None:  # the scan is done
+                    break
+                if self.stopped():
+                    return
+                pending.extend(paths)
+                if self.total == 0 and pending:
+                    self.flush(pending[:1])
+                    del pending[:1]
+
+                while len(pending) >= self.batch_size:
+                    self.flush(pending[:self.batch_size])
+                    del pending[:self.batch_size]
+                if pending and time.perf_counter() - self.last_flush >= self.BATCH_INTERVAL:
+                    self.flush(pending)
+                    pending = []
+
+            if pending and not self.stopped():
+                self.flush(pending)
+        finally:
+            scan.join()
+            self.on_finished(self.stopped())
+
+    def _scan(self, results):
+        """Put the batches of the scanner into results, then None."""
+        try:
+            for paths in self.scanner.scan_batches(self.dir_path):
+                results.put(paths)
+                if self.stopped():
+                    return
+        finally:
+            results.put(None)
+
+    def flush(self, paths):
+        self.total += len(paths)
+        self.last_flush = time.perf_counter()
+        self.on_batch(paths, self.total)
 
     def stop(self):
         self._stop_event.set()
@@ -49,13 +216,6 @@ class ImageLoaderThread(threading.Thread):
         return self._stop_event.is_set()
 
 
-def load_dir_threaded(path, sequence):
-    image_loader_thread = ImageLoaderThread(sequence=sequence, dir_path=path, daemon=True)
-    image_loader_thread.start()
-    image_loader_thread._first_image_ready.wait()
-    return image_loader_thread
-
-
 def stop_thread(thread):
     if thread.is_alive():
         thread.stop()
@@ -0,0 +1,337 @@
+"""
+Read image dimensions, format and frame count from file headers, without decoding any pixels.
+"""
+
+import os
+import re
+import struct
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+
+
+class ImageMetadata(namedtuple('ImageMetadata', 'width height format frames exif_orientation')):
+    """
+    exif_orientation is the EXIF orientation tag (1 = as stored, 5-8 = rotated by 90 degrees).
+    width and height are the stored dimensions, displayed_size() takes the EXIF rotation into account.
+    """
+
+    def displayed_size(self):
+        if self.exif_orientation in (5, 6, 7, 8):
+            return self.height, self.width
+        return self.width, self.height
+
+    @property
+    def orientation(self):
+        width, height = self.displayed_size()
+        if width > height:
+            return 'landscape'
+        elif width < height:
+            return 'portrait'
+        return 'square'
+
+    @property
+    def pixels(self):
+        return self.width * self.height
+
+
+class HeaderError(Exception):
+    pass
+
+
+def read_metadata(path):
+    """Return the ImageMetadata of the image at path or None if its header can't be understood."""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(32)
+            for signature, reader in _READERS:
+                if head.startswith(signature):
+                    f.seek(0)
+                    return reader(f)
+    except (OSError, HeaderError, struct.error):
+        pass
+    return None
+
+
+def _read(f, size):
+    """Read exactly size bytes, a truncated file is a HeaderError."""
+    data = f.read(size)
+    if len(data) < size:
+        raise HeaderError("truncated header")
+    return data
+
+
+def _read_jpeg(f):
+    f.seek(2)
+    exif_orientation = 1
+    while True:
+        byte = f.read(1)
+        if not byte:
+            raise HeaderError("no SOF marker")
+        if byte != b'\xff':
+            continue
+        marker = _read(f, 1)
+        while marker == b'\xff':  # fill bytes
+            marker = _read(f, 1)
+        marker = ord(marker)
+        if marker == 0x01 or 0xd0 <= marker <= 0xd7:  # markers without a length
+            continue
+
+        length, = struct.unpack('>H', _read(f, 2))
+        if length < 2:
+            raise HeaderError("invalid segment length")
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            precision, height, width = struct.unpack('>BHH', _read(f, 5))
+            return ImageMetadata(width, height, 'jpeg', 1, exif_orientation)
+        elif marker == 0xe1:
+            segment = _read(f, length - 2)
+            if segment.startswith(b'Exif\x00\x00'):
+                exif_orientation = _exif_orientation(segment[6:])
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def _exif_orientation(tiff):
+    byte_order = '<' if tiff[:2] == b'II' else '>'
+    ifd_offset, = struct.unpack(byte_order + 'I', tiff[4:8])
+    entries, = struct.unpack(byte_order + 'H', tiff[ifd_offset:ifd_offset + 2])
+    for i in range(entries):
+        entry = ifd_offset + 2 + i * 12
+        tag, value_type, count, value = struct.unpack(byte_order + 'HHIH', tiff[entry:entry + 10])
+        if tag == 0x0112:
+            return value if 1 <= value <= 8 else 1
+    return 1
+
+
+def _read_png(f):
+    f.seek(8)
+    length, chunk_type = struct.unpack('>I4s', _read(f, 8))
+    if chunk_type != b'IHDR':
+        raise HeaderError("missing IHDR")
+    width, height = struct.unpack('>II', _read(f, 8))
+    f.seek(length - 8 + 4, os.SEEK_CUR)  # rest of IHDR and its CRC
+
+    frames = 1
+    while True:  # animated PNGs announce their frame count in an acTL chunk before the image data
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'acTL':
+            frames, = struct.unpack('>I', _read(f, 4))
+            break
+        if chunk_type == b'IDAT':
+            break
+        f.seek(length + 4, os.SEEK_CUR)
+    return ImageMetadata(width, height, 'png', frames, 1)
+
+
+def _read_gif(f):
+    header = _read(f, 13)
+    width, height, flags = struct.unpack('<HHB', header[6:11])
+    if flags & 0x80:  # global color table
+        f.seek(3 * 2 ** ((flags & 0x07) + 1), os.SEEK_CUR)
+
+    frames = 0
+    while True:  # count image descriptors, skipping over their data sub-blocks
+        block = f.read(1)
+        if not block or block == b'\x3b':  # trailer
+            break
+        elif block == b'\x21':  # extension
+            f.seek(1, os.SEEK_CUR)
+            _skip_sub_blocks(f)
+        elif block == b'\x2c':  # image descriptor
+            frames += 1
+            descriptor = _read(f, 9)
+            if descriptor[8] & 0x80:  # local color table
+                f.seek(3 * 2 ** ((descriptor[8] & 0x07) + 1), os.SEEK_CUR)
+            f.seek(1, os.SEEK_CUR)  # LZW minimum code size
+            _skip_sub_blocks(f)
+        else:
+            break
+    return ImageMetadata(width, height, 'gif', max(frames, 1), 1)
+
+
+def _skip_sub_blocks(f):
+    while True:
+        size = f.read(1)
+        if not size or size == b'\x00':
+            return
+        f.seek(size[0], os.SEEK_CUR)
+
+
+def _read_bmp(f):
+    header = _read(f, 26)
+    dib_size, = struct.unpack('<I', header[14:18])
+    if dib_size == 12:  # OS/2 BITMAPCOREHEADER
+        width, height = struct.unpack('<HH', header[18:22])
+    else:
+        width, height = struct.unpack('<ii', header[18:26])
+    return ImageMetadata(abs(width), abs(height), 'bmp', 1, 1)
+
+
+_PNM_FORMATS = {b'1': 'pbm', b'4': 'pbm', b'2': 'pgm', b'5': 'pgm', b'3': 'ppm', b'6': 'ppm'}
+_PNM_TOKEN = re.compile(rb'(?:\s|#[^\n]*\n)+(\d+)(?=\s)')  # a number cut off by the end of the file doesn't count
+
+
+def _read_pnm(f):
+    head = f.read(1024)
+    if head[1:2] not in _PNM_FORMATS:
+        raise HeaderError("unknown PNM type")
+    width_match = _PNM_TOKEN.match(head, 2)
+    height_match = width_match and _PNM_TOKEN.match(head, width_match.end())
+    if not height_match:
+        raise HeaderError("no PNM size")
+    return ImageMetadata(int(width_match.group(1)), int(height_match.group(1)), _PNM_FORMATS[head[1:2]], 1, 1)
+
+
+_XBM_SIZE = re.compile(rb'#define\s+\S*_width\s+(\d+)\s+#define\s+\S*_height\s+(\d+)')
+_XPM_SIZE = re.compile(rb'"\s*(\d+)\s+(\d+)\s+\d+\s+\d+')
+
+
+def _read_xbm(f):
+    match = _XBM_SIZE.search(f.read(1024))
+    if not match:
+        raise HeaderError("no XBM size")
+    return ImageMetadata(int(match.group(1)), int(match.group(2)), 'xbm', 1, 1)
+
+
+def _read_xpm(f):
+    match = _XPM_SIZE.search(f.read(4096))
+    if not match:
+        raise HeaderError("no XPM values")
+    return ImageMetadata(int(match.group(1)), int(match.group(2)), 'xpm', 1, 1)
+
+
+_READERS = [
+    (b'\xff\xd8', _read_jpeg),
+    (b'\x89PNG\r\n\x1a\n', _read_png),
+    (b'GIF87a', _read_gif),
+    (b'GIF89a', _read_gif),
+    (b'BM', _read_bmp),
+    (b'P1', _read_pnm), (b'P2', _read_pnm), (b'P3', _read_pnm),
+    (b'P4', _read_pnm), (b'P5', _read_pnm), (b'P6', _read_pnm),
+    (b'#define', _read_xbm),
+    (b'/* XPM */', _read_xpm),
+]
+
+
+class MetadataCache:
+    """
+    Probe image headers in a thread pool and cache the results by (path, size, mtime).
+
+    With a db_path the cache is kept in an SQLite database, so headers are only read once per file version.
+    """
+
+    PROBE_CHUNK = 64
+    WORKERS = 4
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS metadata (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            width INTEGER,
+            height INTEGER,
+            format TEXT,
+            frames INTEGER,
+            exif_orientation INTEGER
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db_path=None, workers=WORKERS):
+        self.db_path = db_path
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        self._lock = threading.Lock()
+        self._cache = None  # path -> (size, mtime, ImageMetadata), loaded on first use
+        self._dirty = {}
+        self.generation = 0
+
+    def get(self, path):
+        """Return the cached metadata of path (without checking the file) or None."""
+        entry = self._entries().get(path)
+        return entry[2] if entry else None
+
+    def file_stat(self, path):
+        """Return the (size, mtime) path had when it was probed (without checking the file) or None."""
+        entry = self._entries().get(path)
+        return entry[:2] if entry else None
+
+    def probe(self, path):
+        """Return the metadata of path, reading its header if the cached entry is missing or stale."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        entry = self._entries().get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+            return entry[2]
+
+        metadata = read_metadata(path)
+        if metadata is not None:
+            with self._lock:
+                self._cache[path] = self._dirty[path] = (stat.st_size, stat.st_mtime, metadata)
+        return metadata
+
+    def probe_async(self, paths, callback):
+        """
+        Probe paths in the thread pool. callback([(path, ImageMetadata or None), ...]) is called
+        from a worker thread for every chunk of PROBE_CHUNK paths. cancel() drops chunks that haven't started yet.
+        """
+        generation = self.generation
+        futures = []
+        for i in range(0, len(paths), self.PROBE_CHUNK):
+            futures.append(self.executor.submit(self._probe_chunk, paths[i:i + self.PROBE_CHUNK], callback, generation))
+        return futures
+
+    def cancel(self):
+        self.generation += 1
+
+    def _probe_chunk(self, paths, callback, generation):
+        if generation != self.generation:
+            return
+        callback([(path, self._probe_safely(path)) for path in paths])
+
+    def _probe_safely(self, path):
+        """probe(path), None if it fails in any way: one broken file mustn't cost the rest of its chunk."""
+        try:
+            return self.probe(path)
+        except Exception:
+            return None
+
+    def _entries(self):
+        if self._cache is None:
+            with self._lock:
+                if self._cache is None:
+                    self._cache = self._load()
+        return self._cache
+
+    @contextmanager
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with closing(sqlite3.connect(self.db_path)) as connection:
+            connection.executescript(self.SCHEMA)
+            with connection:
+                yield connection
+
+    def _load(self):
+        if not self.db_path:
+            return {}
+        with self._connect() as connection:
+            return {path: (size, mtime, ImageMetadata(*values))
+                    for path, size, mtime, *values in connection.execute("SELECT * FROM metadata")}
+
+    def save(self):
+        """Write the newly probed entries to the database."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not self.db_path or not dirty:
+            return
+        with self._connect() as connection:
+            connection.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [(path, size, mtime) + tuple(metadata)
+                                    for path, (size, mtime, metadata) in dirty.items()])
@@ -0,0 +1,194 @@
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import closing, contextmanager
+
+from .imageloader import DirectoryScanner, is_supported_image, _entry_key
+
+
+CachedDir = namedtuple('CachedDir', 'mtime dev ino link files subdirs')
+
+
+class LibraryIndex:
+    """
+    Persistent on-disk index of scanned directories.
+
+    For every directory the index records its mtime, its images (with size and mtime) and its subdirectories.
+    Adding or removing an entry changes the mtime of its parent directory, so a directory whose mtime
+    still matches the index is served from the index without being listed again.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            parent TEXT,
+            mtime REAL,
+            dev INTEGER,
+            ino INTEGER,
+            link INTEGER
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+        CREATE TABLE IF NOT EXISTS files (
+            dir TEXT,
+            name TEXT,
+            ino INTEGER,
+            size INTEGER,
+            mtime REAL,
+            PRIMARY KEY (dir, name)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    @contextmanager
+    def connect(self):
+        """A connection for a with block, committed (or rolled back) and closed at its end."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with closing(sqlite3.connect(self.db_path)) as connection:
+            connection.executescript(self.SCHEMA)
+            with connection:
+                yield connection
+
+    def scanner(self, **kwargs):
+        """Return a DirectoryScanner that reads and updates this index."""
+        return IndexedDirectoryScanner(self, **kwargs)
+
+    def scan(self, paths, **kwargs):
+        return self.scanner(**kwargs).scan(paths)
+
+    def load(self, roots):
+        """Return {dir_path: CachedDir} for every indexed directory under roots."""
+        cached = {}
+        with self.connect() as connection:
+            for root in roots:
+                for path, mtime, dev, ino, link in connection.execute(
+                        "SELECT path, mtime, dev, ino, link FROM dirs WHERE " + _SUBTREE.format('path'), _subtree(root)):
+                    cached[path] = CachedDir(mtime, dev, ino, link, [], [])
+
+                for dir_path, name, ino in connection.execute(
+                        "SELECT dir, name, ino FROM files WHERE " + _SUBTREE.format('dir'), _subtree(root)):
+                    if dir_path in cached:
+                        cached[dir_path].files.append((name, ino))
+
+            for path in list(cached):
+                parent = os.path.dirname(path)
+                if parent in cached and parent != path:
+                    cached[parent].subdirs.append(path)
+        return cached
+
+    def update(self, listings):
+        """Replace the stored contents of the rescanned directories in listings."""
+        with self.connect() as connection:
+            for dir_path, (mtime, dev, ino, files, subdirs) in listings.items():
+                stored_subdirs = {row[0] for row in connection.execute("SELECT path FROM dirs WHERE parent = ?",
+                                                                       (dir_path,))}
+                for removed in stored_subdirs.difference(subdir[0] for subdir in subdirs):
+                    self._forget(connection, removed)
+
+                connection.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, "
+                                   "COALESCE((SELECT link FROM dirs WHERE path = ?), 0))",
+                                   (dir_path, os.path.dirname(dir_path), mtime, dev, ino, dir_path))
+                connection.executemany("INSERT OR IGNORE INTO dirs VALUES (?, ?, NULL, ?, ?, ?)",
+                                       [(path, dir_path, subdir_dev, subdir_ino, subdir_link)
+                                        for path, subdir_dev, subdir_ino, subdir_link in subdirs])
+                connection.execute("DELETE FROM files WHERE dir = ?", (dir_path,))
+                connection.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                                       [(dir_path,) + file_info for file_info in files])
+
+    def forget(self, dir_path):
+        with self.connect() as connection:
+            self._forget(connection, dir_path)
+
+    def _forget(self, connection, dir_path):
+        connection.execute("DELETE FROM dirs WHERE path = ? OR " + _SUBTREE.format('path'),
+                           (dir_path,) + _subtree(dir_path))
+        connection.execute("DELETE FROM files WHERE dir = ? OR " + _SUBTREE.format('dir'),
+                           (dir_path,) + _subtree(dir_path))
+
+
+# Range query over every path below a directory, so the primary key index can be used instead of LIKE.
+_SUBTREE = "({0} = ? OR ({0} >= ? AND {0} < ?))"
+
+
+def _subtree(dir_path):
+    dir_path = os.path.abspath(dir_path)
+    prefix = os.path.join(dir_path, '')
+    return dir_path, prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class IndexedDirectoryScanner(DirectoryScanner):
+    """
+    A DirectoryScanner that serves unchanged directories from a LibraryIndex.
+    Directories whose mtime changed are listed again and written back to the index when the scan ends.
+    """
+
+    def __init__(self, index, **kwargs):
+        super().__init__(**kwargs)
+        self.index = index
+        self._lock = threading.Lock()
+        self._cached = {}
+        self._listings = {}
+
+    def scan_batches(self, paths):
+        if isinstance(paths, str):
+            paths = [paths]
+        self._cached = self.index.load([os.path.abspath(path) for path in paths if os.path.isdir(path)])
+        self._listings = {}
+        try:
+            yield from super().scan_batches(paths)
+        finally:
+            self.index.update(self._listings)
+
+    def _list_dir(self, dir_path, descend):
+        dir_stat = os.stat(dir_path)
+        cached = self._cached.get(dir_path)
+        if cached is None or cached.mtime != dir_stat.st_mtime:
+            cached = self._rescan_dir(dir_path, dir_stat)
+
+        images = [(os.path.join(dir_path, name), _key(dir_stat.st_dev, ino, os.path.join(dir_path, name)))
+                  for name, ino in cached.files]
+        subdirs = []
+        if descend:
+            for subdir in cached.subdirs:
+                info = self._cached.get(subdir)
+                if info is not None and (self.follow_symlinks or not info.link):
+                    subdirs.append((subdir, _key(info.dev, info.ino, subdir)))
+        return images, subdirs
+
+    def _rescan_dir(self, dir_path, dir_stat):
+        """Runs in a worker thread. List dir_path and remember the listing for the index."""
+        files = []
+        subdirs = []
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        if is_supported_image(entry.name):
+                            stat = entry.stat()
+                            dev, ino = _dev_ino(_entry_key(entry, dir_stat.st_dev))
+                            files.append((entry.name, ino, stat.st_size, stat.st_mtime))
+                    elif entry.is_dir():
+                        dev, ino = _dev_ino(_entry_key(entry, dir_stat.st_dev))
+                        subdirs.append((entry.path, dev, ino, entry.is_symlink()))
+                except OSError:
+                    continue
+
+        with self._lock:
+            self._listings[dir_path] = (dir_stat.st_mtime, dir_stat.st_dev, dir_stat.st_ino, files, subdirs)
+            for path, dev, ino, link in subdirs:
+                cached = self._cached.get(path)
+                if cached is None or (cached.dev, cached.ino, cached.link) != (dev, ino, link):
+                    self._cached[path] = CachedDir(None, dev, ino, link, [], [])  # listed when visited
+
+        return CachedDir(dir_stat.st_mtime, dir_stat.st_dev, dir_stat.st_ino, False,
+                         [(name, ino) for name, ino, size, mtime in files], [subdir[0] for subdir in subdirs])
+
+
+def _dev_ino(key):
+    return key if isinstance(key, tuple) else (0, 0)
+
+
+def _key(dev, ino, path):
+    return (dev, ino) if ino else os.path.normcase(path)
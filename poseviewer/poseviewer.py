@@ -10,10 +10,15 @@ import subprocess
 from .ui import poseviewerMainGui
 from .corewidgets import *
 from .guiwidgets import *
+from .imageexport import ImageExporter
+from .sorting import SORT_ORDERS
+from .tags import QueryError
+from .settingscache import settings_sibling
 
 
 class MainWindow(QMainWindow, poseviewerMainGui.Ui_MainWindow):
     WINDOW_TITLE = "Poseviewer"
+    RESIZE_COALESCE = 15  # ms
     BEEP = QSound(os.path.join(os.path.dirname(os.path.abspath(__file__)), './Sounds/beep.wav'))
 
     def __init__(self, parent=None):
@@ -28,6 +33,7 @@ class MainWindow(QMainWindow, poseviewerMainGui.Ui_MainWindow):
         self.list_image_viewer = ListImageViewer(parent=self)
         self.slideshow = Slideshow(self)
         self.star_actions = StarActions(self.actionStar)
+        self.exporter = ImageExporter(self)
 
         self.gridLayout.addWidget(self.image_canvas)
         self.gridLayout.addWidget(self.list_image_viewer)
@@ -47,7 +53,14 @@ class MainWindow(QMainWindow, poseviewerMainGui.Ui_MainWindow):
         self.list_image_viewer.indexDoubleClicked.connect(self.prepare_image)
         self.list_image_viewer.listImageViewerToggled.connect(self.image_canvas.fit_in_view)
         self.list_image_viewer.setDefaultSequence.connect(lambda seq: self.image_path.set_sequence(seq))
+        self.list_image_viewer.loadSelected.connect(self.image_path.load)
         self.list_image_viewer.starChange.connect(self.star_actions.handle_star_icon)
+        self.list_image_viewer.starChange.connect(self.update_random_star)
+        self.list_image_viewer.starsChange.connect(self.update_stars)
+        self.list_image_viewer.exportSelected.connect(self.export_images)
+
+        self.exporter.progress.connect(self.export_progress)
+        self.exporter.finished.connect(self.export_finished)
 
         self.time_elapsed_timer = TimeElapsedTimer(self)
         self.totalTimeElapsed = QElapsedTimer()  # keep a track of the whole time spent in app
@@ -62,6 +75,7 @@ class MainWindow(QMainWindow, poseviewerMainGui.Ui_MainWindow):
         # self.toolBar.insertAction(self.actionTimerLabel, self.actionStar)
         self.actionStar.triggered.connect(lambda: self.star_actions.star_image(self.image_path.current))
         self.actionStar.triggered.connect(lambda: self.list_image_viewer.handle_star(self.image_path.current, update=False))
+        self.actionStar.triggered.connect(lambda: self.update_random_star(self.image_path.current))
         # self.actionStar.triggered.connect(self.display_list_image_viewer)
         # self.actionStar.triggered.connect(lambda: self.list_image_viewer.handle_star_icon(self.image_path.current))
         self.actionOpen.triggered.connect(self.get_directory)
@@ -79,6 +93,8 @@ class MainWindow(QMainWindow, poseviewerMainGui.Ui_MainWindow):
 
         self.image_path.imageChanged.connect(self.prepare_image)
         self.image_path.sequenceChanged.connect(self.action_options.enable_all_actions)
+        self.image_path.loader.progress.connect(self.loading_progress)
+        self.image_path.loader.finished.connect(self.loading_finished)
 
         self.time_elapsed_timer.secElapsed.connect(self.update_timerLabel)  # update the timer label every second
 
@@ -88,7 +104,12 @@ class MainWindow(QMainWindow, poseviewerMainGui.Ui_MainWindow):
 
         self.toolBar.hide()
 
-        self.dirs = self.settings.value('dirs', '.')
+        self.dirs = self.settings.get_str('dirs', '.')
+        self.image_path.sampler.balance_folders = self.settings.get_str('random_balance', 'folders') == 'folders'
+        self.image_path.sampler.set_starred(self.star_actions.starred_images())
+        self.image_path.set_sort_order(self.settings.get_str('sort_order') or None)
+        self.session_keeper = SessionKeeper(self.image_path, settings_sibling("-session.bin"), self)
+        self.session_keeper.restore()  # the last image is shown before its directories are scanned again
 
         self.action_options.enable_actions_for(self.action_options.path_actions)
 
@@ -98,6 +119,9 @@ class MainWindow(QMainWindow, poseviewerMainGui.Ui_MainWindow):
         self.centralWidget().layout().setContentsMargins(0, 0, 0, 0)
         QApplication.instance().installEventFilter(self)
 
+        self.resize_timer = QTimer(self, singleShot=True, interval=self.RESIZE_COALESCE)
+        self.resize_timer.timeout.connect(self.image_canvas.fit_in_view)
+
     def get_directory(self):
         """
         Append the image directory to self.dirs
@@ -109,6 +133,64 @@ class MainWindow(QMainWindow, poseviewerMainGui.Ui_MainWindow):
         if self.dirs:  # '' is not a valid path
             self.image_path.set_sequence(self.dirs)
 
+    def update_random_star(self, path):
+        """Starred images are picked more often by random."""
+        self.image_path.sampler.set_star(path, self.star_actions.is_starred(path))
+
+    def update_stars(self, paths):
+        """After a bulk (un)star in the list viewer."""
+        for path in paths:
+            self.update_random_star(path)
+        self.star_actions.handle_star_icon(self.image_path.current)
+
+    def find_by_tags(self):
+        """Load the tagged images that match a query like 'hands AND foreshortening NOT starred'."""
+        query, ok = QInputDialog.getText(self, "Find images by tags", "Tags, collection:<name>, note:<text> and starred,\n"
+                                         "combined with AND, OR, NOT and parentheses:",
+                                         QLineEdit.Normal, self.settings.get_str('tag_query'))
+        if not ok or not query.strip():
+            return
+        try:
+            paths = shared_tag_store().query(query)
+        except QueryError as e:
+            self.notification_widget.notify("Invalid query: {}.".format(e))
+            return
+        self.settings['tag_query'] = query
+        if not paths:
+            self.notification_widget.notify("No images found.")
+            return
+        self.image_path.set_sequence(paths)
+        self.notification_widget.notify("Found {} images.".format(len(paths)))
+
+    def open_collection(self):
+        store = shared_tag_store()
+        names = store.collection_names()
+        if not names:
+            self.notification_widget.notify("There are no collections.")
+            return
+        name, ok = QInputDialog.getItem(self, "Open collection", "Collection:", names, 0, False)
+        if ok and store.collection(name):
+            self.image_path.set_sequence(store.collection(name))
+
+    def set_balance_folders(self, checked):
+        self.settings['random_balance'] = 'folders' if checked else 'images'
+        self.image_path.sampler.balance_folders = checked
+        self.image_path.sampler.set_sequence(self.image_path.sequence.base)
+
+    def set_sort_order(self, sort_order):
+        self.settings['sort_order'] = sort_order or ''
+        self.image_path.set_sort_order(sort_order)
+
+    def loading_progress(self, total):
+        if not self.image_path.current:
+            self.set_window_title("Loading ({} images)".format(total))
+
+    def loading_finished(self):
+        if not self.image_path.sequence:
+            self.notification_widget.notify("No images found.")
+        else:
+            self.notification_widget.notify("Loaded {} images.".format(len(self.image_path.sequence)))
+
     def update_image(self, path=None):
         """
         Update the graphicsview with image_path or current_image_path.
@@ -127,6 +209,7 @@ class MainWindow(QMainWindow, poseviewerMainGui.Ui_MainWindow):
         self.star_actions.handle_star_icon(self.image_path.current)
         self.time_elapsed_timer.set_time_to_zero()
         self.update_timerLabel()
+        self.image_canvas.prefetch(self.image_path.upcoming())
 
     def next_image(self):
         """
@@ -243,6 +326,22 @@ class MainWindow(QMainWindow, poseviewerMainGui.Ui_MainWindow):
         QMessageBox.information(self, 'Stats',
                                 'Total time in app: ' + format_secs(self.totalTimeElapsed.elapsed() / 1000))
 
+    def show_cache_stats(self):
+        stats = self.image_canvas.cache_stats()
+        frame_stats = self.image_canvas.frame_stats()
+        QMessageBox.information(self, 'Image cache',
+                                'Hits: {hits}\nMisses: {misses}\nHit rate: {hit_rate:.0%}\n'
+                                'Cached: {cached_mb:.1f} MB\nAverage time to display: {time_ms:.0f} ms\n'
+                                'Average frame time: {interactive_ms:.1f} ms interactive, {idle_ms:.1f} ms idle'.format(
+                                    cached_mb=stats['cached_bytes'] / 2 ** 20,
+                                    time_ms=stats['average_time_to_display'] * 1000,
+                                    interactive_ms=frame_stats[True] * 1000,
+                                    idle_ms=frame_stats[False] * 1000, **stats))
+
+    def set_decode_processes(self, checked):
+        self.settings['decode_backend'] = 'processes' if checked else 'threads'
+        self.notification_widget.notify("The decoding backend changes after a restart.")
+
     def open_in_folder(self):
         subprocess.Popen(r'explorer /select,{}'.format(self.image_path.current))
 
@@ -253,18 +352,41 @@ class MainWindow(QMainWindow, poseviewerMainGui.Ui_MainWindow):
             self.setWindowTitle("{} - {}".format(title, self.WINDOW_TITLE))
 
     def display_list_image_viewer(self):
-        if not self.list_image_viewer.string_list_model.stringList() == self.image_path.sequence:
+        if not self.list_image_viewer.is_showing(self.image_path.sequence):
             self.list_image_viewer.display(self.star_actions.starred_images(), self.image_path.current)
             self.list_image_viewer.toggle_display()
 
     def save_image(self):
+        """Save the current image at full resolution, flipped, mirrored and rotated like it is shown."""
         file_name = QFileDialog.getSaveFileName(self, "Save image", self.dirs, "Images (*.BMP, *.JPG, *.JPEG, *.PNG)")[
             0]
         if file_name:
-            if self.image_canvas.save(file_name):
+            self.exporter.export(self.image_path.current, file_name, self.image_canvas.view_transform())
+
+    def export_images(self, paths):
+        """Export paths into a chosen directory with the transform of the current image."""
+        if not paths:
+            self.notification_widget.notify("No images to export.")
+            return
+        dir_path = QFileDialog.getExistingDirectory(self, "Export {} images".format(len(paths)), dir=self.dirs)
+        if dir_path:
+            self.exporter.export_batch(paths, dir_path, self.image_canvas.view_transform())
+
+    def export_progress(self, done, total):
+        if total > 1:
+            self.set_window_title("Exporting {}/{}".format(done, total))
+
+    def export_finished(self, succeeded, failed):
+        if self.image_path.current:
+            self.set_window_title(self.image_path.current)
+        if succeeded + failed == 1:
+            if succeeded:
                 QMessageBox.information(self, "Success", "Successfully saved image")
             else:
                 QMessageBox.critical(self, "Failure", "An error occurred while trying to save the image.")
+        else:
+            self.notification_widget.notify("Exported {} images.".format(succeeded) +
+                                            (" {} failed.".format(failed) if failed else ""))
 
     def eventFilter(self, obj, event):
         if not self.force_toolbar_display:
@@ -289,10 +411,19 @@ class MainWindow(QMainWindow, poseviewerMainGui.Ui_MainWindow):
     def resizeEvent(self, event):
         """
         Update the image as you resize the window.
+        Bursts of resize events are coalesced into one fit per RESIZE_COALESCE ms.
         """
-        self.image_canvas.fit_in_view()
+        self.image_canvas.begin_interaction()
+        if not self.resize_timer.isActive():
+            self.resize_timer.start()
 
     def closeEvent(self, event):
+        self.session_keeper.shutdown()
+        self.list_image_viewer.thumbnails.shutdown()
+        flush_star_store()
+        flush_tag_store()
+        shutdown_decode_farm()
+        self.settings.sync()
         event.accept()  # close app
 
 
@@ -308,9 +439,11 @@ class ActionOptions:
         self.path_actions.addAction(self.main_window.actionFullscreen)
 
         self.random_actions = QActionGroup(self.main_window)
+        self.random_actions.setExclusive(False)
         self.random_actions.addAction(self.main_window.actionRandom)
 
         self.misc_actions = QActionGroup(self.main_window)
+        self.misc_actions.setExclusive(False)
         self.slideshow_actions = QActionGroup(self.main_window)
         self.slideshow_actions.addAction(self.main_window.actionSettings)
         self.slideshow_actions.addAction(self.main_window.actionPlay)
@@ -320,6 +453,8 @@ class ActionOptions:
         self.stars_actions = QActionGroup(self.main_window)
         self.stars_actions.addAction(self.main_window.actionStar)
 
+        self.sort_actions = QActionGroup(self.main_window)  # exclusive
+
         self.create_actions()
         self.add_actions()
 
@@ -340,6 +475,11 @@ class ActionOptions:
         # ------- misc_actions --------
         self.main_window.actionStats = self.create_action("Run time", self.main_window, triggered=self.main_window.show_stats, action_group=self.misc_actions)
         self.main_window.actionBars = self.create_action("Hide/Show toolbar", self.main_window, triggered=self.main_window.toggle_bars, action_group=self.misc_actions)
+        self.main_window.actionCacheStats = self.create_action("Image cache statistics", self.main_window, triggered=self.main_window.show_cache_stats, action_group=self.misc_actions)
+        self.main_window.actionDecodeProcesses = self.create_action("Decode images in worker processes", self.main_window,
+                                                           triggered=self.main_window.set_decode_processes, checkable=True,
+                                                           checked=self.main_window.settings.get_str('decode_backend', 'threads') == 'processes',
+                                                           action_group=self.misc_actions)
         # ------- /misc_actions -------
 
         # ------- image_actions -------
@@ -377,6 +517,15 @@ class ActionOptions:
                                                       enabled=True,
                                                       shortcut=QKeySequence("Alt+D"),
                                                       action_group=self.path_actions)
+        self.main_window.actionWatchFolder = self.create_action("Watch folder for changes", self.main_window,
+                                                       triggered=self.main_window.image_path.set_watching,
+                                                       enabled=True, checkable=True,
+                                                       action_group=self.path_actions)
+        self.main_window.actionSearchImages = self.create_action("Search the current images", self.main_window,
+                                                        triggered=lambda: self.main_window.list_image_viewer.search(
+                                                            self.main_window.image_path.sequence, self.main_window.image_path.current),
+                                                        enabled=True, shortcut=QKeySequence("Ctrl+F"),
+                                                        action_group=self.path_actions)
         # ------- /path_actions --------
 
         # ------- random_actions -------
@@ -388,6 +537,18 @@ class ActionOptions:
         self.main_window.actionShuffle = self.create_action("Shuffle images", self.main_window, triggered=self.main_window.image_path.shuffle,
                                                    enabled=False, shortcut=QKeySequence("Ctrl+F5"),
                                                    action_group=self.random_actions)
+        self.main_window.actionShuffleRemaining = self.create_action("Shuffle remaining images", self.main_window,
+                                                            triggered=lambda: self.main_window.image_path.shuffle(remaining=True),
+                                                            enabled=False, shortcut=QKeySequence("Alt+F5"),
+                                                            action_group=self.random_actions)
+        self.main_window.actionWeightedShuffle = self.create_action("Shuffle by stars and folders", self.main_window,
+                                                           triggered=lambda: self.main_window.image_path.shuffle(weighted=True),
+                                                           enabled=False, shortcut=QKeySequence("Ctrl+Alt+F5"),
+                                                           action_group=self.random_actions)
+        self.main_window.actionBalanceFolders = self.create_action("Balance folders in random picks", self.main_window,
+                                                          triggered=self.main_window.set_balance_folders, checkable=True,
+                                                          checked=self.main_window.settings.get_str('random_balance', 'folders') == 'folders',
+                                                          enabled=False, action_group=self.random_actions)
         self.main_window.actionPreviousShuffle = self.create_action("Undo shuffle", self.main_window,
                                                            triggered=self.main_window.image_path.previous_shuffle,
                                                            enabled=False,
@@ -395,12 +556,30 @@ class ActionOptions:
                                                            action_group=self.random_actions)
         # ------- /random_actions ------
 
+        # ------- sort_actions ---------
+        sort_order = self.main_window.settings.get_str('sort_order') or None
+        for kind, name in ((None, "Loading order"),) + SORT_ORDERS:
+            self.create_action(name, self.main_window, triggered=lambda checked=True, kind=kind: self.main_window.set_sort_order(kind),
+                               checkable=True, checked=kind == sort_order, action_group=self.sort_actions)
+        # ------- /sort_actions --------
+
         # ------- stars_actions --------
+        self.main_window.actionExportStars = self.create_action("Export starred images", self.main_window,
+                                                       triggered=lambda: self.main_window.export_images(
+                                                           self.main_window.star_actions.starred_images()),
+                                                       enabled=False, action_group=self.stars_actions)
         self.main_window.actionOpenStars = self.create_action("View starred images", self.main_window,
                                                      triggered=lambda: self.main_window.list_image_viewer.display(
                                                          self.main_window.star_actions.starred_images(), self.main_window.image_path.current),
                                                      enabled=True, shortcut=QKeySequence("Ctrl+Alt+D"),
                                                      action_group=self.stars_actions)
+        self.main_window.actionFindByTags = self.create_action("Find images by tags", self.main_window,
+                                                      triggered=self.main_window.find_by_tags,
+                                                      enabled=True, shortcut=QKeySequence("Ctrl+T"),
+                                                      action_group=self.stars_actions)
+        self.main_window.actionOpenCollection = self.create_action("Open collection", self.main_window,
+                                                          triggered=self.main_window.open_collection,
+                                                          enabled=True, action_group=self.stars_actions)
         # ------- /stars_actions -------
 
     def create_action(self, *args, **kwargs):
@@ -412,19 +591,23 @@ class ActionOptions:
 
         return act
 
-    def enable_actions_for(self, actions):
+    def enable_actions_for(self, actions, enabled=True):
         for action in actions.actions():
-            action.setEnabled(True)
+            action.setEnabled(enabled)
 
     def enable_all_actions(self):
+        """Enable the actions, the ones that move through the images only while there are any."""
+        has_images = bool(self.main_window.image_path.sequence)
         self.main_window.actionSound.setEnabled(True)
         self.main_window.actionTimer.setEnabled(True)
 
-        self.enable_actions_for(self.random_actions)
+        self.enable_actions_for(self.random_actions, has_images)
         self.enable_actions_for(self.image_actions)
         self.enable_actions_for(self.stars_actions)
         self.enable_actions_for(self.path_actions)
-        self.enable_actions_for(self.slideshow_actions)
+        self.enable_actions_for(self.slideshow_actions, has_images)
+        self.main_window.actionSettings.setEnabled(True)
+        self.main_window.actionPlay.setEnabled(has_images or self.main_window.slideshow.is_active())  # can be stopped
 
     def add_to_context_menu(self, menu):
         menu.addAction(self.main_window.actionOpen)
@@ -436,6 +619,7 @@ class ActionOptions:
         menu.addSeparator()
 
         menu.addActions(self.random_actions.actions())
+        menu.addMenu("Sort by").addActions(self.sort_actions.actions())
         menu.addAction(self.main_window.actionSound)
         menu.addAction(self.main_window.actionTimer)
         menu.addSeparator()
@@ -450,7 +634,8 @@ class ActionOptions:
 
 
 def run():
-    ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID('Mare5.Poseviewer.python.1')
+    if os.name == 'nt':  # group the windows under poseviewer's own taskbar icon
+        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID('Mare5.Poseviewer.python.1')
 
     app = QApplication(sys.argv)
     main_window = MainWindow()
@@ -0,0 +1,305 @@
+"""
+Weighted random picks from image sequences in O(1) per pick.
+"""
+
+import random
+from math import log
+from array import array
+from collections import deque, Counter
+from itertools import compress
+
+
+class AliasTable:
+    """Vose's alias method: draw index i with probability weights[i] / sum(weights) in O(1)."""
+
+    def __init__(self, weights):
+        n = len(weights)
+        self.total = float(sum(weights))
+        self.probabilities = array('d', [1.0] * n)
+        self.aliases = array('I', range(n))
+        if not self.total:
+            return
+
+        scaled = [w * n / self.total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.probabilities[s] = scaled[s]
+            self.aliases[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # whatever is left is 1 up to rounding errors, which the defaults already say
+
+    def __len__(self):
+        return len(self.aliases)
+
+    def draw(self, rng=random):
+        i = int(rng.random() * len(self.aliases))
+        return i if rng.random() < self.probabilities[i] else self.aliases[i]
+
+
+class UniformTable:
+    """An AliasTable of n equal weights, without the tables."""
+
+    def __init__(self, n):
+        self.total = float(n)
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def draw(self, rng=random):
+        return int(rng.random() * self.n)
+
+
+class _Folder:
+    __slots__ = ('positions', 'table', 'live', 'unseen', 'unseen_starred', 'top_weight')
+
+    def __init__(self):
+        self.positions = array('I')  # of the images in the base sequence
+        self.table = None  # over live, None when it has to be rebuilt
+        self.live = array('I')  # the positions the table draws from
+        self.unseen = 0
+        self.unseen_starred = 0
+        self.top_weight = 0.0  # of the folder in the top level table
+
+
+class ImageSampler:
+    """
+    Random images of a CompactSequence, weighted by stars, balanced across folders and spread over a session.
+
+    Starred images weigh star_weight times more. With balance_folders every folder is as likely as any other
+    (by the average weight of its images) instead of in proportion to its weight. An image isn't picked again
+    until every other image was (sampling without replacement), and the last RECENT picks are only accepted with
+    probability RECENT_PENALTY when a new round starts.
+
+    Picks go through two alias tables: one over the folders, then one over the images of the picked folder.
+    Neither is rebuilt on every pick. Folders whose weight dropped since the top table was built are accepted
+    with probability current / built weight and images that were seen are rejected, which keeps the picks exact.
+    A table is rebuilt once half of what it draws from is gone, so a pick costs O(1) amortized.
+    """
+
+    STAR_WEIGHT = 4.0
+    RECENT = 50
+    RECENT_PENALTY = 0.1
+
+    def __init__(self, base=None, balance_folders=True, star_weight=STAR_WEIGHT, rng=random):
+        self.balance_folders = balance_folders
+        self.star_weight = star_weight
+        self.rng = rng
+        self.recent = deque(maxlen=self.RECENT)
+        self._recent = Counter()
+        self._starred_paths = set()
+        self.set_sequence(base)
+
+    def set_sequence(self, base):
+        """Sample from base (a CompactSequence) from now on, starting a new round."""
+        self.base = base
+        self._folders = {}
+        self._seen = bytearray()
+        self._starred = set()
+        self._size = 0
+        self._top = None
+        self._top_folders = []
+        self._live_weight = 0.0  # the sum of folder_weight() over all folders
+        self.recent.clear()
+        self._recent.clear()
+        self.update()
+
+    def rebase(self, base):
+        """Like set_sequence, but keep the images that were already seen this round (looked up by path)."""
+        seen = [self.base[i] for i, flag in enumerate(self._seen) if flag] if self.base is not None else []
+        recent = [self.base[i] for i in self.recent if i < len(self.base)] if self.base is not None else []
+        self.set_sequence(base)
+        for path in seen:
+            self.mark_seen(path)
+        for path in recent:
+            self._remember(base.find(path))
+
+    def update(self):
+        """Add the images appended to the base sequence since the last update."""
+        if self.base is None or len(self.base) == self._size:
+            return
+        dir_ids = self.base.directory_ids()
+        for position in range(self._size, len(self.base)):
+            folder = self._folders.get(dir_ids[position])
+            if folder is None:
+                folder = self._folders[dir_ids[position]] = _Folder()
+            folder.positions.append(position)
+            folder.unseen += 1
+            folder.table = None
+        self._seen.extend(bytes(len(self.base) - self._size))
+        self._size = len(self.base)
+        self._top = None
+        self._resolve_stars()
+
+    def folder_weight(self, folder):
+        if not folder.unseen:
+            return 0.0
+        weight = folder.unseen + (self.star_weight - 1) * folder.unseen_starred
+        return weight / folder.unseen if self.balance_folders else weight
+
+    def _folder(self, position):
+        return self._folders[self.base.directory_id(position)]
+
+    def _count_star(self, position, change):
+        folder = self._folder(position)
+        if not self._seen[position]:
+            before = self.folder_weight(folder)
+            folder.unseen_starred += change
+            self._live_weight += self.folder_weight(folder) - before
+        if folder.unseen_starred or change < 0:
+            folder.table = None  # (the table of a folder without stars is uniform)
+
+    def set_starred(self, paths):
+        self._starred_paths = set(paths)
+        for position in self._starred:
+            self._count_star(position, -1)
+        self._starred = set()
+        self._resolve_stars()
+
+    def set_star(self, path, starred):
+        """Incremental version of set_starred for one image."""
+        if starred:
+            self._starred_paths.add(path)
+        else:
+            self._starred_paths.discard(path)
+        position = self.base.find(path) if self.base is not None else -1
+        if 0 <= position < self._size and starred != (position in self._starred):
+            if starred:
+                self._starred.add(position)
+            else:
+                self._starred.remove(position)
+            self._count_star(position, 1 if starred else -1)
+
+    def _resolve_stars(self):
+        if self.base is None:
+            return
+        for path in self._starred_paths:
+            position = self.base.find(path)
+            if 0 <= position < self._size and position not in self._starred:
+                self._starred.add(position)
+                self._count_star(position, 1)
+
+    def weight(self, position):
+        return self.star_weight if position in self._starred else 1.0
+
+    def mark_seen(self, path):
+        position = self.base.find(path) if self.base is not None else -1
+        if 0 <= position < self._size and not self._seen[position]:
+            self._see(position)
+
+    def _see(self, position):
+        folder = self._folder(position)
+        before = self.folder_weight(folder)
+        self._seen[position] = 1
+        folder.unseen -= 1
+        if position in self._starred:
+            folder.unseen_starred -= 1
+        self._live_weight += self.folder_weight(folder) - before
+
+    def _remember(self, position):
+        if position < 0:
+            return
+        if len(self.recent) == self.recent.maxlen:
+            forgotten = self.recent[0]
+            self._recent[forgotten] -= 1
+            if not self._recent[forgotten]:
+                del self._recent[forgotten]
+        self.recent.append(position)
+        self._recent[position] += 1
+
+    def new_round(self):
+        """Make every image pickable again."""
+        self._seen = bytearray(len(self._seen))
+        for folder in self._folders.values():
+            folder.unseen = len(folder.positions)
+            folder.unseen_starred = 0
+            folder.table = None
+        for position in self._starred:
+            self._folder(position).unseen_starred += 1
+        self._top = None
+
+    def seen(self):
+        """One byte per image of the base sequence, 1 if it was picked this round."""
+        self.update()
+        return bytes(self._seen)
+
+    def seen_count(self):
+        return self._size - sum(folder.unseen for folder in self._folders.values())
+
+    def restore_seen(self, seen):
+        """Continue the round that seen (see seen()) was taken from."""
+        self.update()
+        for position in compress(range(min(len(seen), self._size)), seen):
+            if not self._seen[position]:
+                self._see(position)
+        self._top = None
+
+    def _build_folder(self, folder):
+        if folder.unseen == len(folder.positions):
+            folder.live = folder.positions
+        else:
+            folder.live = array('I', (p for p in folder.positions if not self._seen[p]))
+        if folder.unseen_starred:
+            folder.table = AliasTable([self.weight(p) for p in folder.live])
+        else:
+            folder.table = UniformTable(len(folder.live))
+
+    def _build_top(self):
+        self._top_folders = [folder for folder in self._folders.values() if folder.unseen]
+        for folder in self._top_folders:
+            folder.top_weight = self.folder_weight(folder)
+        self._top = AliasTable([folder.top_weight for folder in self._top_folders])
+        self._live_weight = self._top.total
+
+    def draw(self):
+        """Return the position in the base sequence of a random image, -1 if it is empty."""
+        self.update()
+        if not self._size:
+            return -1
+        while True:
+            if self._top is None or self._live_weight * 2 < self._top.total:
+                self._build_top()
+                if not self._top_folders:
+                    self.new_round()
+                    continue
+
+            folder = self._top_folders[self._top.draw(self.rng)]
+            weight = self.folder_weight(folder)
+            if weight > folder.top_weight:  # gained stars
+                self._top = None
+                continue
+            if self.rng.random() * folder.top_weight >= weight:
+                continue
+
+            if folder.table is None or folder.unseen * 2 < len(folder.live):
+                self._build_folder(folder)
+            position = folder.live[folder.table.draw(self.rng)]
+            if self._seen[position]:
+                continue
+            if position in self._recent and self._size > len(self.recent) and self.rng.random() >= self.RECENT_PENALTY:
+                continue
+            self._see(position)
+            self._remember(position)
+            return position
+
+    def draw_path(self):
+        position = self.draw()
+        return self.base[position] if position >= 0 else None
+
+    def permutation(self, positions):
+        """
+        A weighted random order of positions (of the base sequence): like drawing them without replacement
+        where every image weighs weight() (divided by the size of its folder with balance_folders), so starred
+        images and the images of smaller folders come first on average. Sorts by random exponential keys
+        (Efraimidis-Spirakis), O(n log n) at C speed instead of n picks.
+        """
+        self.update()
+        dir_ids = self.base.directory_ids()
+        sizes = {dir_id: len(folder.positions) if self.balance_folders else 1 for dir_id, folder in self._folders.items()}
+        random_value, starred, star_weight = self.rng.random, self._starred, self.star_weight
+        keys = [-log(1.0 - random_value()) * sizes[dir_ids[p]] / (star_weight if p in starred else 1.0)
+                for p in positions]
+        return array('I', (positions[i] for i in sorted(range(len(keys)), key=keys.__getitem__)))
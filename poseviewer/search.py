@@ -0,0 +1,160 @@
+"""
+Search of image sequences by file and folder name.
+"""
+
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain, compress
+from operator import or_
+
+from .sequence import CompactSequence, PermutedSequence, inverse_permutation
+
+
+_GLOB_CHARS = re.compile(r'[*?[]')
+_NUL = re.compile(rb'\0')
+
+
+def glob_pattern(term):
+    """A bytes regex for the glob term (*, ? and [...] like fnmatch) matching a whole name in a blob of NUL separated names."""
+    parts = []
+    i = 0
+    while i < len(term):
+        char = term[i]
+        if char == '*':
+            parts.append(rb'[^\0]*')
+        elif char == '?':
+            parts.append(rb'[^\0]')
+        elif char == '[' and term.find(']', i + 1) > i + 1:
+            end = term.find(']', i + 1)
+            chars = term[i + 1:end]
+            negate = chars.startswith('!')
+            chars = chars[1:] if negate else chars
+            chars = re.escape(chars.encode(CompactSequence.ENCODING, CompactSequence.ERRORS)).replace(b'\\-', b'-')
+            parts.append(b'[' + (b'^\\x00' if negate else b'') + chars + b']')  # (\0 would run into a digit)
+            i = end
+        else:
+            parts.append(re.escape(char.encode(CompactSequence.ENCODING, CompactSequence.ERRORS)))
+        i += 1
+    return re.compile(rb'(?<![^\0])' + b''.join(parts) + rb'(?![^\0])')
+
+
+class SearchIndex:
+    """
+    Exact and substring search over a sequence of paths (a list, CompactSequence or PermutedSequence).
+
+    All file names are kept lowercased in one NUL separated bytes blob, so a substring or glob is a regex
+    scan at C speed (a few ms for 500k names when it is rare, about 0.15 s when it matches most of them)
+    where an inverted index of trigrams would cost tens of MB and seconds to build in Python. Folders are
+    few, so they are searched one by one. Terms are combined as bit masks over the entries. Exact lookups
+    go through the hash index of the CompactSequence.
+
+    Results are indices into the sequence, ascending.
+    """
+
+    SCAN_LIMIT = 64
+
+    def __init__(self, paths=()):
+        if isinstance(paths, PermutedSequence):
+            self.base, self.order = paths.base, paths.order
+        else:
+            self.base = paths if isinstance(paths, CompactSequence) else CompactSequence(paths)
+            self.order = array('I')
+        self.sequence = paths
+        self._inverse = None
+        self._size = 0
+        self._blob = bytearray()  # the lowercased names, each followed by a NUL
+        self._starts = array('Q')  # offset of every name in the blob
+        self._directories = []
+        self._dir_positions = None  # directory id -> array of positions in base
+
+    def __len__(self):
+        return len(self.base)
+
+    def update(self):
+        """Index the paths appended to the sequence since the last update."""
+        if self._size == len(self.base):
+            return
+        names = self.base.name_bytes(range(self._size, len(self.base)))
+        encoding, errors = CompactSequence.ENCODING, CompactSequence.ERRORS
+        chunk = b'\0'.join(names).decode(encoding, errors).lower().encode(encoding, errors) + b'\0'
+        offset = len(self._blob)
+        self._starts.append(offset)
+        self._starts.extend(offset + match.end() for match in _NUL.finditer(chunk, 0, len(chunk) - 1))
+        self._blob += chunk
+        self._size = len(self.base)
+        self._directories = [directory.lower() for directory in self.base.directories()]
+        self._dir_positions = None
+        self._inverse = None
+
+    def append(self, path):
+        """Append path to a list sequence (of which the index keeps its own CompactSequence) and index it."""
+        if self.base is not self.sequence:
+            self.base.append(path)
+        self.update()
+
+    def find(self, path):
+        """The index of path in the sequence or -1, without a scan."""
+        position = self.base.find(path)
+        return self._index(position) if position >= 0 else -1
+
+    def _index(self, position):
+        if position >= len(self.order):
+            return position
+        if self._inverse is None:
+            self._inverse = inverse_permutation(self.order)
+        return self._inverse[position]
+
+    def search(self, query):
+        """
+        The indices of the paths matching every whitespace separated term of query, ignoring case.
+        A term matches a substring of the file name or of its folder, a term with *, ? or [...] is a glob
+        that has to match the whole file name.
+        """
+        self.update()
+        size = len(self.base)
+        matches = -1  # bit i is set when entry i of base matches every term so far
+        for term in query.lower().split():
+            matches &= int.from_bytes(self._search_term(term), 'little')
+            if not matches:
+                break
+        if matches == -1:
+            return array('I', range(size))
+        mask = matches.to_bytes(size, 'little')
+        if self.order:
+            return array('I', compress(range(size), map(mask.__getitem__, chain(self.order, range(len(self.order), size)))))
+        return array('I', compress(range(size), mask))
+
+    def _search_term(self, term):
+        """A mask of the entries matching term: one byte per entry, 1 if it matches."""
+        if _GLOB_CHARS.search(term):
+            return self._scan(glob_pattern(term))
+
+        mask = self._scan(re.compile(re.escape(term.encode(CompactSequence.ENCODING, CompactSequence.ERRORS))))
+        hits = bytes(term in directory for directory in self._directories)
+        if any(hits):
+            mask = bytes(map(or_, mask, map(hits.__getitem__, self.base.directory_ids())))
+        return mask
+
+    def _scan(self, pattern):
+        """
+        Scan the blob for a rare pattern, or test every name on its own (still in C) when it turns out to match
+        more than one in SCAN_LIMIT names, which would make the scan a Python loop over most of them.
+        """
+        mask = bytearray(len(self.base))
+        limit = len(self.base) // self.SCAN_LIMIT
+        found = 0
+        starts = self._starts
+        for match in pattern.finditer(self._blob):
+            found += 1
+            if found > limit:
+                names = self._blob.split(b'\0')[:-1]
+                return bytes(map(bool, map(pattern.search, names)))
+            mask[bisect_right(starts, match.start()) - 1] = 1
+        return mask
+
+
+def filter_rows(rows, index):
+    """The position of index in the ascending rows (of a search result), or -1."""
+    i = bisect_left(rows, index)
+    return i if i < len(rows) and rows[i] == index else -1
@@ -0,0 +1,350 @@
+"""
+Memory-compact sequences of image paths.
+"""
+
+import os
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+
+try:
+    import numpy
+except ImportError:  # optional, shuffles are just slower without it
+    numpy = None
+
+
+class CompactSequence(Sequence):
+    """
+    A read-mostly sequence of paths that stores every directory once.
+
+    Each path is split into a directory prefix (interned in a table) and a base name. The base names are
+    UTF-8 encoded into one bytes blob with an array of offsets, and every entry only keeps the integer id
+    of its directory, so an entry costs about 20 bytes plus its base name instead of a whole str object.
+
+    Lookups (in, index) go through an array of path hashes sorted on first use. Entries appended after
+    that are found through a dict of their hashes until there are enough of them to be worth sorting in.
+    """
+
+    ENCODING = 'utf-8'
+    ERRORS = 'surrogatepass'  # every str round-trips, even undecodable file names
+
+    def __init__(self, paths=()):
+        self._prefixes = []  # directory id -> path up to and including the last separator
+        self._prefix_ids = {}
+        self._names = bytearray()
+        self._offsets = array('Q', [0])  # entry i is _names[_offsets[i]:_offsets[i + 1]]
+        self._dir_ids = array('I')
+        self._entry_hashes = array('q')  # hash of every entry, in order
+
+        self._hashes = array('q')  # sorted hashes of the first _indexed entries
+        self._positions = array('I')  # entry of every hash in _hashes
+        self._indexed = 0
+        self._tail = {}  # hash -> first position, of the entries from _indexed to _tail_end
+        self._tail_end = 0
+
+        self.extend(paths)
+
+    def extend(self, paths):
+        for path in paths:
+            self.append(path)
+
+    def append(self, path):
+        name = os.path.basename(path)
+        prefix = path[:len(path) - len(name)]
+        dir_id = self._prefix_ids.get(prefix)
+        if dir_id is None:
+            dir_id = self._prefix_ids[prefix] = len(self._prefixes)
+            self._prefixes.append(prefix)
+        if len(self._entry_hashes) == len(self._dir_ids):  # (see from_buffers)
+            self._entry_hashes.append(hash(path))
+        self._names += name.encode(self.ENCODING, self.ERRORS)
+        self._offsets.append(len(self._names))
+        self._dir_ids.append(dir_id)
+
+    def __len__(self):
+        return len(self._dir_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._path(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("sequence index out of range")
+        return self._path(index)
+
+    def _path(self, i):
+        return self._prefixes[self._dir_ids[i]] + self._names[self._offsets[i]:self._offsets[i + 1]].decode(self.ENCODING, self.ERRORS)
+
+    def __iter__(self):
+        return self._iter()
+
+    def _iter(self, start=0):
+        names, offsets, prefixes = self._names, self._offsets, self._prefixes
+        for i, dir_id in enumerate(self._dir_ids[start:], start):
+            yield prefixes[dir_id] + names[offsets[i]:offsets[i + 1]].decode(self.ENCODING, self.ERRORS)
+
+    def __contains__(self, path):
+        return self.find(path) >= 0
+
+    def index(self, path, start=0, stop=None):
+        """Like list.index: the first position of path (within start..stop)."""
+        stop = len(self) if stop is None else stop
+        if start == 0 and stop == len(self):
+            i = self.find(path)
+        else:
+            i = next((i for i in range(start, min(stop, len(self))) if self._path(i) == path), -1)
+        if i < 0:
+            raise ValueError("{!r} is not in the sequence".format(path))
+        return i
+
+    def find(self, path):
+        """Return the first position of path or -1."""
+        if not isinstance(path, str):
+            return -1
+        if len(self._entry_hashes) < len(self):
+            self._entry_hashes.extend(map(hash, self._iter(len(self._entry_hashes))))
+        if len(self) - self._indexed > max(1024, self._indexed // 16):
+            self._build_index()
+        elif self._tail_end < len(self):
+            hashes = self._entry_hashes
+            for position in range(self._tail_end, len(self)):
+                self._tail.setdefault(hashes[position], position)
+            self._tail_end = len(self)
+
+        key = hash(path)
+        found = -1
+        i = bisect_left(self._hashes, key)
+        while i < len(self._hashes) and self._hashes[i] == key:
+            position = self._positions[i]
+            if (found < 0 or position < found) and self._path(position) == path:
+                found = position
+            i += 1
+        if found >= 0:
+            return found
+        first = self._tail.get(key, -1)
+        if first < 0 or self._path(first) == path:
+            return first
+        for position in range(first + 1, len(self)):  # another path with the same hash
+            if self._entry_hashes[position] == key and self._path(position) == path:
+                return position
+        return -1
+
+    def _build_index(self):
+        hashes = self._entry_hashes
+        order = sorted(range(len(hashes)), key=hashes.__getitem__)
+        self._hashes = array('q', (hashes[i] for i in order))
+        self._positions = array('I', order)
+        self._indexed = self._tail_end = len(hashes)
+        self._tail = {}
+
+    def __eq__(self, other):
+        if isinstance(other, (CompactSequence, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return "CompactSequence({} paths in {} directories)".format(len(self), len(self._prefixes))
+
+    @classmethod
+    def from_buffers(cls, prefixes, names, offsets, dir_ids):
+        """
+        A sequence made of what buffers() returned. The hashes of the paths (which differ between runs of
+        Python) are only computed on the first lookup.
+        """
+        sequence = cls()
+        sequence._prefixes = list(prefixes)
+        sequence._prefix_ids = {prefix: dir_id for dir_id, prefix in enumerate(sequence._prefixes)}
+        sequence._names = bytearray(names)
+        sequence._offsets = offsets
+        sequence._dir_ids = dir_ids
+        return sequence
+
+    def buffers(self):
+        """The directory prefixes, the encoded names blob, the name offsets and the directory ids."""
+        return self._prefixes, self._names, self._offsets, self._dir_ids
+
+    def name_bytes(self, positions):
+        """The encoded base names of the entries at positions."""
+        names, offsets = self._names, self._offsets
+        return [names[offsets[i]:offsets[i + 1]] for i in positions]
+
+    def directory_id(self, index):
+        """The id of the directory of entry index, an index into directories()."""
+        return self._dir_ids[index]
+
+    def directory_ids(self):
+        """The directory id of every entry (read only)."""
+        return self._dir_ids
+
+    def directories(self):
+        """The directories of the paths, each once."""
+        return [os.path.dirname(prefix + "x") for prefix in self._prefixes]
+
+    def nbytes(self):
+        """Approximate memory footprint in bytes."""
+        arrays = (self._offsets, self._dir_ids, self._entry_hashes, self._hashes, self._positions)
+        return (sys.getsizeof(self._names) + sum(sys.getsizeof(a) for a in arrays) +
+                sys.getsizeof(self._prefixes) + sys.getsizeof(self._prefix_ids) + sys.getsizeof(self._tail) +
+                sum(sys.getsizeof(prefix) for prefix in self._prefixes))
+
+
+class PermutedSequence(Sequence):
+    """
+    A view of base in the order of a permutation array: entry i is base[order[i]].
+
+    The order may be shorter than base (paths appended to base after a shuffle); the rest of base
+    follows it in its own order. Shuffling only ever replaces the order, base is shared and never copied.
+    """
+
+    def __init__(self, base=None, order=None):
+        self.base = CompactSequence() if base is None else base
+        self.order = array('I') if order is None else order
+        self._inverse = None  # base position -> position in the order, built on the first index()
+
+    def __len__(self):
+        return len(self.base)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if 0 <= index < len(self.order):
+            return self.base[self.order[index]]
+        return self.base[index]
+
+    def __iter__(self):
+        base = self.base
+        for position in self.order:
+            yield base[position]
+        for i in range(len(self.order), len(base)):
+            yield base[i]
+
+    def __contains__(self, path):
+        return path in self.base
+
+    def index(self, path, start=0, stop=None):
+        i = self.find(path)
+        if i < 0 or not start <= i < (len(self) if stop is None else stop):
+            raise ValueError("{!r} is not in the sequence".format(path))
+        return i
+
+    def find(self, path):
+        """Return the position of path or -1."""
+        position = self.base.find(path)
+        if 0 <= position < len(self.order):
+            if self._inverse is None:
+                self._inverse = inverse_permutation(self.order)
+            position = self._inverse[position]
+        return position
+
+    def __eq__(self, other):
+        if isinstance(other, (PermutedSequence, CompactSequence, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return "PermutedSequence({!r}, {} shuffled)".format(self.base, len(self.order))
+
+    def directories(self):
+        return self.base.directories()
+
+    def nbytes(self):
+        return self.base.nbytes() + sys.getsizeof(self.order) + sys.getsizeof(self._inverse or ())
+
+
+_MASK = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+
+
+def random_keys(n, seed):
+    """
+    n distinct pseudo random 64 bit keys made from seed by SplitMix64, as a numpy array or a list.
+    Both give the same keys, so orders don't depend on whether numpy is installed.
+    """
+    if numpy is not None:
+        keys = numpy.arange(1, n + 1, dtype=numpy.uint64) * numpy.uint64(_GOLDEN) + numpy.uint64(seed & _MASK)
+        keys = (keys ^ (keys >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+        keys = (keys ^ (keys >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+        return keys ^ (keys >> numpy.uint64(31))
+    keys = []
+    for i in range(1, n + 1):
+        key = (seed + i * _GOLDEN) & _MASK
+        key = ((key ^ (key >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+        key = ((key ^ (key >> 27)) * 0x94D049BB133111EB) & _MASK
+        keys.append(key ^ (key >> 31))
+    return keys
+
+
+def permutation(n, seed):
+    """
+    A random permutation of range(n) as array('I'), always the same one for the same n and seed (with or
+    without numpy, so a saved session undoes its shuffles the same anywhere): range(n) sorted by random_keys.
+    A seed that is already a permutation (an array, for orders that no seed makes) is returned as it is.
+    """
+    if isinstance(seed, array):
+        return seed
+    keys = random_keys(n, seed)
+    if numpy is not None:
+        order = array('I')
+        order.frombytes(numpy.argsort(keys).astype(numpy.uint32).tobytes())  # the keys are distinct
+        return order
+    return array('I', sorted(range(n), key=keys.__getitem__))
+
+
+def inverse_permutation(order):
+    inverse = array('I', bytes(len(order) * order.itemsize))
+    if numpy is not None:
+        numpy.frombuffer(inverse, dtype=numpy.uint32)[numpy.frombuffer(order, dtype=numpy.uint32)] = numpy.arange(
+            len(order), dtype=numpy.uint32)
+    else:
+        for i, position in enumerate(order):
+            inverse[position] = i
+    return inverse
+
+
+def shuffle_order(order, seed, start, length):
+    """
+    Return order extended to length entries (with the identity) and its entries from start on shuffled.
+    (seed, start, length) is all that has to be remembered to undo it with unshuffle_order.
+    The seed can also be the permutation of the shuffled entries itself (see permutation).
+    """
+    order = order[:]
+    order.extend(range(len(order), length))
+    if numpy is not None:
+        tail = numpy.frombuffer(order, dtype=numpy.uint32)[start:]
+        tail[:] = tail[numpy.frombuffer(permutation(length - start, seed), dtype=numpy.uint32)]
+    else:
+        tail = order[start:]
+        order[start:] = array('I', map(tail.__getitem__, permutation(length - start, seed)))
+    return order
+
+
+def unshuffle_order(order, seed, start, length):
+    """The inverse of shuffle_order: return the order that shuffle_order(order, seed, start, length) was given."""
+    order = order[:]
+    perm = permutation(length - start, seed)
+    if numpy is not None:
+        tail = numpy.frombuffer(order, dtype=numpy.uint32)[start:length]
+        tail[numpy.frombuffer(perm, dtype=numpy.uint32)] = tail.copy()
+    else:
+        tail = [0] * len(perm)
+        for position, path in zip(perm, order[start:length]):
+            tail[position] = path
+        order[start:length] = array('I', tail)
+    return order
+
+
+def list_nbytes(paths):
+    """Approximate memory footprint of a plain list of path strings, for comparison with CompactSequence.nbytes."""
+    return sys.getsizeof(paths) + sum(sys.getsizeof(path) for path in paths)
@@ -0,0 +1,238 @@
+"""
+Binary snapshots of the viewing session, to pick up where the last run left off without scanning first.
+
+A snapshot file is a header, a table of named sections and the sections themselves:
+
+    MAGIC | version, section count (uint32) | (name (8 bytes), offset, length (uint64)) per section | sections
+
+The 'meta' section is JSON (the current image, its index, the shuffle steps and the undo history), the
+others are the raw bytes of the arrays of the sequence, so writing one is a few memcpys and reading one maps
+the file and copies each array out with a single frombytes.
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+from .sequence import CompactSequence
+
+
+MAGIC = b'PVSESSN\0'
+VERSION = 1
+
+_HEADER = struct.Struct('<II')
+_SECTION = struct.Struct('<8sQQ')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def write_snapshot(path, meta, sections):
+    """Write meta (JSON serializable) and sections ({name: bytes-like}) to path, replacing it atomically."""
+    sections = dict(sections, meta=json.dumps(meta).encode('utf-8'))
+    offset = len(MAGIC) + _HEADER.size + _SECTION.size * len(sections)
+    table = []
+    for name, data in sections.items():
+        table.append(_SECTION.pack(name.encode('ascii'), offset, len(data)))
+        offset += len(data)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_HEADER.pack(VERSION, len(sections)))
+        f.writelines(table)
+        for data in sections.values():
+            f.write(data)
+    os.replace(temp_path, path)
+
+
+class Snapshot:
+    """A snapshot file mapped into memory. Sections are only read when they are asked for."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise SnapshotError("empty snapshot")
+        try:
+            self._sections = self._read_table()
+            self.meta = json.loads(self.section('meta').decode('utf-8'))
+        except (struct.error, ValueError, KeyError) as e:
+            self.close()
+            raise SnapshotError("invalid snapshot: {}".format(e))
+
+    def _read_table(self):
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a snapshot")
+        version, count = _HEADER.unpack_from(self._map, len(MAGIC))
+        if version != VERSION:
+            raise ValueError("version {}".format(version))
+        sections = {}
+        for i in range(count):
+            name, offset, length = _SECTION.unpack_from(self._map, len(MAGIC) + _HEADER.size + i * _SECTION.size)
+            if offset + length > len(self._map):
+                raise ValueError("truncated")
+            sections[name.rstrip(b'\0').decode('ascii')] = (offset, length)
+        return sections
+
+    def __contains__(self, name):
+        return name in self._sections
+
+    def section(self, name):
+        offset, length = self._sections[name]
+        return self._map[offset:offset + length]
+
+    def array(self, name, typecode):
+        result = array(typecode)
+        offset, length = self._sections[name]
+        with memoryview(self._map) as view:
+            result.frombytes(view[offset:offset + length])
+        if self.meta.get('byteorder', sys.byteorder) != sys.byteorder:
+            result.byteswap()
+        return result
+
+    def close(self):
+        self._map.close()
+
+
+class Session:
+    """
+    What is worth keeping of an ImagePath between runs: the sequence (a CompactSequence), its order and shuffle
+    steps, the current image and index, the directories it was loaded from, the shuffle and random undo history
+    and which images random already picked this round.
+
+    Sessions loaded from a snapshot read the meta data right away (so the current image can be shown first)
+    and the sequence and the rest of the arrays on first use.
+    """
+
+    def __init__(self, base=None, order=None, steps=(), current="", current_index=0, root_dirs=(),
+                 sort_order=None, sorted=False, shuffle_history=(), random_history=(), seen=b''):
+        self._snapshot = None
+        self._base = CompactSequence() if base is None else base
+        self._order = array('I') if order is None else order
+        self._steps = steps
+        self._shuffle_history = list(shuffle_history)  # (steps, current index), all of base
+        self._seen = seen
+        self._permutations = {}  # section name -> array
+        self.current = current
+        self.current_index = current_index
+        self.root_dirs = list(root_dirs)
+        self.sort_order = sort_order
+        self.sorted = sorted
+        self.random_history = list(random_history)
+
+    @classmethod
+    def load(cls, path):
+        """The session saved to path, or None if there is none (or it can't be read)."""
+        try:
+            snapshot = Snapshot(path)
+        except (OSError, SnapshotError):
+            return None
+        meta = snapshot.meta
+        session = cls(current=meta['current'], current_index=meta['current_index'], root_dirs=meta['root_dirs'],
+                      sort_order=meta['sort_order'], sorted=meta['sorted'], random_history=meta['random_history'])
+        session._snapshot = snapshot
+        session._base = session._order = session._steps = session._seen = None
+        session._shuffle_history = None
+        return session
+
+    @property
+    def base(self):
+        if self._base is None:
+            snapshot = self._snapshot
+            encoding, errors = CompactSequence.ENCODING, CompactSequence.ERRORS
+            prefixes = snapshot.section('prefixes').decode(encoding, errors).split('\0') if snapshot.meta['dirs'] else []
+            self._base = CompactSequence.from_buffers(prefixes, snapshot.section('names'), snapshot.array('offsets', 'Q'),
+                                                      snapshot.array('dir_ids', 'I'))
+        return self._base
+
+    @property
+    def order(self):
+        if self._order is None:
+            self._order = self._snapshot.array('order', 'I')
+        return self._order
+
+    @property
+    def steps(self):
+        if self._steps is None:
+            self._steps = self._decode_steps(self._snapshot.meta['steps'])
+        return self._steps
+
+    @property
+    def shuffle_history(self):
+        if self._shuffle_history is None:
+            self._shuffle_history = [(self._decode_steps(steps), index)
+                                     for steps, index in self._snapshot.meta['shuffle_history']]
+        return self._shuffle_history
+
+    @property
+    def seen(self):
+        if self._seen is None:
+            self._seen = self._snapshot.section('seen')
+        return self._seen
+
+    def _decode_steps(self, steps):
+        """Seeds are numbers, permutations (sorts and weighted shuffles) the names of their sections."""
+        return tuple((self._permutation(seed) if isinstance(seed, str) else seed, start, length)
+                     for seed, start, length in steps)
+
+    def _permutation(self, name):
+        if name == 'order':
+            return self.order
+        if name not in self._permutations:  # the same array in every step it was in
+            self._permutations[name] = self._snapshot.array(name, 'I')
+        return self._permutations[name]
+
+    def close(self):
+        """Read everything that wasn't read yet and let go of the snapshot file."""
+        if self._snapshot is not None:
+            for name in ('base', 'order', 'steps', 'shuffle_history', 'seen'):
+                getattr(self, name)
+            self._snapshot.close()
+            self._snapshot = None
+
+    def save(self, path):
+        write_snapshot(path, *self.encode())
+
+    def encode(self):
+        """The meta data and the sections of a snapshot of the session, copies that can be written in any thread."""
+        sections = {}
+        arrays = {}  # id of a permutation -> its section
+
+        def encode_steps(steps):
+            encoded = []
+            for seed, start, length in steps:
+                if seed is self.order:
+                    seed = 'order'
+                elif isinstance(seed, array):
+                    if id(seed) not in arrays:
+                        arrays[id(seed)] = 'perm{}'.format(len(arrays))
+                        sections[arrays[id(seed)]] = seed.tobytes()
+                    seed = arrays[id(seed)]
+                encoded.append((seed, start, length))
+            return encoded
+
+        prefixes, names, offsets, dir_ids = self.base.buffers()
+        encoding, errors = CompactSequence.ENCODING, CompactSequence.ERRORS
+        sections.update(prefixes='\0'.join(prefixes).encode(encoding, errors), names=bytes(names),
+                        offsets=offsets.tobytes(), dir_ids=dir_ids.tobytes(), order=self.order.tobytes(),
+                        seen=bytes(self.seen))
+        meta = {
+            'byteorder': sys.byteorder,
+            'dirs': len(prefixes),
+            'current': self.current,
+            'current_index': self.current_index,
+            'root_dirs': self.root_dirs,
+            'sort_order': self.sort_order,
+            'sorted': self.sorted,
+            'steps': encode_steps(self.steps),
+            'shuffle_history': [(encode_steps(steps), index) for steps, index in self.shuffle_history],
+            'random_history': self.random_history,
+        }
+        return meta, sections
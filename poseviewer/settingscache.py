@@ -0,0 +1,131 @@
+"""
+The settings of the application, read once and kept in memory.
+"""
+
+import os
+import sys
+import threading
+
+
+_TRUE = {'true', '1', 'yes', 'on'}
+_REMOVED = object()
+
+
+def settings_file_path():
+    """
+    The settings INI file, where QSettings(IniFormat, UserScope, "Mare5", "Poseviewer") keeps it, found without Qt
+    so the command line can use the caches next to it.
+    """
+    if sys.platform == 'win32':
+        config_dir = os.environ.get('APPDATA') or os.path.expanduser('~')
+    else:
+        config_dir = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(config_dir, "Mare5", "Poseviewer.ini")
+
+
+def settings_sibling(suffix):
+    """The path of a file stored next to the settings INI file, named like it with suffix ("-library.db")."""
+    return os.path.splitext(settings_file_path())[0] + suffix
+
+
+def _copy(value):
+    return list(value) if isinstance(value, list) else value
+
+
+class SettingsCache:
+    """
+    Every settings value by its full key ('group/key', like QSettings.allKeys), in memory and safe to use from
+    any thread.
+
+    Changes apply right away and are collected until take_changes(), so whoever owns the settings file can
+    write them in one go (see corewidgets.SettingsService). on_change is called with {key: value} (None for
+    removed keys) after every change, in the thread that made it.
+    """
+
+    def __init__(self, values=None, on_change=None):
+        self.on_change = on_change or (lambda changes: None)
+        self._lock = threading.RLock()
+        self._values = {key: _copy(value) for key, value in (values or {}).items()}
+        self._changes = {}  # key -> new value or _REMOVED, not written yet
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def value(self, key, default=None):
+        with self._lock:
+            return _copy(self._values.get(key, default))
+
+    def get_int(self, key, default=0):
+        try:
+            return int(self.value(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_float(self, key, default=0.0):
+        try:
+            return float(self.value(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_bool(self, key, default=False):
+        value = self.value(key, default)
+        if isinstance(value, str):  # INI values are read back as strings
+            return value.lower() in _TRUE
+        return bool(value)
+
+    def get_str(self, key, default=''):
+        value = self.value(key)
+        return default if value is None else str(value)
+
+    def get_list(self, key, default=()):
+        value = self.value(key)
+        if value is None:
+            return list(default)
+        # Reading a list with a single string evaluates to a string instead of a list.
+        return [value] if isinstance(value, str) else list(value)
+
+    def set_values(self, values, removed=()):
+        """Set every key of values and remove every key in removed (and the keys under it), as one change."""
+        changes = {}
+        with self._lock:
+            for key in removed:
+                for child in [child for child in self._values if child == key or child.startswith(key + '/')]:
+                    del self._values[child]
+                    changes[child] = None
+                    self._changes[child] = _REMOVED
+            for key, value in values.items():
+                self._values[key] = self._changes[key] = _copy(value)
+                changes[key] = value
+        if changes:
+            self.on_change(changes)
+
+    def replace_group(self, group, values):
+        """Set values (keys without the group) and remove the other keys directly in group, as one change."""
+        prefix = group + '/' if group else ''
+        with self._lock:
+            removed = [prefix + key for key in self.child_keys(group) if key not in values]
+            self.set_values({prefix + key: value for key, value in values.items()}, removed)
+
+    def set_value(self, key, value):
+        self.set_values({key: value})
+
+    def remove(self, key):
+        self.set_values({}, removed=[key])
+
+    def child_keys(self, group=''):
+        """The keys directly in group, without the group."""
+        prefix = group + '/' if group else ''
+        with self._lock:
+            return [key[len(prefix):] for key in self._values
+                    if key.startswith(prefix) and '/' not in key[len(prefix):]]
+
+    def take_changes(self):
+        """The changes since the last call, as ({key: value}, [removed keys])."""
+        with self._lock:
+            changes, self._changes = self._changes, {}
+        removed = [key for key, value in changes.items() if value is _REMOVED]
+        return {key: value for key, value in changes.items() if value is not _REMOVED}, removed
+
+    @property
+    def dirty(self):
+        return bool(self._changes)
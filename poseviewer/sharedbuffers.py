@@ -0,0 +1,131 @@
+"""
+Memory shared between processes, as memory mapped files that the worker processes of a pool open by path.
+"""
+
+import os
+import mmap
+import shutil
+import tempfile
+import threading
+from collections import deque
+
+
+def _shared_dir():
+    """A directory in RAM where there is one (Linux), so the buffers are never written out to disk."""
+    return '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+class SharedBuffer:
+    """A memory mapped temporary file of size bytes. Other processes write into it with write_buffer(path, data)."""
+
+    def __init__(self, directory, size):
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.buf')
+        try:
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.size = size
+
+    def view(self, size):
+        """A memoryview of the first size bytes, the buffer can't be closed while it is alive."""
+        return memoryview(self.map)[:size]
+
+    def close(self):
+        """Unmap and delete the file. Raises BufferError while a view is alive."""
+        self.map.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def write_buffer(path, data):
+    """Runs in a worker process. Write data (a bytes-like object) to the start of the SharedBuffer at path."""
+    with open(path, 'r+b') as f, mmap.mmap(f.fileno(), 0) as buffer:
+        buffer[:len(data)] = data
+
+
+class BufferPool:
+    """
+    SharedBuffers that are leased for one decoded image each and reused once nothing reads them any more.
+
+    A leased buffer comes with an in_use function and only goes back to the pool once it returns False, so a buffer
+    is never written to while an image still shows it. Leases are checked when a buffer is acquired. Free buffers
+    are reused oldest first and deleted while the pool holds more than budget bytes. Safe to use from any thread.
+    """
+
+    GRANULARITY = 1024 * 1024
+
+    def __init__(self, budget, directory=None):
+        self.budget = budget
+        self.bytes = 0
+        self.directory = tempfile.mkdtemp(prefix='poseviewer-', dir=directory or _shared_dir())
+        self._free = deque()
+        self._leases = []  # (buffer, in_use)
+        self._lock = threading.Lock()
+
+    def acquire(self, size):
+        """A buffer of at least size bytes, to be given back with lease() or release()."""
+        with self._lock:
+            self._reclaim()
+            for buffer in self._free:
+                if size <= buffer.size <= 2 * size + self.GRANULARITY:  # don't tie up a large buffer for a small image
+                    self._free.remove(buffer)
+                    return buffer
+            size = -(-size // self.GRANULARITY) * self.GRANULARITY
+            buffer = SharedBuffer(self.directory, size)
+            self.bytes += buffer.size
+            self._trim()
+            return buffer
+
+    def lease(self, buffer, in_use):
+        """Take buffer back once in_use() returns False."""
+        with self._lock:
+            self._leases.append((buffer, in_use))
+
+    def release(self, buffer):
+        """Take buffer back right away (nothing reads it)."""
+        with self._lock:
+            self._free.append(buffer)
+            self._trim()
+
+    def leased(self):
+        with self._lock:
+            self._reclaim()
+            return len(self._leases)
+
+    def _reclaim(self):
+        leases = []
+        for buffer, in_use in self._leases:
+            if in_use():
+                leases.append((buffer, in_use))
+            else:
+                self._free.append(buffer)
+        self._leases = leases
+
+    def _trim(self):
+        for i in range(len(self._free)):
+            if self.bytes <= self.budget:
+                break
+            buffer = self._free.popleft()
+            try:
+                buffer.close()
+            except BufferError:  # a view of it is still being let go of, try again next time
+                self._free.append(buffer)
+                continue
+            self.bytes -= buffer.size
+
+    def close(self):
+        """Delete every buffer. Leased buffers stay mapped as long as their views are alive."""
+        with self._lock:
+            buffers = list(self._free) + [buffer for buffer, in_use in self._leases]
+            self._free.clear()
+            self._leases = []
+            self.bytes = 0
+        for buffer in buffers:
+            try:
+                buffer.close()
+            except BufferError:
+                pass
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,51 @@
+"""
+Plan slideshows ahead of time, without any widgets.
+
+Each planner returns the seconds every image is shown for, in the order the matching slideshow in
+slideshowsettings plays them. group_plan() folds that into (images, seconds per image) segments.
+"""
+
+import random
+from itertools import groupby
+
+
+NO_PRESET, INCREMENTAL, RANDOM_TIME, IMAGES_TIME = range(4)  # the presets of SlideshowSettings.preset_selector
+
+
+def fixed_plan(base_speed, images):
+    return [base_speed] * images
+
+
+def incremental_plan(base_speed, increment_interval):
+    """Like IncrementalSlideshow: the time per image doubles every time fewer images are left at the current speed."""
+    plan = []
+    speed, counter, interval = base_speed, 1, increment_interval
+    while interval != 0:
+        if counter >= interval:
+            speed = base_speed * 2 ** ((increment_interval - counter) + 1)
+            counter = 1
+            interval -= 1
+        else:
+            counter += 1
+        plan.append(speed)
+    return plan
+
+
+def random_time_plan(times, total_time, rng=random):
+    """Like RandomTimeSlideshow: random times from times until total_time is used up, the last one cut short."""
+    plan = []
+    elapsed = 0
+    while times and elapsed < total_time:
+        speed = min(rng.choice(times), total_time - elapsed)
+        elapsed += speed
+        plan.append(speed)
+    return plan
+
+
+def images_time_plan(rows):
+    """Like ImageTimeProductSlideshow: rows of (images, seconds per image)."""
+    return [secs for images, secs in rows for i in range(images)]
+
+
+def group_plan(plan):
+    return [(len(list(group)), secs) for secs, group in groupby(plan)]
@@ -38,12 +38,12 @@ class SlideshowSettings(QDialog, SlideshowSettingsUi):
             self.resize(_settings.value('size', self.size()))
             self.move(_settings.value('pos', self.pos()))
             self.base_speed_timeedit.setTime(_settings.value('base_speed', self.base_speed_timeedit.time()))
-            self.transition_speed_spinner.setValue(float(_settings.value('transition_speed', self.transition_speed_spinner.value())))
-            self.preset_selector.setCurrentIndex(int(_settings.value('selected_preset', 0)))
+            self.transition_speed_spinner.setValue(_settings.get_float('transition_speed', self.transition_speed_spinner.value()))
+            self.preset_selector.setCurrentIndex(_settings.get_int('selected_preset', 0))
             self.total_random_time_edit.setTime(_settings.value('total_random_time_edit', self.total_random_time_edit.time()))
 
             with _settings.in_group('interval_settings'):
-                self.increment_interval_spinner.setValue(int(_settings.value('increment_interval', self.increment_interval_spinner.value())))
+                self.increment_interval_spinner.setValue(_settings.get_int('increment_interval', self.increment_interval_spinner.value()))
 
 
     def write_settings(self):
@@ -55,16 +55,11 @@ class SlideshowSettings(QDialog, SlideshowSettingsUi):
                 'base_speed': self.base_speed_timeedit.time(),
                 'transition_speed': self.transition_speed_spinner.value(),
                 'selected_preset': self.preset_selector.currentIndex(),
-                'total_random_time_edit': self.total_random_time_edit.time()
+                'total_random_time_edit': self.total_random_time_edit.time(),
+                'interval_settings/increment_interval': self.increment_interval_spinner.value()
             }
             _settings.set_values(general_settings)
 
-            with _settings.in_group('interval_settings'):
-                interval_settings = {
-                    'increment_interval': self.increment_interval_spinner.value()
-                }
-                _settings.set_values(interval_settings)
-
     def closeEvent(self, event):
         self.write_settings()
         self.images_time_table.write_settings()
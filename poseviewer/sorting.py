@@ -0,0 +1,226 @@
+"""
+Sort orders of image sequences.
+
+A sort is an array('I') of positions in a CompactSequence (see sequence.PermutedSequence), so the paths
+themselves are never copied or moved.
+"""
+
+import os
+import re
+from array import array
+from itertools import repeat
+
+
+NAME, FOLDER, MODIFIED, SIZE, DIMENSIONS = 'name', 'folder', 'modified', 'size', 'dimensions'
+
+SORT_ORDERS = ((FOLDER, "Folder"), (NAME, "File name"), (MODIFIED, "Date modified"), (SIZE, "File size"),
+               (DIMENSIONS, "Dimensions"))
+
+_DIGITS = re.compile(rb'(\d+)')
+_NUMBER_WIDTH = 20
+
+
+def natural_keys(names):
+    """
+    Keys of encoded file names (bytes) that sort numbers by value ('img2' before 'img10') and ignore ASCII case.
+    Every digit run is zero padded, all names at once so the work stays in C.
+    """
+    parts = _DIGITS.split(b'\0'.join(names).lower())
+    parts[1::2] = map(bytes.zfill, parts[1::2], repeat(_NUMBER_WIDTH))
+    return b''.join(parts).split(b'\0')
+
+
+def natural_key(name):
+    return natural_keys([name])[0]
+
+
+class SequenceSorter:
+    """
+    Sorts a CompactSequence by one of the SORT_ORDERS.
+
+    The keys of every kind that was sorted by are kept in an array('d') per kind, so sorting by it again
+    (or after images were added) only sorts numbers. Modification times, sizes and dimensions are their own
+    keys. Name keys are long strings, so their arrays hold ranks instead: the index of the image in the sorted
+    order, with images inserted later ranked halfway between their neighbours.
+
+    metadata is a function from a path to its ImageMetadata or None. Images whose dimensions aren't known
+    when they are sorted in go last. stat is a function from a path to its (size, mtime) if they are known
+    without touching the file (see MetadataCache.file_stat), the other files are stat'ed. That is slow for
+    big sequences, so the GUI reads those keys in a worker first (see missing_keys and read_keys).
+    """
+
+    def __init__(self, kind=FOLDER, metadata=None, stat=None):
+        self.kind = kind
+        self.metadata = metadata or (lambda path: None)
+        self.stat = stat or (lambda path: None)
+        self.set_sequence(None)
+
+    def set_sequence(self, base):
+        self.base = base
+        self._keys = {}  # kind -> array('d') of keys (or ranks) by position
+
+    def rebase(self, base, positions):
+        """Sort base from now on, whose entry i was entry positions[i] of the previous sequence. Keeps the keys."""
+        size = len(self.base) if self.base is not None else 0
+        keys = {kind: array('d', map(kind_keys.__getitem__, positions))
+                for kind, kind_keys in self._keys.items() if len(kind_keys) >= size}
+        self.set_sequence(base)
+        self._keys = keys
+
+    def set_kind(self, kind):
+        self.kind = kind
+
+    def missing_keys(self):
+        """The (start, stop) positions whose keys of the current kind need the file system, or None if there are none."""
+        if self.base is None or self.kind not in (MODIFIED, SIZE):
+            return None
+        start = len(self._keys.get(self.kind, ()))
+        return (start, len(self.base)) if start < len(self.base) else None
+
+    def read_keys(self, base, kind, start, stop):
+        """The keys of kind of the entries start..stop of base. Changes nothing, so it can run in any thread."""
+        return array('d', (self._stat_key(kind, base[position]) for position in range(start, stop)))
+
+    def add_keys(self, base, kind, start, keys):
+        """Keep keys that read_keys returned, unless the sequence or the keys changed since."""
+        if base is self.base and len(self._keys.setdefault(kind, array('d'))) == start:
+            self._keys[kind].extend(keys)
+
+    def sort(self):
+        """The order of all the images of the sequence. Equal keys keep the order of the sequence."""
+        if self.kind == DIMENSIONS:
+            self._keys.pop(DIMENSIONS, None)  # dimensions that were unknown may have been probed since
+        keys = self._keys.get(self.kind)
+        if keys is None and self.kind in (NAME, FOLDER):
+            return self._rank(self._sort_names(range(len(self.base))))
+        if keys is not None and len(keys) < len(self.base) and self.kind in (NAME, FOLDER):
+            order = array('I', sorted(range(len(keys)), key=keys.__getitem__))
+            return self.insert(order, range(len(order), len(self.base)))[0]
+        keys = self._numeric_keys()
+        return array('I', sorted(range(len(self.base)), key=keys.__getitem__))
+
+    def insert(self, order, positions):
+        """
+        Insert positions (images appended to the sequence after order was sorted) into order.
+        Return the new order and the indices in order before which they were inserted (ascending).
+        Each image is put in place by a binary search, so a batch costs O(batch * log(sequence)) key
+        lookups and a single copy of order.
+        """
+        if self.kind in (NAME, FOLDER):
+            if self.kind not in self._keys:
+                self._rank(order)
+            folder_ranks = self._folder_ranks() if self.kind == FOLDER else None
+            keys = dict(zip(positions, self._name_keys(positions, folder_ranks)))
+            key = self._memo(keys, lambda position: self._name_keys([position], folder_ranks)[0])
+        else:
+            key = self._numeric_keys().__getitem__
+
+        positions = sorted(positions, key=key)
+        points = []
+        lo = 0
+        for position in positions:
+            item_key = key(position)
+            hi = len(order)
+            while lo < hi:  # bisect_right, so images with equal keys keep the order of the sequence
+                mid = (lo + hi) // 2
+                if item_key < key(order[mid]):
+                    hi = mid
+                else:
+                    lo = mid + 1
+            points.append(lo)
+
+        new_order = array('I')
+        start = 0
+        for point, position in zip(points, positions):
+            new_order.extend(order[start:point])
+            new_order.append(position)
+            start = point
+        new_order.extend(order[start:])
+
+        if self.kind in (NAME, FOLDER):
+            self._rank_inserted(order, new_order, points, positions)
+        return new_order, points
+
+    @staticmethod
+    def _memo(keys, func):
+        def key(position):
+            if position not in keys:
+                keys[position] = func(position)
+            return keys[position]
+        return key
+
+    def _name_keys(self, positions, folder_ranks=None):
+        """Sort keys of positions for NAME and FOLDER: bytes, or (folder rank, bytes)."""
+        names = natural_keys(self.base.name_bytes(positions))
+        if self.kind == NAME:
+            return names
+        return list(zip(map(folder_ranks.__getitem__, map(self.base.directory_id, positions)), names))
+
+    def _folder_ranks(self):
+        """The rank of every directory id in natural order, where 'a/b' comes before 'a b/c' like in file managers."""
+        directories = [directory.replace('\\', '/').encode('utf-8', 'surrogatepass') for directory in self.base.directories()]
+        keys = [key.replace(b'/', b'\1') for key in natural_keys(directories)]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        ranks = [0] * len(keys)
+        for rank, dir_id in enumerate(order):
+            ranks[dir_id] = rank
+        return ranks
+
+    def _sort_names(self, positions):
+        """Full sort for NAME and FOLDER: by name, then stably by folder, both at C speed."""
+        names = natural_keys(self.base.name_bytes(positions))
+        order = sorted(range(len(names)), key=names.__getitem__)
+        if self.kind == FOLDER:
+            folder_ranks = self._folder_ranks()
+            order.sort(key=list(map(folder_ranks.__getitem__, self.base.directory_ids())).__getitem__)
+        return array('I', order)
+
+    def _rank(self, order):
+        ranks = array('d', bytes(8 * len(self.base)))
+        for rank, position in enumerate(order):
+            ranks[position] = rank
+        self._keys[self.kind] = ranks
+        return order
+
+    def _rank_inserted(self, order, new_order, points, positions):
+        """Rank the inserted positions between their neighbours, or everything again when there is no room left."""
+        ranks = self._keys[self.kind]
+        ranks.extend(repeat(0.0, len(self.base) - len(ranks)))
+        i = 0
+        while i < len(points):
+            j = i
+            while j < len(points) and points[j] == points[i]:  # inserted at the same point
+                j += 1
+            count = j - i
+            low = ranks[order[points[i] - 1]] if points[i] > 0 else -1.0
+            high = ranks[order[points[i]]] if points[i] < len(order) else low + count + 1
+            step = (high - low) / (count + 1)
+            if not (low < low + step and low + step * count < high):  # out of float precision
+                self._rank(new_order)
+                return
+            for k in range(count):
+                ranks[positions[i + k]] = low + step * (k + 1)
+            i = j
+
+    def _numeric_keys(self):
+        keys = self._keys.setdefault(self.kind, array('d'))
+        if len(keys) < len(self.base):
+            keys.extend(map(self._numeric_key, range(len(keys), len(self.base))))
+        return keys
+
+    def _numeric_key(self, position):
+        path = self.base[position]
+        if self.kind == DIMENSIONS:
+            metadata = self.metadata(path)
+            return float(metadata.pixels) if metadata else float('inf')
+        return self._stat_key(self.kind, path)
+
+    def _stat_key(self, kind, path):
+        stat = self.stat(path)
+        if stat is None:
+            try:
+                result = os.stat(path)
+            except OSError:
+                return 0.0
+            stat = result.st_size, result.st_mtime
+        return stat[1] if kind == MODIFIED else float(stat[0])
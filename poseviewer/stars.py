@@ -0,0 +1,96 @@
+"""
+The starred images, kept in memory and saved to a file of their own.
+"""
+
+import os
+
+
+class StarStore:
+    """
+    The set of starred image paths, in the order they were starred.
+
+    Membership is a dict lookup, so asking whether an image is starred costs the same with 20k stars as with
+    none. The stars are stored in a UTF-8 text file, one path per line, instead of one INI value that has to
+    be parsed and rewritten as a whole on every change. Every change calls on_change, which is expected to
+    schedule a save (see corewidgets.StarSaver).
+    """
+
+    ENCODING = 'utf-8'
+    ERRORS = 'surrogatepass'
+
+    def __init__(self, path, on_change=None):
+        self.path = path
+        self.on_change = on_change or (lambda: None)
+        self._stars = {}  # path -> None, a set that remembers the order
+        self.dirty = False
+
+    def load(self):
+        """Read the stars file, return False if there isn't one."""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        lines = data.decode(self.ENCODING, self.ERRORS).split('\n')
+        self._stars = dict.fromkeys(line for line in lines if line)
+        self.dirty = False
+        return True
+
+    def __contains__(self, path):
+        return path in self._stars
+
+    def __len__(self):
+        return len(self._stars)
+
+    def __iter__(self):
+        return iter(self._stars)
+
+    def is_starred(self, path):
+        return path in self._stars
+
+    def paths(self):
+        return list(self._stars)
+
+    def star(self, paths):
+        """Star every one of paths, return the ones that weren't starred."""
+        added = [path for path in dict.fromkeys(paths) if path and path not in self._stars]
+        self._stars.update(dict.fromkeys(added))
+        self._changed(added)
+        return added
+
+    def unstar(self, paths):
+        """Unstar every one of paths, return the ones that were starred."""
+        removed = [path for path in dict.fromkeys(paths) if path in self._stars]
+        for path in removed:
+            del self._stars[path]
+        self._changed(removed)
+        return removed
+
+    def toggle(self, path):
+        """(Un)star path, return whether it is starred now."""
+        if path in self._stars:
+            self.unstar([path])
+            return False
+        self.star([path])
+        return True
+
+    def _changed(self, paths):
+        if paths:
+            self.dirty = True
+            self.on_change()
+
+    def encode(self):
+        """The contents of the stars file, taken at once so it can be written in another thread."""
+        self.dirty = False
+        return ''.join(path + '\n' for path in self._stars).encode(self.ENCODING, self.ERRORS)
+
+    def write(self, data):
+        """Replace the stars file with data (see encode)."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, self.path)
+
+    def save(self):
+        self.write(self.encode())
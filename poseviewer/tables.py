@@ -101,25 +101,18 @@ class RandomTimeTable(BaseTable):
         settings = Settings()
         with settings.in_group('settings_ui'):
             with settings.in_group('random_time_table'):
-                rows = int(settings.value('rows', self.rowCount()))
+                rows = settings.get_int('rows', self.rowCount())
                 self.setRowCount(rows)
                 for row in range(rows):
                     time = settings.value(str(row), self.DEFAULT_TIME)
                     self.model().setData(self.model().index(row, 0), time)
 
     def write_settings(self):
-        settings = Settings()
-        with settings.in_group('settings_ui'):
-            with settings.in_group('random_time_table'):
-                section_settings = {'rows': self.rowCount()}
-                for row in range(self.rowCount()):
-                    section_settings[str(row)] = self.item(row, 0).data(QtCore.Qt.DisplayRole)
-                settings.set_values(section_settings)
-
-                max_extra_rows = max([int(key) for key in settings.childKeys() if key != 'rows']) + 1
-                if max_extra_rows > section_settings['rows']:
-                    for extra_row in range(section_settings['rows'], max_extra_rows):
-                        settings.remove(str(extra_row))
+        """Write all rows at once, dropping the ones of a longer table."""
+        section_settings = {'rows': self.rowCount()}
+        for row in range(self.rowCount()):
+            section_settings[str(row)] = self.item(row, 0).data(QtCore.Qt.DisplayRole)
+        Settings().set_values(section_settings, group='settings_ui/random_time_table', replace=True)
 
 
 class ImagesTimeTable(BaseTable):
@@ -169,7 +162,7 @@ class ImagesTimeTable(BaseTable):
         settings = Settings()
         with settings.in_group('settings_ui'):
             with settings.in_group('images_time_table'):
-                rows = int(settings.value('rows', self.rowCount()))
+                rows = settings.get_int('rows', self.rowCount())
                 self.setRowCount(rows)
                 for row in range(rows):
                     image, time = settings.value(str(row), (self.DEFAULT_IMAGE, self.DEFAULT_TIME))
@@ -178,17 +171,10 @@ class ImagesTimeTable(BaseTable):
                     self.model().setData(self.model().index(row, 1), time)
 
     def write_settings(self):
-        settings = Settings()
-        with settings.in_group('settings_ui'):
-            with settings.in_group('images_time_table'):
-                section_settings = {'rows': self.rowCount()}
-                for row in range(section_settings['rows']):
-                    section_settings[str(row)] = self.item(row, 0).data(QtCore.Qt.DisplayRole), \
-                                                 self.item(row, 1).data(QtCore.Qt.DisplayRole)
-                settings.set_values(section_settings)
-
-                max_extra_rows = max([int(key) for key in settings.childKeys() if key != 'rows']) + 1
-                if max_extra_rows > section_settings['rows']:
-                    for extra_row in range(section_settings['rows'], max_extra_rows):
-                        settings.remove(str(extra_row))
+        """Write all rows at once, dropping the ones of a longer table."""
+        section_settings = {'rows': self.rowCount()}
+        for row in range(section_settings['rows']):
+            section_settings[str(row)] = self.item(row, 0).data(QtCore.Qt.DisplayRole), \
+                                         self.item(row, 1).data(QtCore.Qt.DisplayRole)
+        Settings().set_values(section_settings, group='settings_ui/images_time_table', replace=True)
 
@@ -0,0 +1,176 @@
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+import os
+from collections import OrderedDict
+
+from .thumbnails import thumbnail_size
+
+
+class SequenceListModel(QAbstractListModel):
+    """
+    List model over a sequence of image paths (a list, CompactSequence or PermutedSequence), with thumbnails
+    as decorations. The sequence is kept as it is, so showing 500k paths copies nothing.
+
+    Thumbnails are only asked for when the view paints a row: the rows wanted by one paint are requested
+    together from the ThumbnailService once control returns to the event loop. Converted pixmaps are kept
+    for the PIXMAP_CACHE most recently shown rows.
+    """
+
+    PIXMAP_CACHE = 2000
+
+    def __init__(self, thumbnails, icon_size, parent=None):
+        super().__init__(parent)
+
+        self.thumbnails = thumbnails
+        self.icon_size = icon_size
+        self.paths = []
+        self._find = self._scan
+
+        self.pixmaps = OrderedDict()  # path -> QPixmap scaled to icon_size
+        self.requested = {}  # path -> row
+        self._wanted = {}  # path -> row, to request on the next round of the event loop
+        self.placeholder = QPixmap(icon_size)
+        self.placeholder.fill(Qt.transparent)
+
+        self.request_timer = QTimer(self, singleShot=True, interval=0)
+        self.request_timer.timeout.connect(self.request_wanted)
+        self.thumbnails.thumbnailReady.connect(self.handle_thumbnail)
+
+    def set_paths(self, paths, find=None):
+        """
+        Show paths, which mustn't change while they are shown. find(path) returns the row of path or -1,
+        by default through the sequence's own find (the hash index of a CompactSequence).
+        """
+        self.cancel_requests()
+        self.beginResetModel()
+        self.paths = paths
+        self._find = find or getattr(paths, 'find', None) or self._scan
+        self.endResetModel()
+
+    def find(self, path):
+        """The row of path or -1."""
+        return self._find(path)
+
+    def _scan(self, path):
+        try:
+            return self.paths.index(path)
+        except ValueError:
+            return -1
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.paths):
+            return None
+        path = self.paths[index.row()]
+        if role == Qt.DisplayRole:
+            return os.path.basename(path)
+        elif role == Qt.ToolTipRole or role == Qt.UserRole:
+            return path
+        elif role == Qt.DecorationRole:
+            pixmap = self.pixmaps.get(path)
+            if pixmap is not None:
+                self.pixmaps.move_to_end(path)
+                return pixmap
+            if path not in self.requested:
+                self._wanted[path] = index.row()
+                self.request_timer.start()
+            return self.placeholder
+        return None
+
+    def path(self, index):
+        return self.paths[index.row()] if index.isValid() else ""
+
+    def request_wanted(self):
+        wanted, self._wanted = self._wanted, {}
+        for path, row in wanted.items():
+            self.requested[path] = row
+            self.thumbnails.request(path, self.icon_size)
+
+    def cancel_outside(self, first, last):
+        """Cancel the requests of rows outside first..last, which have been scrolled past."""
+        for path, row in list(self.requested.items()):
+            if not first <= row <= last:
+                del self.requested[path]
+                self.thumbnails.cancel(path, self.icon_size)
+        self._wanted = {path: row for path, row in self._wanted.items() if first <= row <= last}
+
+    def cancel_requests(self):
+        self.cancel_outside(0, -1)
+
+    def handle_thumbnail(self, path, side, image):
+        if side != thumbnail_size(self.icon_size):
+            return
+        row = self.requested.pop(path, None)
+        if row is None:
+            return
+        if image.width() > self.icon_size.width() or image.height() > self.icon_size.height():
+            image = image.scaled(self.icon_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.pixmaps[path] = QPixmap.fromImage(image)
+        while len(self.pixmaps) > self.PIXMAP_CACHE:
+            self.pixmaps.popitem(last=False)
+
+        if row >= len(self.paths) or self.paths[row] != path:  # the model changed since the request
+            return
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+
+class ThumbnailGridView(QListView):
+    """
+    Icon mode view for a SequenceListModel.
+
+    Items have a uniform size and are laid out in batches, so the view stays responsive with 100k rows.
+    When scrolling settles, thumbnail requests for rows that are no longer near the viewport are cancelled.
+    """
+
+    ICON_SIZE = QSize(128, 128)
+    SCROLL_SETTLE = 100  # ms
+    MARGIN_ROWS = 2  # rows of items above and below the viewport that keep their requests
+
+    def __init__(self, thumbnails, parent=None):
+        super().__init__(parent)
+
+        self.setViewMode(QListView.IconMode)
+        self.setResizeMode(QListView.Adjust)
+        self.setMovement(QListView.Static)
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(500)
+        self.setIconSize(self.ICON_SIZE)
+        self.setGridSize(self.ICON_SIZE + QSize(24, 36))
+        self.setWordWrap(False)
+        self.setTextElideMode(Qt.ElideMiddle)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+
+        self.sequence_model = SequenceListModel(thumbnails, self.ICON_SIZE, self)
+        self.setModel(self.sequence_model)
+
+        self.scroll_timer = QTimer(self, singleShot=True, interval=self.SCROLL_SETTLE)
+        self.scroll_timer.timeout.connect(self.cancel_scrolled_past)
+        self.verticalScrollBar().valueChanged.connect(self.scroll_timer.start)
+
+    def set_paths(self, paths, find=None):
+        self.sequence_model.set_paths(paths, find)
+
+    def visible_rows(self):
+        """Return the (first, last) row in view, widened by MARGIN_ROWS rows of items."""
+        rect = self.viewport().rect()
+        first = self.indexAt(rect.topLeft() + QPoint(1, 1))
+        last = self.indexAt(QPoint(rect.right() - 1, rect.bottom() - 1))
+        first = first.row() if first.isValid() else 0
+        last = last.row() if last.isValid() else self.sequence_model.rowCount() - 1
+        columns = max(1, rect.width() // max(1, self.gridSize().width()))
+        return max(0, first - self.MARGIN_ROWS * columns), last + self.MARGIN_ROWS * columns
+
+    def cancel_scrolled_past(self):
+        self.sequence_model.cancel_outside(*self.visible_rows())
+
+    def find_path(self, path):
+        row = self.sequence_model.find(path)
+        return self.sequence_model.index(row) if row >= 0 else None
+
+    def selected_paths(self):
+        return [self.sequence_model.path(index) for index in sorted(self.selectedIndexes(), key=lambda index: index.row())]
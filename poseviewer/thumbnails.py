@@ -0,0 +1,332 @@
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+import os
+import mmap
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing, contextmanager
+
+from .imageloader import DirectoryScanner
+from .imagedecoder import decode_image
+
+
+THUMBNAIL_SIZES = (128, 256, 512, 1024, 2048)  # thumbnails are generated for the smallest size that covers a request
+THUMBNAIL_QUALITY = 85
+
+
+def thumbnail_size(size):
+    """The thumbnail size (length of the longer side) to use for a QSize."""
+    side = max(size.width(), size.height())
+    for thumbnail_side in THUMBNAIL_SIZES:
+        if thumbnail_side >= side:
+            return thumbnail_side
+    return THUMBNAIL_SIZES[-1]
+
+
+def init_worker():
+    """Initializer of the worker processes that make thumbnails (see make_thumbnail)."""
+    global _worker_app
+    if QCoreApplication.instance() is None:  # image format plugins are looked up through the application
+        _worker_app = QCoreApplication([])
+
+
+def make_thumbnail(path, side):
+    """
+    Runs in a worker process. Return (file size, mtime, JPEG bytes) of the thumbnail of the image at path,
+    scaled down to fit a square of side pixels. The bytes are empty if the image can't be read.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0, 0, b''
+    image, source_size = decode_image(path, QSize(side, side))
+    if image.isNull():
+        return stat.st_size, stat.st_mtime, b''
+
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, "JPG", THUMBNAIL_QUALITY)
+    buffer.close()
+    return stat.st_size, stat.st_mtime, data.data()
+
+
+class ThumbnailStore:
+    """
+    Persistent thumbnail cache keyed by (path, thumbnail size) and validated by the file's size and mtime.
+
+    Thumbnails are appended to a few large pack files (a new one is started every PACK_SIZE bytes) and read
+    through memory maps, so the cache doesn't litter the disk with thousands of tiny files.
+    The offsets are kept in an SQLite index that is loaded on first use. Safe to use from any thread.
+    """
+
+    PACK_SIZE = 64 * 1024 * 1024
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS thumbnails (
+            path TEXT,
+            side INTEGER,
+            size INTEGER,
+            mtime REAL,
+            pack INTEGER,
+            offset INTEGER,
+            length INTEGER,
+            PRIMARY KEY (path, side)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.db_path = os.path.join(cache_dir, "thumbnails.db")
+
+        self._lock = threading.Lock()
+        self._index = None  # (path, side) -> (size, mtime, pack, offset, length), loaded on first use
+        self._dirty = {}
+        self._maps = {}  # pack -> mmap
+        self._pack = None
+        self._pack_size = 0
+
+    def pack_path(self, pack):
+        return os.path.join(self.cache_dir, "thumbnails-{:04d}.pack".format(pack))
+
+    def get(self, path, side):
+        """Return the JPEG bytes of the thumbnail or None if it is missing or the file has changed since."""
+        entry = self._entries().get((path, side))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        size, mtime, pack, offset, length = entry
+        if size != stat.st_size or mtime != stat.st_mtime:
+            return None
+
+        with self._lock:
+            try:
+                view = self._map(pack, offset + length)
+            except (OSError, ValueError):
+                return None
+            return view[offset:offset + length] if view is not None else None
+
+    def __contains__(self, key):
+        return key in self._entries()
+
+    def put(self, path, side, size, mtime, data):
+        """Append data to the current pack. A thumbnail of an older version of the file becomes garbage."""
+        self._entries()
+        with self._lock:
+            if self._pack is None or self._pack_size + len(data) > self.PACK_SIZE:
+                self._next_pack()
+            with open(self.pack_path(self._pack), 'ab') as f:
+                f.write(data)
+            self._index[path, side] = self._dirty[path, side] = (size, mtime, self._pack, self._pack_size, len(data))
+            self._pack_size += len(data)
+
+    def _next_pack(self):
+        packs = [entry[2] for entry in self._index.values()]
+        self._pack = max(packs) if packs else 0
+        try:
+            self._pack_size = os.path.getsize(self.pack_path(self._pack))
+        except OSError:
+            self._pack_size = 0
+        if self._pack_size >= self.PACK_SIZE:
+            self._pack += 1
+            self._pack_size = 0
+
+    def _map(self, pack, end):
+        """Return a memory map of pack that reaches at least end, mapping it again if it has grown since."""
+        view = self._maps.get(pack)
+        if view is None or len(view) < end:
+            if view is not None:
+                view.close()
+            with open(self.pack_path(pack), 'rb') as f:
+                view = self._maps[pack] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return view if len(view) >= end else None
+
+    def _entries(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._load()
+        return self._index
+
+    @contextmanager
+    def _connect(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with closing(sqlite3.connect(self.db_path)) as connection:
+            connection.executescript(self.SCHEMA)
+            with connection:
+                yield connection
+
+    def _load(self):
+        with self._connect() as connection:
+            return {(path, side): tuple(values) for path, side, *values in connection.execute("SELECT * FROM thumbnails")}
+
+    def save(self):
+        """Write the index entries of the newly added thumbnails."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        with self._connect() as connection:
+            connection.executemany("INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   [key + entry for key, entry in dirty.items()])
+
+    def close(self):
+        with self._lock:
+            for view in self._maps.values():
+                view.close()
+            self._maps.clear()
+
+
+class ThumbnailService(QObject):
+    """
+    Serve thumbnails from a ThumbnailStore and generate the missing ones in a pool of worker processes.
+
+    Requests are handed to the pool a few at a time, so a request for the image the user is looking at
+    jumps ahead of a running warm_up(). thumbnailReady carries (path, thumbnail size, QImage) and is emitted
+    in the GUI thread. The cache lookups (a stat per file) and the directory scans of warm_up() run in a
+    worker thread too, so the GUI thread never touches the disk.
+    """
+
+    thumbnailReady = Signal(str, int, QImage)
+    warmUpProgress = Signal(int, int)  # done, total
+
+    _generated = Signal(str, int, object)
+    _looked_up = Signal(str, int, object)  # QImage of a cached thumbnail or None
+    _scanned = Signal(int, list)  # warm-up generation, keys missing from the store
+
+    WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+    IN_FLIGHT = 2 * WORKERS
+    SAVE_DELAY = 2000
+
+    def __init__(self, cache_dir, parent=None):
+        super().__init__(parent)
+
+        self.store = ThumbnailStore(cache_dir)
+        self.executor = None  # started on first use, spawning processes is not free
+        self.lookup_executor = ThreadPoolExecutor(max_workers=1)
+
+        self._queue = deque()  # (path, side) waiting for a worker, requests first and warm-up after them
+        self._pending = set()  # every queued or running (path, side)
+        self._running = set()
+        self._requested = set()  # the pending keys to deliver through thumbnailReady
+        self._in_flight = 0
+        self._warm_up = set()
+        self.warm_up_total = 0
+        self.warm_up_generation = 0
+
+        self._generated.connect(self.handle_generated, Qt.QueuedConnection)
+        self._looked_up.connect(self.handle_looked_up, Qt.QueuedConnection)
+        self._scanned.connect(self.handle_scanned, Qt.QueuedConnection)
+
+        self.save_timer = QTimer(self, singleShot=True, interval=self.SAVE_DELAY)
+        self.save_timer.timeout.connect(self.store.save)
+
+    def request(self, path, size):
+        """Deliver the thumbnail of path for a QSize through thumbnailReady, generating it first if needed."""
+        key = (path, thumbnail_size(size))
+        self._requested.add(key)
+        self.lookup_executor.submit(self._look_up, *key)
+
+    def _look_up(self, path, side):
+        data = self.store.get(path, side)
+        self._looked_up.emit(path, side, QImage.fromData(data, "JPG") if data is not None else None)
+
+    def handle_looked_up(self, path, side, image):
+        key = (path, side)
+        if key not in self._requested:  # cancelled in the meantime
+            return
+        if image is not None:
+            self._requested.discard(key)
+            self.thumbnailReady.emit(path, side, image)
+            return
+        if key in self._running:
+            return
+        self._pending.add(key)
+        self._queue.appendleft(key)  # an older queue entry of key is skipped once it comes up
+        self._pump()
+
+    def cancel(self, path, size):
+        """Forget a request that isn't running yet, e.g. for a row scrolled out of view. Warm-up keeps its thumbnails."""
+        key = (path, thumbnail_size(size))
+        self._requested.discard(key)
+        if key not in self._running and key not in self._warm_up:
+            self._pending.discard(key)
+
+    def warm_up(self, dir_path, size):
+        """Generate the missing thumbnails of every image in dir_path (not its subdirectories) for a QSize."""
+        self.lookup_executor.submit(self._scan, self.warm_up_generation, dir_path, thumbnail_size(size))
+
+    def _scan(self, generation, dir_path, side):
+        missing = [(path, side) for path in DirectoryScanner(max_depth=0).scan(dir_path)
+                   if self.store.get(path, side) is None]
+        self._scanned.emit(generation, missing)
+
+    def handle_scanned(self, generation, missing):
+        if generation != self.warm_up_generation:  # cancelled in the meantime
+            return
+        missing = [key for key in missing if key not in self._pending]
+        self._pending.update(missing)
+        self._queue.extend(missing)
+        self._warm_up.update(missing)
+        self.warm_up_total += len(missing)
+        self.warmUpProgress.emit(self.warm_up_total - len(self._warm_up), self.warm_up_total)
+        self._pump()
+
+    def cancel_warm_up(self):
+        self.warm_up_generation += 1
+        self._pending.difference_update(self._warm_up - self._requested - self._running)
+        self._warm_up.clear()
+        self.warm_up_total = 0
+
+    def _pump(self):
+        while self._queue and self._in_flight < self.IN_FLIGHT:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.WORKERS, initializer=init_worker)
+            path, side = key = self._queue.popleft()
+            if key not in self._pending or key in self._running:  # cancelled or moved to the front
+                continue
+            self._running.add(key)
+            future = self.executor.submit(make_thumbnail, path, side)
+            future.add_done_callback(lambda future, key=key: self._generated.emit(key[0], key[1], _result(future)))
+            self._in_flight += 1
+
+    def handle_generated(self, path, side, result):
+        self._in_flight -= 1
+        self._pending.discard((path, side))
+        self._running.discard((path, side))
+        size, mtime, data = result
+        if data:
+            self.store.put(path, side, size, mtime, data)
+            self.save_timer.start()
+            if (path, side) in self._requested:
+                self.thumbnailReady.emit(path, side, QImage.fromData(data, "JPG"))
+        self._requested.discard((path, side))
+
+        if (path, side) in self._warm_up:
+            self._warm_up.discard((path, side))
+            self.warmUpProgress.emit(self.warm_up_total - len(self._warm_up), self.warm_up_total)
+            if not self._warm_up:
+                self.warm_up_total = 0
+        self._pump()
+
+    def shutdown(self):
+        self._queue.clear()
+        self.lookup_executor.shutdown(wait=False)
+        self.save_timer.stop()
+        self.store.save()
+        self.store.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+
+def _result(future):
+    """The result of a make_thumbnail future, an empty one if it failed or was cancelled by shutdown."""
+    if future.cancelled() or future.exception() is not None:
+        return 0, 0, b''
+    return future.result()
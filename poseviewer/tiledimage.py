@@ -0,0 +1,263 @@
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+import io
+import math
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from .imagedecoder import MAX_DECODE_PIXELS
+
+
+TILING_THRESHOLD = 8192  # images wider or taller than this are drawn from tiles
+
+_tile_executor = ThreadPoolExecutor(max_workers=2)
+
+
+def needs_tiling(source_size):
+    return max(source_size.width(), source_size.height()) > TILING_THRESHOLD
+
+
+class TilePack:
+    """
+    Tiles kept as raw pixels in a temporary file (deleted once the pack is garbage collected), for the levels of
+    an image that are too large to keep whole. Safe to use from any thread.
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._index = {}  # key -> (offset, byte count, width, height, bytes per line, format)
+        self._lock = threading.Lock()
+
+    def add(self, key, image):
+        data = bytes(image.constBits())
+        with self._lock:
+            offset = self._file.seek(0, io.SEEK_END)
+            self._file.write(data)
+            self._index[key] = (offset, len(data), image.width(), image.height(), image.bytesPerLine(), image.format())
+
+    def get(self, key):
+        """The tile at key, a null QImage if it isn't in the pack."""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return QImage()
+            offset, count, width, height, bytes_per_line, image_format = entry
+            self._file.seek(offset)
+            data = self._file.read(count)
+        return QImage(data, width, height, bytes_per_line, image_format).copy()  # the QImage doesn't own data
+
+
+class TiledImageItem(QGraphicsObject):
+    """
+    Draws a very large image from a pyramid of tiles.
+
+    Level 0 is the full resolution and every next level halves it. Only the tiles that are visible at the level
+    matching the current zoom are decoded (lazily, in worker threads) and painted. Until a tile is ready the
+    area is covered by the preview, the display-size version of the image (null if the image is too large to
+    decode a preview of, see decode_image). Tiles are evicted least recently
+    used first once TILE_BUDGET is exceeded, so tiles that scrolled off-screen go first.
+
+    Every level is decoded once. Levels small enough are kept whole (LEVEL_IMAGES of them) and the coarser ones
+    are scaled from them. Tiles of the levels that are too large are decoded one by one if the format can decode
+    a part of the image on its own (JPEG), otherwise the whole image is decoded once into a TilePack.
+
+    Item coordinates are the pixel coordinates of the full resolution image.
+    """
+
+    TILE_SIZE = 512
+    TILE_BUDGET = 256 * 1024 * 1024
+    LEVEL_IMAGES = 2  # levels small enough to decode whole are kept to cut tiles from
+
+    _tileDecoded = Signal(int, object, QImage)
+
+    def __init__(self, path, source_size, preview, parent=None):
+        super().__init__(parent)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)  # fills option.exposedRect
+
+        self.path = path
+        self.source_size = source_size
+        self.preview = preview
+        self.max_level = max(0, math.ceil(math.log2(max(source_size.width(), source_size.height()) / self.TILE_SIZE)))
+
+        self.tiles = OrderedDict()  # (level, column, row) -> QPixmap
+        self.tile_bytes = 0
+        self.wanted = set()
+        self._requested = set()
+        self.generation = 0
+
+        self._levels = OrderedDict()  # level -> Future of the QImage of the whole level
+        self._pack = None  # Future of the TilePack
+        self._clips = None  # whether the format decodes only the clip rect, found out in a worker
+        self._level_lock = threading.Lock()  # guards _levels and _pack, not the decoding
+
+        self._tileDecoded.connect(self.handle_tile, Qt.QueuedConnection)
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.source_size.width(), self.source_size.height())
+
+    def set_preview(self, preview):
+        self.preview = preview
+        self.update()
+
+    def paint(self, painter, option, widget=None):
+        if not self.preview.isNull():
+            painter.drawPixmap(self.boundingRect(), self.preview, QRectF(self.preview.rect()))
+
+        level = self.level_for(QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform()))
+        if level is None:  # the preview has enough detail for this zoom
+            self.wanted = set()
+            return
+
+        extent = self.TILE_SIZE * 2 ** level  # size of a tile in item coordinates
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        wanted = set()
+        for row in range(int(exposed.top() // extent), math.ceil(exposed.bottom() / extent)):
+            for column in range(int(exposed.left() // extent), math.ceil(exposed.right() / extent)):
+                key = (level, column, row)
+                wanted.add(key)
+                pixmap = self.tiles.get(key)
+                if pixmap is None:
+                    self.request_tile(key)
+                else:
+                    self.tiles.move_to_end(key)
+                    painter.drawPixmap(self.tile_rect(key), pixmap, QRectF(pixmap.rect()))
+        self.wanted = wanted
+
+    def level_for(self, level_of_detail):
+        """The pyramid level for a zoom of level_of_detail device pixels per image pixel, None if the preview will do."""
+        if level_of_detail * self.source_size.width() <= self.preview.width():
+            return None
+        level = int(math.floor(math.log2(1 / level_of_detail))) if level_of_detail < 1 else 0
+        return min(max(level, 0), self.max_level)
+
+    def tile_rect(self, key):
+        level, column, row = key
+        extent = self.TILE_SIZE * 2 ** level
+        x, y = column * extent, row * extent
+        return QRectF(x, y, min(extent, self.source_size.width() - x), min(extent, self.source_size.height() - y))
+
+    def level_tile_rect(self, key):
+        """The rect of the tile in the pixels of its level."""
+        scale = 2 ** key[0]
+        rect = self.tile_rect(key).toAlignedRect()
+        return QRect(rect.x() // scale, rect.y() // scale, math.ceil(rect.width() / scale), math.ceil(rect.height() / scale))
+
+    def level_size(self, level):
+        scale = 2 ** level
+        return QSize(math.ceil(self.source_size.width() / scale), math.ceil(self.source_size.height() / scale))
+
+    def request_tile(self, key):
+        if key not in self._requested:
+            self._requested.add(key)
+            _tile_executor.submit(self._decode_tile, self.generation, key)
+
+    def cancel(self):
+        """Drop every queued tile request, e.g. when the item is removed from the scene."""
+        self.generation += 1
+        self.wanted = set()
+        self._requested.clear()
+
+    def _decode_tile(self, generation, key):
+        """Runs in a worker thread."""
+        if generation != self.generation or key not in self.wanted:  # scrolled past or zoomed away
+            self._tileDecoded.emit(generation, key, QImage())
+            return
+
+        scaled_rect = self.level_tile_rect(key)
+        level_image = self.level_image(key[0])
+        if level_image is not None:
+            tile = level_image.copy(scaled_rect)
+        elif self.clips_while_decoding():  # decode only the tile, the rest of the image is skipped
+            reader = QImageReader(self.path)
+            reader.setClipRect(self.tile_rect(key).toAlignedRect())
+            reader.setScaledSize(scaled_rect.size())
+            tile = reader.read()
+        else:  # the format would decode the whole image for every tile
+            tile = self.tile_pack().get(key)
+        self._tileDecoded.emit(generation, key, tile)
+
+    def clips_while_decoding(self):
+        if self._clips is None:
+            self._clips = QImageReader(self.path).supportsOption(QImageIOHandler.ClipRect)
+        return self._clips
+
+    def level_image(self, level):
+        """
+        The whole image at level, or None if it's too large to keep. It is decoded once, and scaled from a finer
+        level if one is kept. Other workers wait for it outside of _level_lock.
+        """
+        size = self.level_size(level)
+        if size.width() * size.height() > MAX_DECODE_PIXELS:
+            return None
+
+        with self._level_lock:
+            future = self._levels.get(level)
+            decode = future is None
+            if decode:
+                future = self._levels[level] = Future()
+                finer = max((kept for kept, image in self._levels.items() if kept < level and image.done()), default=None)
+                finer = self._levels[finer] if finer is not None else None
+                while len(self._levels) > self.LEVEL_IMAGES:
+                    self._levels.popitem(last=False)
+            self._levels.move_to_end(level)
+
+        if decode:
+            if finer is not None:
+                image = finer.result().scaled(size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+            else:
+                reader = QImageReader(self.path)
+                reader.setScaledSize(size)
+                image = reader.read()
+            future.set_result(image)
+        return future.result()
+
+    def tile_pack(self):
+        """The TilePack of the levels too large to keep whole, built by the first worker that needs it."""
+        with self._level_lock:
+            build = self._pack is None
+            if build:
+                self._pack = Future()
+            future = self._pack
+        if build:
+            future.set_result(self._build_pack())
+        return future.result()
+
+    def _build_pack(self):
+        """Decode the image once, cut the levels too large to keep into tiles and keep the first level that isn't."""
+        pack = TilePack()
+        image = QImageReader(self.path).read()
+        if image.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied):
+            image = image.convertToFormat(QImage.Format_ARGB32)  # no color table to keep with the pixels
+        for level in range(self.max_level + 1):
+            size = self.level_size(level)
+            if size.width() * size.height() <= MAX_DECODE_PIXELS:
+                future = Future()
+                future.set_result(image)
+                with self._level_lock:
+                    self._levels.setdefault(level, future)
+                break
+            extent = self.TILE_SIZE * 2 ** level
+            for row in range(math.ceil(self.source_size.height() / extent)):
+                for column in range(math.ceil(self.source_size.width() / extent)):
+                    key = (level, column, row)
+                    pack.add(key, image.copy(self.level_tile_rect(key)))
+            image = image.scaled(self.level_size(level + 1), Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        return pack
+
+    def handle_tile(self, generation, key, tile):
+        if generation != self.generation:
+            return
+        self._requested.discard(key)
+        if tile.isNull():
+            return
+
+        pixmap = QPixmap.fromImage(tile)
+        self.tiles[key] = pixmap
+        self.tile_bytes += pixmap.width() * pixmap.height() * 4
+        while self.tile_bytes > self.TILE_BUDGET and len(self.tiles) > len(self.wanted):
+            evicted_key, evicted = self.tiles.popitem(last=False)
+            self.tile_bytes -= evicted.width() * evicted.height() * 4
+        self.update(self.tile_rect(key))
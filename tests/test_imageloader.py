@@ -0,0 +1,51 @@
+import time
+
+from poseviewer.imageloader import DirectoryScanner, ImageLoaderThread
+
+
+class SlowScanner(DirectoryScanner):
+    """Yields its batches after a delay, like a scan of a slow disk."""
+
+    def __init__(self, batches, delay):
+        super().__init__()
+        self.batches = batches
+        self.delay = delay
+
+    def scan_batches(self, paths):
+        for batch in self.batches:
+            time.sleep(self.delay)
+            yield batch
+
+
+def load(scanner, **kwargs):
+    batches = []
+    finished = []
+    thread = ImageLoaderThread(scanner=scanner, on_batch=lambda paths, total: batches.append((list(paths), total)),
+                               on_finished=finished.append, **kwargs)
+    thread.start()
+    thread.join()
+    assert finished == [False]
+    return batches
+
+
+def test_nothing_is_delivered_before_the_first_image():
+    assert load(SlowScanner([['/x/a.png']], 0.35)) == [(['/x/a.png'], 1)]
+
+
+def test_empty_scan_delivers_nothing():
+    assert load(SlowScanner([], 0.25)) == []
+
+
+def test_first_image_comes_alone_then_in_batches():
+    batches = load(SlowScanner([['/x/{}.png'.format(i) for i in range(5)]], 0), batch_size=2)
+    assert batches == [(['/x/0.png'], 1), (['/x/1.png', '/x/2.png'], 3), (['/x/3.png', '/x/4.png'], 5)]
+
+
+def test_scans_a_directory(tmp_path):
+    for name in ('a.png', 'b.txt', 'c/d.jpg'):
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_bytes(b'')
+    batches = load(DirectoryScanner(), dir_path=str(tmp_path))
+    assert sorted(path for paths, total in batches for path in paths) == \
+        [str(tmp_path / 'a.png'), str(tmp_path / 'c' / 'd.jpg')]
+    assert batches[-1][1] == 2
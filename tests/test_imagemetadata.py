@@ -0,0 +1,82 @@
+import struct
+
+import pytest
+
+from poseviewer.imagemetadata import read_metadata, MetadataCache
+
+
+def png(width, height):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I4sII5s4s', 13, b'IHDR', width, height, b'\x08\x02\0\0\0', b'crc!')
+
+
+def jpeg(width, height, orientation=None):
+    data = b'\xff\xd8'
+    if orientation is not None:
+        tiff = b'II*\0' + struct.pack('<IHHHIH2s', 8, 1, 0x0112, 3, 1, orientation, b'\0\0') + b'\0' * 4
+        exif = b'Exif\0\0' + tiff
+        data += b'\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif
+    return data + b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 3) + b'\0' * 6
+
+
+def gif(width, height, frames=1):
+    data = b'GIF89a' + struct.pack('<HHBBB', width, height, 0, 0, 0)
+    for i in range(frames):
+        data += b'\x2c' + struct.pack('<HHHHB', 0, 0, width, height, 0) + b'\x02\x01\x00\x00'
+    return data + b'\x3b'
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.mark.parametrize('name, data, expected', [
+    ('a.png', png(640, 480), (640, 480, 'png', 1, 1)),
+    ('a.jpg', jpeg(300, 200), (300, 200, 'jpeg', 1, 1)),
+    ('rotated.jpg', jpeg(300, 200, orientation=6), (300, 200, 'jpeg', 1, 6)),
+    ('a.gif', gif(20, 10, frames=3), (20, 10, 'gif', 3, 1)),
+    ('a.pgm', b'P5\n# comment\n12 34\n255\n', (12, 34, 'pgm', 1, 1)),
+    ('a.bmp', b'BM' + b'\0' * 12 + struct.pack('<Iii', 40, 7, -9), (7, 9, 'bmp', 1, 1)),
+])
+def test_read_metadata(tmp_path, name, data, expected):
+    assert tuple(read_metadata(write(tmp_path, name, data))) == expected
+
+
+def test_displayed_size_follows_exif_rotation(tmp_path):
+    metadata = read_metadata(write(tmp_path, 'rotated.jpg', jpeg(300, 200, orientation=6)))
+    assert metadata.displayed_size() == (200, 300)
+    assert metadata.orientation == 'portrait'
+
+
+@pytest.mark.parametrize('name, data', [
+    ('a.jpg', jpeg(300, 200)),
+    ('rotated.jpg', jpeg(300, 200, orientation=6)),
+    ('a.png', png(640, 480)),
+    ('a.gif', gif(20, 10, frames=2)),
+    ('a.pgm', b'P5\n12 34\n255\n'),
+    ('a.bmp', b'BM' + b'\0' * 12 + struct.pack('<Iii', 40, 7, 9)),
+])
+def test_truncated_files_have_no_metadata(tmp_path, name, data):
+    complete = read_metadata(write(tmp_path, name, data))
+    for length in range(len(data)):
+        metadata = read_metadata(write(tmp_path, name, data[:length]))
+        assert metadata is None or metadata[:3] == complete[:3]  # a cut off GIF has fewer frames
+
+
+def test_malformed_pnm(tmp_path):
+    assert read_metadata(write(tmp_path, 'a.pgm', b'P5 width')) is None
+
+
+def test_probe_async_reports_every_path(tmp_path, monkeypatch):
+    paths = [write(tmp_path, '{}.png'.format(i), png(i + 1, 1)) for i in range(5)]
+    cache = MetadataCache()
+    probe = cache.probe
+    monkeypatch.setattr(cache, 'probe', lambda path: 1 / 0 if path == paths[2] else probe(path))
+
+    results = []
+    for future in cache.probe_async(paths, results.extend):
+        future.result()
+    assert [path for path, metadata in results] == paths
+    assert results[2][1] is None
+    assert results[4][1].width == 5
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from poseviewer.libraryindex import IndexedDirectoryScanner, LibraryIndex
+
+
+def make_tree(root, paths):
+    for path in paths:
+        path = root / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'')
+
+
+def scanned(index, root, **kwargs):
+    return sorted(os.path.relpath(path, str(root)) for path in index.scan(str(root), **kwargs))
+
+
+def touch_dir(path, mtime):
+    """Set the mtime of a directory, so changes are seen even on file systems with coarse timestamps."""
+    os.utime(str(path), (mtime, mtime))
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / 'library'
+    make_tree(root, ['1.png', 'notes.txt', 'a/2.jpg', 'a/b/3.gif', 'c/4.png'])
+    return root
+
+
+def test_scan_finds_the_images(tmp_path, tree):
+    index = LibraryIndex(str(tmp_path / 'index' / 'library.db'))
+    assert scanned(index, tree) == ['1.png', 'a/2.jpg', 'a/b/3.gif', 'c/4.png']
+    assert scanned(index, tree, max_depth=0) == ['1.png']
+
+
+def test_unchanged_directories_come_from_the_index(tmp_path, tree, monkeypatch):
+    index = LibraryIndex(str(tmp_path / 'library.db'))
+    expected = scanned(index, tree)
+    assert set(index.load([str(tree)])) == {str(tree), str(tree / 'a'), str(tree / 'a' / 'b'), str(tree / 'c')}
+
+    monkeypatch.setattr(IndexedDirectoryScanner, '_rescan_dir',
+                        lambda self, dir_path, dir_stat: pytest.fail("listed " + dir_path))
+    assert scanned(index, tree) == expected
+
+
+def test_rescan_sees_added_and_removed_entries(tmp_path, tree, monkeypatch):
+    index = LibraryIndex(str(tmp_path / 'library.db'))
+    scanned(index, tree)
+
+    make_tree(tree, ['a/5.png', 'd/6.png'])
+    (tree / 'c' / '4.png').unlink()
+    (tree / 'a' / 'b' / '3.gif').unlink()
+    (tree / 'a' / 'b').rmdir()
+    for path, mtime in ((tree, 1000), (tree / 'a', 1000), (tree / 'c', 1000)):
+        touch_dir(path, mtime)
+
+    listed = []
+    rescan_dir = IndexedDirectoryScanner._rescan_dir
+    monkeypatch.setattr(IndexedDirectoryScanner, '_rescan_dir',
+                        lambda self, dir_path, dir_stat: listed.append(dir_path) or rescan_dir(self, dir_path, dir_stat))
+    assert scanned(index, tree) == ['1.png', 'a/2.jpg', 'a/5.png', 'd/6.png']
+    assert sorted(listed) == sorted(str(path) for path in (tree, tree / 'a', tree / 'c', tree / 'd'))
+    assert str(tree / 'a' / 'b') not in index.load([str(tree)])
+
+    del listed[:]
+    assert scanned(index, tree) == ['1.png', 'a/2.jpg', 'a/5.png', 'd/6.png']
+    assert listed == []
+
+
+def test_forget_drops_the_subtree(tmp_path, tree):
+    index = LibraryIndex(str(tmp_path / 'library.db'))
+    scanned(index, tree)
+    index.forget(str(tree / 'a'))
+    assert set(index.load([str(tree)])) == {str(tree), str(tree / 'c')}
+    assert scanned(index, tree) == ['1.png', 'c/4.png']  # the root is unchanged, so its cached subdirs are used
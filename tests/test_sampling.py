@@ -0,0 +1,103 @@
+import random
+from collections import Counter
+
+import pytest
+
+from poseviewer.sampling import AliasTable, ImageSampler
+from poseviewer.sequence import CompactSequence
+
+
+def library(folders):
+    """A CompactSequence with {folder: image count} images."""
+    return CompactSequence('/{}/{}.png'.format(folder, i) for folder, count in folders.items() for i in range(count))
+
+
+def test_alias_table_draws_in_proportion_to_the_weights():
+    table = AliasTable([1, 0, 3])
+    rng = random.Random(1)
+    counts = Counter(table.draw(rng) for i in range(20000))
+    assert counts[1] == 0
+    assert counts[2] / counts[0] == pytest.approx(3, rel=0.1)
+
+
+def test_alias_table_without_weight_draws_uniformly():
+    table = AliasTable([0, 0])
+    assert table.draw(random.Random(1)) in (0, 1)
+
+
+def test_every_image_is_drawn_once_per_round():
+    base = library({'a': 5, 'b': 30})
+    sampler = ImageSampler(base, rng=random.Random(2))
+    first_round = [sampler.draw() for i in range(len(base))]
+    assert sorted(first_round) == list(range(len(base)))
+    assert sampler.seen_count() == len(base)
+    assert sampler.draw() >= 0  # a new round
+    assert sampler.seen_count() == 1
+
+
+def test_empty_sequence_draws_nothing():
+    sampler = ImageSampler(CompactSequence())
+    assert sampler.draw() == -1
+    assert sampler.draw_path() is None
+    assert ImageSampler().draw_path() is None
+
+
+def test_balanced_folders_are_picked_equally_often():
+    base = library({'small': 2, 'large': 200})
+    sampler = ImageSampler(base, rng=random.Random(3))
+    sampler.RECENT_PENALTY = 1.0  # the rounds are one pick each, recent picks must not count less
+    firsts = Counter()
+    for i in range(2000):
+        sampler.new_round()
+        firsts[base[sampler.draw()].split('/')[1]] += 1
+    assert firsts['small'] / firsts['large'] == pytest.approx(1, rel=0.15)
+
+
+def test_starred_images_weigh_more():
+    base = library({'a': 2})
+    sampler = ImageSampler(base, rng=random.Random(4))
+    sampler.RECENT_PENALTY = 1.0
+    sampler.set_starred(['/a/1.png'])
+    firsts = Counter()
+    for i in range(4000):
+        sampler.new_round()
+        firsts[sampler.draw()] += 1
+    assert firsts[1] / firsts[0] == pytest.approx(ImageSampler.STAR_WEIGHT, rel=0.15)
+
+    sampler.set_star('/a/1.png', False)
+    assert sampler.weight(1) == 1.0
+
+
+def test_images_appended_to_the_base_are_drawn_too():
+    base = library({'a': 3})
+    sampler = ImageSampler(base, rng=random.Random(5))
+    base.extend(['/b/0.png', '/b/1.png'])
+    assert sorted(sampler.draw() for i in range(5)) == list(range(5))
+
+
+def test_seen_round_trips_through_restore_seen():
+    base = library({'a': 10})
+    sampler = ImageSampler(base, rng=random.Random(6))
+    drawn = {sampler.draw() for i in range(4)}
+    restored = ImageSampler(base, rng=random.Random(7))
+    restored.restore_seen(sampler.seen())
+    assert restored.seen_count() == 4
+    assert not drawn & {restored.draw() for i in range(6)}
+
+
+def test_rebase_keeps_the_seen_images_by_path():
+    base = library({'a': 4})
+    sampler = ImageSampler(base, rng=random.Random(8))
+    sampler.mark_seen('/a/2.png')
+    sampler.rebase(CompactSequence(['/a/2.png', '/a/3.png']))
+    assert sampler.seen() == b'\x01\x00'
+
+
+def test_permutation_puts_starred_images_first_on_average():
+    base = library({'a': 50})
+    sampler = ImageSampler(base, rng=random.Random(9))
+    sampler.set_starred(['/a/0.png'])
+    positions = list(range(50))
+    ranks = [list(sampler.permutation(positions)).index(0) for i in range(500)]
+    assert sorted(sampler.permutation(positions)) == positions
+    assert sum(ranks) / len(ranks) < 20  # 24.5 without the star
@@ -0,0 +1,66 @@
+from array import array
+
+import pytest
+
+from poseviewer.search import SearchIndex, filter_rows
+from poseviewer.sequence import CompactSequence, PermutedSequence
+
+
+PATHS = ['/poses/Standing/001.png', '/poses/sitting/002.JPG', '/poses/sitting/standing_003.png',
+         '/other/Walk cycle 10.gif', '/other/walk cycle 2.gif']
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('', [0, 1, 2, 3, 4]),
+    ('standing', [0, 2]),  # the folder of 0, the file name of 2
+    ('SITTING png', [2]),
+    ('*.png', [0, 2]),
+    ('*.jpg', [1]),
+    ('walk?cycle*', [3, 4]),
+    ('[0-9][0-9][0-9].*', [0, 1]),
+    ('[!0]*.png', [2]),
+    ('missing', []),
+])
+def test_search(query, expected):
+    assert list(SearchIndex(PATHS).search(query)) == expected
+
+
+def test_search_many_matches_takes_the_per_name_path():
+    paths = ['/dir/image{}.png'.format(i) for i in range(1000)] + ['/dir/other.jpg']
+    index = SearchIndex(CompactSequence(paths))
+    assert len(index.search('image')) == 1000
+    assert list(index.search('other')) == [1000]
+
+
+def test_results_are_indices_into_a_permuted_sequence():
+    base = CompactSequence(PATHS)
+    paths = PermutedSequence(base, array('I', [4, 3, 2, 1, 0]))
+    index = SearchIndex(paths)
+    assert [paths[i] for i in index.search('walk')] == ['/other/walk cycle 2.gif', '/other/Walk cycle 10.gif']
+    assert index.find('/poses/Standing/001.png') == 4
+    assert index.find('/missing.png') == -1
+
+
+def test_paths_appended_later_are_found():
+    base = CompactSequence(PATHS)
+    index = SearchIndex(base)
+    assert list(index.search('new')) == []
+    base.append('/new/004.png')
+    assert list(index.search('new')) == [5]
+    assert index.find('/new/004.png') == 5
+
+
+def test_append_to_a_list_sequence():
+    paths = list(PATHS)
+    index = SearchIndex(paths)
+    paths.append('/new/004.png')
+    index.append('/new/004.png')
+    assert list(index.search('004')) == [5]
+    assert index.find('/new/004.png') == 5
+
+
+def test_filter_rows():
+    rows = array('I', [1, 4, 9])
+    assert filter_rows(rows, 4) == 1
+    assert filter_rows(rows, 5) == -1
+    assert filter_rows(rows, 10) == -1
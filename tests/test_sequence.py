@@ -0,0 +1,102 @@
+from array import array
+
+import pytest
+
+from poseviewer import sequence
+from poseviewer.sequence import (CompactSequence, PermutedSequence, permutation, random_keys, shuffle_order,
+                                 unshuffle_order, inverse_permutation)
+
+
+PATHS = ['/a/1.png', '/a/2.png', '/b/c/3.jpg', '/a/1.png', '/b/\udcff.gif', 'rel.png']
+
+
+def test_compact_sequence_round_trips_paths():
+    paths = CompactSequence(PATHS)
+    assert list(paths) == PATHS
+    assert paths[2] == '/b/c/3.jpg'
+    assert paths[-1] == 'rel.png'
+    assert paths[1:3] == PATHS[1:3]
+    assert paths == PATHS
+    assert paths.directories() == ['/a', '/b/c', '/b', '']
+    with pytest.raises(IndexError):
+        paths[len(PATHS)]
+
+
+def test_find_and_index_return_the_first_position():
+    paths = CompactSequence(PATHS)
+    assert paths.find('/a/1.png') == 0
+    assert paths.index('/a/1.png', 1) == 3
+    assert paths.find('/b/\udcff.gif') == 4
+    assert paths.find('/missing.png') == -1
+    assert paths.find(None) == -1
+    with pytest.raises(ValueError):
+        paths.index('/missing.png')
+
+
+def test_find_sees_paths_appended_after_the_index_was_built():
+    paths = CompactSequence('/dir/{}.png'.format(i) for i in range(3000))
+    assert paths.find('/dir/10.png') == 10
+    paths.extend('/other/{}.png'.format(i) for i in range(10))
+    assert paths.find('/other/9.png') == 3009
+    paths.extend('/more/{}.png'.format(i) for i in range(2000))
+    assert paths.find('/more/1999.png') == 5009
+    assert paths.find('/dir/2999.png') == 2999
+
+
+def test_from_buffers_round_trips():
+    paths = CompactSequence(PATHS)
+    copy = CompactSequence.from_buffers(*paths.buffers())
+    assert copy == paths
+    assert copy.find('/b/c/3.jpg') == 2
+
+
+def test_permuted_sequence_is_followed_by_the_rest_of_base():
+    base = CompactSequence(['a', 'b', 'c', 'd'])
+    paths = PermutedSequence(base, array('I', [2, 0, 1]))
+    assert list(paths) == ['c', 'a', 'b', 'd']
+    assert [paths.find(path) for path in 'abcd'] == [1, 2, 0, 3]
+    assert paths.index('d') == 3
+    base.append('e')
+    assert paths[-1] == 'e'
+    assert len(paths) == 5
+
+
+def test_random_keys_are_splitmix64():
+    assert random_keys(1, 0)[0] == 0xE220A8397B1DCDAF  # the first output of SplitMix64 seeded with 0
+
+
+def test_random_keys_do_not_depend_on_numpy(monkeypatch):
+    pytest.importorskip('numpy')
+    keys = [int(key) for key in random_keys(100, 12345)]
+    monkeypatch.setattr(sequence, 'numpy', None)
+    assert random_keys(100, 12345) == keys
+
+
+@pytest.mark.parametrize('n', [0, 1, 2, 1000])
+def test_permutation_is_a_fixed_permutation_of_the_seed(n):
+    order = permutation(n, 42)
+    assert sorted(order) == list(range(n))
+    assert permutation(n, 42) == order
+    if n > 2:
+        assert permutation(n, 43) != order
+
+
+def test_permutation_keeps_an_array_seed():
+    seed = array('I', [1, 0])
+    assert permutation(2, seed) is seed
+
+
+@pytest.mark.parametrize('seed', [7, array('I', [3, 0, 2, 1])])
+def test_unshuffle_order_undoes_shuffle_order(seed):
+    order = array('I', [1, 0])
+    shuffled = shuffle_order(order, seed, 2, 6)
+    assert sorted(shuffled) == list(range(6))
+    assert shuffled[:2] == order
+    assert shuffled != array('I', [1, 0, 2, 3, 4, 5])
+    assert unshuffle_order(shuffled, seed, 2, 6) == array('I', [1, 0, 2, 3, 4, 5])
+
+
+def test_inverse_permutation():
+    order = permutation(50, 3)
+    inverse = inverse_permutation(order)
+    assert all(inverse[position] == i for i, position in enumerate(order))
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+from poseviewer.__main__ import main
+from poseviewer.settingscache import SettingsCache, settings_file_path, settings_sibling
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / 'config'))
+    monkeypatch.setenv('APPDATA', str(tmp_path / 'config'))
+    return tmp_path / 'config'
+
+
+def test_siblings_are_next_to_the_settings_file(config_dir):
+    assert settings_file_path() == os.path.join(str(config_dir), 'Mare5', 'Poseviewer.ini')
+    assert settings_sibling('-library.db') == os.path.join(str(config_dir), 'Mare5', 'Poseviewer-library.db')
+
+
+def test_scan_command_runs_without_qt(config_dir, tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'PySide', None)  # importing it fails
+    (tmp_path / 'images').mkdir()
+    (tmp_path / 'images' / 'a.png').write_bytes(b'')
+    main(['scan', str(tmp_path / 'images')])
+    assert os.path.exists(settings_sibling('-library.db'))
+
+
+def test_changes_are_collected_until_taken():
+    changes = []
+    cache = SettingsCache({'a/x': 1, 'a/y': [1, 2], 'b': 'true'}, on_change=changes.append)
+    assert cache.get_bool('b') and cache.get_list('a/y') == [1, 2]
+    cache.replace_group('a', {'z': 3})
+    assert sorted(cache.child_keys('a')) == ['z']
+    assert changes == [{'a/x': None, 'a/y': None, 'a/z': 3}]
+    assert cache.take_changes() == ({'a/z': 3}, ['a/x', 'a/y'])
+    assert not cache.dirty
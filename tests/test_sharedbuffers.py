@@ -0,0 +1,53 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from poseviewer.sharedbuffers import BufferPool, write_buffer
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = BufferPool(budget=4 * BufferPool.GRANULARITY, directory=str(tmp_path))
+    yield pool
+    pool.close()
+
+
+def test_worker_processes_write_into_the_buffer(pool):
+    buffer = pool.acquire(10)
+    with ProcessPoolExecutor(max_workers=1) as processes:
+        processes.submit(write_buffer, buffer.path, b'0123456789').result()
+    assert bytes(buffer.view(10)) == b'0123456789'
+
+
+def test_released_buffers_are_reused(pool):
+    buffer = pool.acquire(100)
+    pool.release(buffer)
+    assert pool.acquire(50) is buffer
+    assert pool.acquire(50) is not buffer
+    pool.release(buffer)
+    assert pool.acquire(3 * BufferPool.GRANULARITY) is not buffer  # too small
+
+
+def test_leased_buffers_come_back_once_not_in_use(pool):
+    buffer = pool.acquire(100)
+    in_use = [True]
+    pool.lease(buffer, lambda: in_use[0])
+    assert pool.acquire(100) is not buffer
+    assert pool.leased() == 1
+    in_use[0] = False
+    assert pool.leased() == 0
+    assert pool.acquire(100) is buffer
+
+
+def test_free_buffers_over_the_budget_are_deleted(pool):
+    buffers = [pool.acquire(BufferPool.GRANULARITY) for i in range(6)]
+    assert pool.bytes == 6 * BufferPool.GRANULARITY
+    view = buffers[0].view(1)  # still read, so it can't be deleted yet
+    for buffer in buffers:
+        pool.release(buffer)
+    assert pool.bytes == 4 * BufferPool.GRANULARITY
+    assert os.path.exists(buffers[0].path) and not os.path.exists(buffers[1].path)
+    del view
+    pool.close()
+    assert not os.path.exists(pool.directory)
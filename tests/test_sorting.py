@@ -0,0 +1,101 @@
+import os
+from array import array
+
+import pytest
+
+from poseviewer.imagemetadata import ImageMetadata
+from poseviewer.sequence import CompactSequence
+from poseviewer.sorting import SequenceSorter, natural_keys, NAME, FOLDER, MODIFIED, SIZE, DIMENSIONS
+
+
+def sorted_paths(sorter, order):
+    return [sorter.base[position] for position in order]
+
+
+def test_natural_keys_sort_numbers_by_value_and_ignore_case():
+    names = [b'img10.png', b'IMG2.png', b'img1.png', b'a.png']
+    keys = natural_keys(names)
+    assert [names[i] for i in sorted(range(len(names)), key=keys.__getitem__)] == \
+        [b'a.png', b'img1.png', b'IMG2.png', b'img10.png']
+
+
+def test_sort_by_name():
+    sorter = SequenceSorter(NAME)
+    sorter.set_sequence(CompactSequence(['/b/x10.png', '/a/x2.png', '/c/x1.png']))
+    assert sorted_paths(sorter, sorter.sort()) == ['/c/x1.png', '/a/x2.png', '/b/x10.png']
+
+
+def test_sort_by_folder_puts_subfolders_right_after_their_parent():
+    sorter = SequenceSorter(FOLDER)
+    sorter.set_sequence(CompactSequence(['/a b/1.png', '/a/b/1.png', '/a/2.png', '/a/1.png']))
+    assert sorted_paths(sorter, sorter.sort()) == ['/a/1.png', '/a/2.png', '/a/b/1.png', '/a b/1.png']
+
+
+@pytest.mark.parametrize('kind', [NAME, FOLDER])
+def test_insert_matches_a_full_sort(kind):
+    base = CompactSequence('/dir{}/img{}.png'.format(i % 3, (i * 7) % 40) for i in range(40))
+    sorter = SequenceSorter(kind)
+    sorter.set_sequence(base)
+    order = sorter.sort()
+    for i in range(40, 100):
+        base.append('/dir{}/img{}.png'.format(i % 4, (i * 7) % 100))
+    order, points = sorter.insert(order, range(40, 100))
+    assert points == sorted(points)
+    assert sorted_paths(sorter, order) == sorted_paths(sorter, sorter.sort())
+
+
+def test_sort_by_dimensions_puts_unknown_images_last():
+    metadata = {'/a.png': ImageMetadata(10, 10, 'png', 1, 1), '/b.png': ImageMetadata(2, 3, 'png', 1, 1)}
+    sorter = SequenceSorter(DIMENSIONS, metadata=metadata.get)
+    sorter.set_sequence(CompactSequence(['/unknown.png', '/a.png', '/b.png']))
+    assert sorted_paths(sorter, sorter.sort()) == ['/b.png', '/a.png', '/unknown.png']
+
+
+def test_stat_keys_come_from_the_stat_function_or_the_file(tmp_path):
+    paths = []
+    for name, size in (('a.png', 30), ('b.png', 10), ('c.png', 20)):
+        path = tmp_path / name
+        path.write_bytes(b'x' * size)
+        paths.append(str(path))
+    known = {paths[2]: (5, 0.0)}
+    sorter = SequenceSorter(SIZE, stat=known.get)
+    sorter.set_sequence(CompactSequence(paths))
+    assert sorted_paths(sorter, sorter.sort()) == [paths[2], paths[1], paths[0]]
+
+
+def test_keys_read_in_a_worker_are_kept(tmp_path):
+    paths = []
+    for i, mtime in enumerate((300, 100, 200)):
+        path = tmp_path / '{}.png'.format(i)
+        path.write_bytes(b'')
+        os.utime(str(path), (mtime, mtime))
+        paths.append(str(path))
+    base = CompactSequence(paths)
+    sorter = SequenceSorter(MODIFIED)
+    sorter.set_sequence(base)
+    assert sorter.missing_keys() == (0, 3)
+    keys = sorter.read_keys(base, MODIFIED, 0, 3)
+    assert keys == array('d', [300, 100, 200])
+
+    sorter.add_keys(CompactSequence(), MODIFIED, 0, keys)  # for another sequence
+    assert sorter.missing_keys() == (0, 3)
+    sorter.add_keys(base, MODIFIED, 0, keys)
+    assert sorter.missing_keys() is None
+    sorter.stat = lambda path: pytest.fail("sorted without the keys that were read")
+    assert list(sorter.sort()) == [1, 2, 0]
+
+    base.append(paths[0])
+    assert sorter.missing_keys() == (3, 4)
+    sorter.set_kind(NAME)
+    assert sorter.missing_keys() is None
+
+
+def test_rebase_keeps_the_keys_of_the_remaining_images():
+    base = CompactSequence(['/c.png', '/a.png', '/b.png'])
+    sorter = SequenceSorter(SIZE, stat=lambda path: (ord(path[1]), 0.0))
+    sorter.set_sequence(base)
+    sorter.sort()
+    sorter.stat = lambda path: None
+    sorter.rebase(CompactSequence(['/b.png', '/c.png']), [2, 0])
+    assert sorter.missing_keys() is None
+    assert sorted_paths(sorter, sorter.sort()) == ['/b.png', '/c.png']
@@ -0,0 +1,106 @@
+from array import array
+
+import pytest
+
+from poseviewer.sequence import CompactSequence, PermutedSequence
+from poseviewer.tags import QueryError, TagStore, parse_query
+
+
+@pytest.mark.parametrize('text, tree', [
+    ('hands', ('tag', 'hands')),
+    ('hands feet', ('and', ('tag', 'hands'), ('tag', 'feet'))),
+    ('hands and feet', ('and', ('tag', 'hands'), ('tag', 'feet'))),
+    ('a OR b c', ('or', ('tag', 'a'), ('and', ('tag', 'b'), ('tag', 'c')))),
+    ('NOT a b', ('and', ('not', ('tag', 'a')), ('tag', 'b'))),
+    ('not not a', ('not', ('not', ('tag', 'a')))),
+    ('hands AND (foreshortening OR "from above") NOT starred',
+     ('and', ('and', ('tag', 'hands'), ('or', ('tag', 'foreshortening'), ('tag', 'from above'))),
+      ('not', ('starred',)))),
+    ('Collection:Warmup note:gesture', ('and', ('collection', 'Warmup'), ('note', 'gesture'))),
+    ('"note:long pose"', ('note', 'long pose')),
+    ('collection:', ('tag', 'collection:')),
+    ('"or"', ('tag', 'or')),
+])
+def test_parse_query(text, tree):
+    assert parse_query(text) == tree
+
+
+@pytest.mark.parametrize('text', ['', '   ', '(a', 'a)', 'a OR', 'NOT', '()', 'a AND OR b'])
+def test_parse_query_errors(text):
+    with pytest.raises(QueryError):
+        parse_query(text)
+
+
+def test_tags_are_case_insensitive_and_untagged(tmp_path):
+    store = TagStore(str(tmp_path / 'tags.db'))
+    store.tag(['/a.png', '/b.png'], ['Hands', 'feet'])
+    store.tag(['/a.png'], ['hands'])
+    assert store.tag_names() == ['feet', 'Hands']
+    assert store.tags_of('/a.png') == ['feet', 'Hands']
+    store.untag(['/a.png', '/missing.png'], ['HANDS', 'missing'])
+    assert store.tags_of('/a.png') == ['feet']
+    assert store.tags_of('/missing.png') == []
+
+
+def test_everything_persists(tmp_path):
+    db_path = str(tmp_path / 'sub' / 'tags.db')
+    store = TagStore(db_path)
+    store.tag(['/a.png', '/b.png'], ['cat'])
+    store.untag(['/b.png'], ['cat'])
+    store.add_to_collection('warmup', ['/c.png', '/a.png', '/c.png'])
+    store.add_to_collection('warmup', ['/b.png'])
+    store.remove_from_collection('warmup', ['/a.png'])
+    store.set_note('/a.png', 'hi')
+    store.set_note('/b.png', 'gone')
+    store.set_note('/b.png', '')
+    store.flush()
+
+    reopened = TagStore(db_path)
+    assert reopened.tags_of('/a.png') == ['cat']
+    assert reopened.tags_of('/b.png') == []
+    assert reopened.collection_names() == ['warmup']
+    assert reopened.collection('warmup') == ['/c.png', '/b.png']
+    assert reopened.collection('missing') == []
+    assert reopened.note('/a.png') == 'hi'
+    assert reopened.note('/b.png') == ''
+
+
+def library(tmp_path):
+    store = TagStore(str(tmp_path / 'tags.db'), starred=lambda: ['/c.png'])
+    store.tag(['/a.png', '/b.png'], ['hands'])
+    store.tag(['/b.png', '/c.png'], ['feet'])
+    store.add_to_collection('set', ['/c.png'])
+    store.set_note('/a.png', 'Gesture, 30s')
+    return store
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('hands', ['/a.png', '/b.png']),
+    ('hands feet', ['/b.png']),
+    ('hands OR collection:set', ['/a.png', '/b.png', '/c.png']),
+    ('NOT hands', ['/c.png']),
+    ('starred OR note:gesture', ['/a.png', '/c.png']),
+    ('missing', []),
+])
+def test_query_every_image(tmp_path, text, expected):
+    assert list(library(tmp_path).query(text)) == expected
+
+
+def test_query_keeps_the_order_of_the_universe(tmp_path):
+    store = library(tmp_path)
+    universe = ['/c.png', '/untagged.png', '/b.png', '/a.png']
+    assert list(store.query('hands', universe)) == ['/b.png', '/a.png']
+    assert list(store.query('NOT feet', universe)) == ['/untagged.png', '/a.png']
+
+    base = CompactSequence(['/a.png', '/b.png', '/c.png'])
+    permuted = PermutedSequence(base, array('I', [1, 0]))
+    assert list(store.query('feet OR hands', permuted)) == ['/b.png', '/a.png', '/c.png']
+
+    store.tag(['/untagged.png'], ['hands'])  # tagged after the universe was mapped
+    base.append('/untagged.png')
+    assert list(store.query('hands', permuted)) == ['/b.png', '/a.png', '/untagged.png']
+
+
+def test_query_errors_are_raised(tmp_path):
+    with pytest.raises(QueryError):
+        library(tmp_path).query('(hands')